@@ -110,6 +110,10 @@ sass(app)
 
 
 from . import models, template_filters
+from .domain import review_counts, search, uploads
+
+from .utils.query_stats import init_app as query_stats
+query_stats(app)
 
 
 @login_manager.user_loader
@@ -3,26 +3,29 @@
 # Copyright (C) 2018-2025 rubenwardy <rw@rubenwardy>
 
 import datetime
-import os
 from typing import List
 
 import requests
-from celery import group, uuid
-from flask import redirect, url_for, flash, current_app
+from celery import uuid
+from flask import redirect, url_for, flash
 from sqlalchemy import or_, and_, not_, func
 from flask_login import current_user
 
 from app.models import PackageRelease, db, Package, PackageState, PackageScreenshot, MetaPackage, User, \
-	NotificationType, PackageUpdateConfig, License, UserRank, PackageType, Thread, AuditLogEntry, ReportAttachment, \
+	NotificationType, PackageUpdateConfig, License, UserRank, PackageType, Thread, AuditLogEntry, \
 	PackageAIDisclosure, AuditSeverity
-from app.tasks.admintasks import delete_empty_threads
+from app.domain.bulk_jobs import create_bulk_job
+from app.domain.scores import recalculate_package_scores
+from app.tasks.admintasks import delete_empty_threads, run_bulk_job, clean_unused_uploads
 from app.tasks.emails import send_pending_digests
 from app.tasks.forumtasks import import_topic_list, check_all_forum_accounts
 from app.tasks.importtasks import import_repo_screenshot, check_zip_release, check_for_updates, update_all_game_support, \
 	import_languages, check_all_zip_files
 from app.tasks.usertasks import import_github_user_ids
-from app.tasks.pkgtasks import notify_about_git_forum_links, clear_removed_packages, check_package_for_broken_links, update_file_size_bytes
+from app.tasks.pkgtasks import notify_about_git_forum_links, clear_removed_packages, check_all_packages_for_broken_links, update_file_size_bytes, \
+	create_all_screenshot_thumbnails, check_review_counts, rebuild_search_index
 from app.tasks.dumptask import create_database_dump
+from app.tasks.zipgrep import rebuild_release_index
 from app.utils.models import add_notification, get_system_user, add_audit_log
 
 actions = {}
@@ -49,39 +52,9 @@ def del_stuck_releases():
 
 @action("Delete unused uploads")
 def clean_uploads():
-	upload_dir = current_app.config['UPLOAD_DIR']
-
-	(_, _, filenames) = next(os.walk(upload_dir))
-	existing_uploads = set(filenames)
-
-	if len(existing_uploads) != 0:
-		def get_filenames_from_column(column):
-			results = db.session.query(column).filter(column.isnot(None), column != "").all()
-			return set([os.path.basename(x[0]) for x in results])
-
-		release_urls = get_filenames_from_column(PackageRelease.url)
-		screenshot_urls = get_filenames_from_column(PackageScreenshot.url)
-		attachment_urls = get_filenames_from_column(ReportAttachment.url)
-		pp_urls = get_filenames_from_column(User.profile_pic)
-
-		db_urls = release_urls.union(screenshot_urls).union(pp_urls).union(attachment_urls)
-		date = datetime.datetime.utcnow().strftime("%Y-%m-%d")
-		db_urls.add(f"/uploads/backup-{date}.zip")
-		unreachable = existing_uploads.difference(db_urls)
-
-		import sys
-		print("On Disk: ", existing_uploads, file=sys.stderr)
-		print("In DB: ", db_urls, file=sys.stderr)
-		print("Unreachable: ", unreachable, file=sys.stderr)
-
-		for filename in unreachable:
-			os.remove(os.path.join(upload_dir, filename))
-
-		flash("Deleted " + str(len(unreachable)) + " unreachable uploads", "success")
-	else:
-		flash("No downloads to create", "danger")
-
-	return redirect(url_for("admin.admin_page"))
+	task_id = uuid()
+	clean_unused_uploads.apply_async((True, ), task_id=task_id)
+	return redirect(url_for("tasks.check", id=task_id, r=url_for("admin.admin_page")))
 
 
 @action("Delete unused mod names")
@@ -97,15 +70,27 @@ def del_mod_names():
 
 @action("Recalc package scores")
 def recalc_scores():
-	for package in Package.query.all():
-		package.recalculate_score()
-
+	changed = recalculate_package_scores()
 	db.session.commit()
 
-	flash("Recalculated package scores", "success")
+	flash(f"Recalculated package scores, {changed} changed", "success")
 	return redirect(url_for("admin.admin_page"))
 
 
+@action("Check review counts")
+def do_check_review_counts():
+	task_id = uuid()
+	check_review_counts.apply_async((), task_id=task_id)
+	return redirect(url_for("tasks.check", id=task_id, r=url_for("admin.admin_page")))
+
+
+@action("Rebuild search index")
+def do_rebuild_search_index():
+	task_id = uuid()
+	rebuild_search_index.apply_async((), task_id=task_id)
+	return redirect(url_for("tasks.check", id=task_id, r=url_for("admin.admin_page")))
+
+
 @action("Import forum topic list")
 def do_import_topic_list():
 	task = import_topic_list.delay()
@@ -292,6 +277,20 @@ def detect_game_support():
 	return redirect(url_for("tasks.check", id=task_id, r=url_for("admin.admin_page")))
 
 
+@action("Create screenshot thumbnails")
+def create_thumbnails():
+	task_id = uuid()
+	create_all_screenshot_thumbnails.apply_async((), task_id=task_id)
+	return redirect(url_for("tasks.check", id=task_id, r=url_for("admin.admin_page")))
+
+
+@action("Rebuild release search index")
+def rebuild_release_search_index():
+	task_id = uuid()
+	rebuild_release_index.apply_async((), task_id=task_id)
+	return redirect(url_for("tasks.check", id=task_id, r=url_for("admin.admin_page")))
+
+
 @action("Send pending notif digests")
 def do_send_pending_digests():
 	send_pending_digests.delay()
@@ -332,6 +331,13 @@ def do_create_database_dump():
 	return redirect(url_for("tasks.check", id=task_id, r=url_for("admin.admin_page")))
 
 
+@action("Create incremental database dump")
+def do_create_incremental_database_dump():
+	task_id = uuid()
+	create_database_dump.apply_async((True, ), task_id=task_id)
+	return redirect(url_for("tasks.check", id=task_id, r=url_for("admin.admin_page")))
+
+
 @action("DANGER: Delete less popular removed packages")
 def del_less_popular_removed_packages():
 	task_id = uuid()
@@ -350,50 +356,42 @@ def del_removed_packages():
 def check_releases():
 	releases = PackageRelease.query.filter(PackageRelease.url.like("/uploads/%")).all()
 
-	tasks = []
-	for release in releases:
-		tasks.append(check_zip_release.s(release.id, release.file_path))
-
-	result = group(tasks).apply_async()
-
-	while not result.ready():
-		import time
-		time.sleep(0.1)
+	job = create_bulk_job(db.session, "Check all releases", check_zip_release,
+			[(release.id, release.file_path) for release in releases])
+	db.session.commit()
 
-	return redirect(url_for("todo.view_editor"))
+	run_bulk_job.delay(job.id, job.lease_token)
+	return redirect(url_for("tasks.check", id=job.id, r=url_for("todo.view_editor")))
 
 
-@action("DANGER: Check latest release of all packages (postReleaseCheckUpdate)")
-def reimport_packages():
-	tasks = []
+def _get_latest_releases() -> List[PackageRelease]:
+	releases = []
 	for package in Package.query.filter(Package.state == PackageState.APPROVED).all():
 		release = package.releases.first()
 		if release:
-			tasks.append(check_zip_release.s(release.id, release.file_path))
+			releases.append(release)
+
+	return releases
 
-	result = group(tasks).apply_async()
 
-	while not result.ready():
-		import time
-		time.sleep(0.1)
+@action("DANGER: Check latest release of all packages (postReleaseCheckUpdate)")
+def reimport_packages():
+	job = create_bulk_job(db.session, "Check latest release of all packages", check_zip_release,
+			[(release.id, release.file_path) for release in _get_latest_releases()])
+	db.session.commit()
 
-	return redirect(url_for("todo.view_editor"))
+	run_bulk_job.delay(job.id, job.lease_token)
+	return redirect(url_for("tasks.check", id=job.id, r=url_for("todo.view_editor")))
 
 
 @action("DANGER: Import translations")
 def reimport_translations():
-	tasks = []
-	for package in Package.query.filter(Package.state == PackageState.APPROVED).all():
-		release = package.releases.first()
-		if release:
-			tasks.append(import_languages.s(release.id, release.file_path))
-
-	result = group(tasks).apply_async()
-	while not result.ready():
-		import time
-		time.sleep(0.1)
+	job = create_bulk_job(db.session, "Import translations", import_languages,
+			[(release.id, release.file_path) for release in _get_latest_releases()])
+	db.session.commit()
 
-	return redirect(url_for("todo.view_editor"))
+	run_bulk_job.delay(job.id, job.lease_token)
+	return redirect(url_for("tasks.check", id=job.id, r=url_for("todo.view_editor")))
 
 
 @action("DANGER: Import screenshots from Git")
@@ -417,8 +415,9 @@ def do_delete_empty_threads():
 
 @action("DANGER: Check for broken links in all packages")
 def check_for_broken_links():
-	for package in Package.query.filter_by(state=PackageState.APPROVED).all():
-		check_package_for_broken_links.delay(package.id)
+	task_id = uuid()
+	check_all_packages_for_broken_links.apply_async((), task_id=task_id)
+	return redirect(url_for("tasks.check", id=task_id, r=url_for("admin.admin_page")))
 
 
 @action("DANGER: Update AI disclosure for old packages")
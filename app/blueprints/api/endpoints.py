@@ -3,39 +3,44 @@
 # Copyright (C) 2018-2025 rubenwardy <rw@rubenwardy>
 
 import math
-import os
 from typing import List
 
 import flask_sqlalchemy
-from flask import request, jsonify, current_app
+from flask import request, jsonify, current_app, Response
 from flask_babel import gettext
-from sqlalchemy import and_, or_
+from sqlalchemy import and_
 from sqlalchemy.orm import joinedload
 from sqlalchemy.sql.expression import func
 
 from app import csrf
 from app.domain.graphs import get_package_stats, get_package_stats_for_user, get_all_package_stats
+from app.domain.stats_buffer import notify_view
+from app.domain.updates import get_updates
 from app.markdown import render_markdown
 from app.models import Tag, PackageState, PackageType, Package, db, PackageRelease, Permission, \
 	LuantiRelease, APIToken, PackageScreenshot, License, ContentWarning, User, PackageReview, Thread, Collection, \
-	PackageAlias, Language, ReleaseState, PackageDailyStats
+	Language, ReleaseState
 from app.querybuilder import QueryBuilder
 from app.utils.models import is_package_page
 from app.utils.flask import get_int_or_abort, url_set_query, abs_url, get_request_date, cached, cors_allowed
 from app.utils.misc import is_yes
+from app.utils.query_stats import query_budget
+from app.utils.pagination import paginate_by_cursor
+from app.utils.reference_data import get_language_ids
 from app.utils.luanti_hypertext import html_to_luanti, package_info_as_hypertext, package_reviews_as_hypertext
 from . import bp
 from .auth import is_api_authd
 from .support import error, api_create_vcs_release, api_create_zip_release, api_create_screenshot, \
-	api_order_screenshots, api_edit_package, api_set_cover_image
+	api_order_screenshots, api_edit_package, api_set_cover_image, cursor_page_as_dict
 from app.rediscache import make_view_key, set_temp_key, has_key
+from app.tasks.zipgrep import update_release_index
 
 
 @bp.route("/api/packages/")
 @cors_allowed
-@cached(300)
+@cached(300, shared=True)
 def packages():
-	allowed_languages = set([x[0] for x in db.session.query(Language.id).all()])
+	allowed_languages = get_language_ids()
 	lang = request.accept_languages.best_match(allowed_languages)
 
 	qb = QueryBuilder(request.args, lang=lang)
@@ -76,7 +81,7 @@ def packages():
 @is_package_page
 @cors_allowed
 def package_view(package):
-	allowed_languages = set([x[0] for x in db.session.query(Language.id).all()])
+	allowed_languages = get_language_ids()
 	lang = request.accept_languages.best_match(allowed_languages)
 
 	data = package.as_dict(current_app.config["BASE_URL"], lang=lang)
@@ -94,8 +99,7 @@ def package_view_client(package: Package):
 		key = make_view_key(ip, package)
 		if not has_key(key):
 			set_temp_key(key, "true")
-			PackageDailyStats.notify_view(package, True)
-			db.session.commit()
+			notify_view(package, True)
 
 	protocol_version = request.args.get("protocol_version")
 	engine_version = request.args.get("engine_version")
@@ -104,7 +108,7 @@ def package_view_client(package: Package):
 	else:
 		version = None
 
-	allowed_languages = set([x[0] for x in db.session.query(Language.id).all()])
+	allowed_languages = get_language_ids()
 	lang = request.accept_languages.best_match(allowed_languages)
 
 	data = package.as_dict(current_app.config["BASE_URL"], version, lang=lang, screenshots_dict=True)
@@ -120,10 +124,11 @@ def package_view_client(package: Package):
 
 	data["download_size"] = package.get_download_release(version).file_size
 
+	[positive, neutral, negative] = package.get_review_summary()
 	data["reviews"] = {
-		"positive": package.reviews.filter(PackageReview.rating > 3, PackageReview.approved).count(),
-		"neutral": package.reviews.filter(PackageReview.rating == 3, PackageReview.approved).count(),
-		"negative": package.reviews.filter(PackageReview.rating < 3, PackageReview.approved).count(),
+		"positive": positive,
+		"neutral": neutral,
+		"negative": negative,
 	}
 
 	resp = jsonify(data)
@@ -277,6 +282,12 @@ def list_all_releases():
 		query = query.join(Package)
 		query = query.filter(Package.maintainers.contains(maintainer))
 
+	if "cursor" in request.args:
+		num = min(get_int_or_abort(request.args.get("n"), 100), 300)
+		pagination = paginate_by_cursor(query, "created_at", [PackageRelease.created_at, PackageRelease.id], True,
+				request.args["cursor"], num, "no_total" not in request.args)
+		return jsonify(cursor_page_as_dict(pagination, [rel.as_long_dict() for rel in pagination.items]))
+
 	return jsonify([ rel.as_long_dict() for rel in query.limit(30).all() ])
 
 
@@ -364,8 +375,7 @@ def delete_release(token: APIToken, package: Package, id: int):
 	db.session.delete(release)
 	db.session.commit()
 
-	if release.file_path and os.path.isfile(release.file_path):
-		os.remove(release.file_path)
+	update_release_index.delay(package.id)
 
 	return jsonify({"success": True})
 
@@ -438,8 +448,6 @@ def delete_screenshot(token: APIToken, package: Package, id: int):
 	db.session.delete(ss)
 	db.session.commit()
 
-	os.remove(ss.file_path)
-
 	return jsonify({ "success": True })
 
 
@@ -520,6 +528,11 @@ def list_all_reviews():
 	if q:
 		query = query.filter(PackageReview.thread.has(Thread.title.ilike(f"%{q}%")))
 
+	if "cursor" in request.args:
+		pagination = paginate_by_cursor(query, "created_at", [PackageReview.created_at, PackageReview.id], True,
+				request.args["cursor"], num, "no_total" not in request.args)
+		return jsonify(cursor_page_as_dict(pagination, [review.as_dict(True) for review in pagination.items]))
+
 	query = query.order_by(db.desc(PackageReview.created_at))
 
 	pagination: flask_sqlalchemy.Pagination = query.paginate(page=page, per_page=num)
@@ -555,7 +568,8 @@ def all_package_stats():
 
 @bp.route("/api/scores/")
 @cors_allowed
-@cached(900)
+@cached(900, shared=True)
+@query_budget(5)
 def package_scores():
 	qb = QueryBuilder(request.args)
 	query = qb.build_package_query()
@@ -566,7 +580,7 @@ def package_scores():
 
 @bp.route("/api/tags/")
 @cors_allowed
-@cached(60*60)
+@cached(60*60, shared=True)
 def tags():
 	return jsonify([tag.as_dict() for tag in Tag.query.order_by(db.asc(Tag.name)).all()])
 
@@ -588,7 +602,7 @@ def licenses():
 
 @bp.route("/api/homepage/")
 @cors_allowed
-@cached(300)
+@cached(300, shared=True)
 def homepage():
 	query = Package.query.filter_by(state=PackageState.APPROVED)
 	count = query.count()
@@ -666,8 +680,12 @@ def all_deps():
 			"optional_depends": [str(x) for x in pkg.dependencies if x.optional],
 		}
 
-	page = get_int_or_abort(request.args.get("page"), 1)
 	num = min(get_int_or_abort(request.args.get("n"), 100), 300)
+	if "cursor" in request.args:
+		pagination = qb.paginate_by_cursor(query, request.args["cursor"], num, "no_total" not in request.args)
+		return jsonify(cursor_page_as_dict(pagination, [format_pkg(pkg) for pkg in pagination.items]))
+
+	page = get_int_or_abort(request.args.get("page"), 1)
 	pagination: flask_sqlalchemy.Pagination = query.paginate(page=page, per_page=num)
 	return jsonify({
 		"page": pagination.page,
@@ -903,52 +921,11 @@ def updates():
 	else:
 		version = None
 
-	# Subquery to get the latest release for each package
-	latest_release_query = (db.session.query(
-		PackageRelease.package_id,
-		func.max(PackageRelease.id).label('max_release_id'))
-			.select_from(PackageRelease)
-			.filter(PackageRelease.state == ReleaseState.APPROVED))
-
-	if version:
-		latest_release_query = (latest_release_query
-			.filter(or_(PackageRelease.min_rel_id == None,
-				PackageRelease.min_rel_id <= version.id))
-			.filter(or_(PackageRelease.max_rel_id == None,
-				PackageRelease.max_rel_id >= version.id)))
-
-	latest_release_subquery = (
-		latest_release_query
-		.group_by(PackageRelease.package_id)
-		.subquery()
-	)
-
-	# Get package id and latest release
-	query = (db.session.query(User.username, Package.name, latest_release_subquery.c.max_release_id)
-		.select_from(Package)
-		.join(User, Package.author)
-		.join(latest_release_subquery, Package.id == latest_release_subquery.c.package_id)
-		.filter(Package.state == PackageState.APPROVED)
-		.all())
-
-	ret = {}
-	for author_username, package_name, release_id in query:
-		ret[f"{author_username}/{package_name}"] = release_id
-
-	# Get aliases
-	aliases = (db.session.query(PackageAlias.author, PackageAlias.name, User.username, Package.name)
-		.select_from(PackageAlias)
-		.join(Package, PackageAlias.package)
-		.join(User, Package.author)
-		.filter(Package.state == PackageState.APPROVED)
-		.all())
-
-	for old_author, old_name, new_author, new_name in aliases:
-		new_release = ret.get(f"{new_author}/{new_name}")
-		if new_release is not None:
-			ret[f"{old_author}/{old_name}"] = new_release
+	etag, body = get_updates(version)
 
-	return jsonify(ret)
+	resp = Response(body, mimetype="application/json")
+	resp.set_etag(etag)
+	return resp.make_conditional(request)
 
 
 @bp.route("/api/uploads/")
@@ -9,12 +9,25 @@ from app.domain.packages import do_edit_package
 from app.domain.releases import DomainError, do_create_vcs_release, do_create_zip_release
 from app.domain.screenshots import do_create_screenshot, do_order_screenshots, do_set_cover_image
 from app.models import APIToken, Package, LuantiRelease, PackageScreenshot
+from app.utils.flask import abs_url, url_set_query
+from app.utils.pagination import CursorPagination
 
 
 def error(code: int, msg: str):
 	abort(make_response(jsonify({ "success": False, "error": msg }), code))
 
 
+def cursor_page_as_dict(pagination: CursorPagination, items: list) -> dict:
+	return {
+		"per_page": pagination.per_page,
+		"total": pagination.total,
+		"urls": {
+			"next": abs_url(url_set_query(cursor=pagination.next_cursor)) if pagination.has_next else None,
+		},
+		"items": items,
+	}
+
+
 # Catches DomainErrors and aborts with JSON error
 def guard(f):
 	def ret(*args, **kwargs):
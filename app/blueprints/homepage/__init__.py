@@ -3,6 +3,7 @@
 # Copyright (C) 2018-2025 rubenwardy <rw@rubenwardy>
 
 from flask import Blueprint, render_template, redirect
+from flask_login import current_user
 from sqlalchemy import and_
 
 from app.models import Package, PackageReview, Thread, User, PackageState, db, PackageType, PackageRelease, Tags, Tag, \
@@ -46,7 +47,8 @@ def gamejam():
 def home():
 	def package_load(query):
 		return query.options(
-				load_only(Package.name, Package.title, Package.short_desc, Package.state, raiseload=True),
+				load_only(Package.name, Package.title, Package.short_desc, Package.state, Package.reviews_positive,
+						Package.reviews_neutral, Package.reviews_negative, raiseload=True),
 				subqueryload(Package.main_screenshot),
 				joinedload(Package.author).load_only(User.username, User.display_name, raiseload=True),
 				joinedload(Package.license).load_only(License.name, License.is_foss, raiseload=True),
@@ -54,7 +56,8 @@ def home():
 
 	def package_spotlight_load(query):
 		return query.options(
-				load_only(Package.name, Package.title, Package.type, Package.short_desc, Package.state, Package.cover_image_id, raiseload=True),
+				load_only(Package.name, Package.title, Package.type, Package.short_desc, Package.state, Package.cover_image_id,
+						Package.reviews_positive, Package.reviews_neutral, Package.reviews_negative, raiseload=True),
 				subqueryload(Package.main_screenshot),
 				joinedload(Package.tags),
 				joinedload(Package.content_warnings),
@@ -65,9 +68,9 @@ def home():
 
 	def review_load(query):
 		return query.options(
-			load_only(PackageReview.id, PackageReview.rating, PackageReview.created_at, PackageReview.language_id, PackageReview.approved, raiseload=True),
+			load_only(PackageReview.id, PackageReview.rating, PackageReview.created_at, PackageReview.language_id, PackageReview.approved,
+					PackageReview.votes_helpful, PackageReview.votes_unhelpful, raiseload=True),
 			joinedload(PackageReview.author).load_only(User.username, User.rank, User.email, User.display_name, User.profile_pic, User.is_active, raiseload=True),
-			joinedload(PackageReview.votes),
 			joinedload(PackageReview.language).load_only(Language.title, raiseload=True),
 			joinedload(PackageReview.thread).load_only(Thread.title, Thread.replies_count, raiseload=True).subqueryload(Thread.first_reply),
 			joinedload(PackageReview.package)
@@ -111,6 +114,7 @@ def home():
 
 	reviews = review_load(PackageReview.query.filter(PackageReview.rating > 3, PackageReview.approved == True)
 			.order_by(db.desc(PackageReview.created_at))).limit(5).all()
+	PackageReview.load_user_votes(reviews, current_user)
 
 	downloads_result = db.session.query(func.sum(Package.downloads)).one_or_none()
 	downloads = 0 if not downloads_result or not downloads_result[0] else downloads_result[0]
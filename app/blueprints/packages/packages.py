@@ -20,15 +20,17 @@ from wtforms_sqlalchemy.fields import QuerySelectField, QuerySelectMultipleField
 
 from app.domain.DomainError import DomainError
 from app.domain.packages import do_edit_package
+from app.domain.search import get_package_facets
 from app.querybuilder import QueryBuilder
 from app.rediscache import has_key, set_temp_key
 from app.tasks.importtasks import import_repo_screenshot, check_zip_release, remove_package_game_support, \
 	update_package_game_support
 from app.tasks.pkgtasks import check_package_on_submit
+from app.tasks.zipgrep import update_release_index
 from app.tasks.webhooktasks import post_discord_webhook
 
 from . import bp, get_package_tabs
-from app.models import Package, Tag, db, User, Tags, PackageState, Permission, PackageType, MetaPackage, ForumTopic, \
+from app.models import Package, Tag, db, User, PackageState, Permission, PackageType, MetaPackage, ForumTopic, \
 	Dependency, Thread, UserRank, PackageReview, PackageDevState, ContentWarning, License, AuditSeverity, \
 	PackageScreenshot, NotificationType, AuditLogEntry, PackageAlias, PackageProvides, PackageGameSupport, \
 	PackageDailyStats, Collection, ReleaseState, PackageAIDisclosure, LuantiRelease, PackageRelease
@@ -41,6 +43,7 @@ from app.utils.misc import normalize_line_endings
 from app.domain.package_approval import validate_package_for_approval, can_move_to_state
 from app.domain.game_support import game_support_set
 from app.utils.models import create_session
+from app.utils.query_stats import timed
 
 
 @bp.route("/packages/")
@@ -78,18 +81,20 @@ def list_all():
 		if qb.search and topic:
 			return redirect(topic.url)
 
-	page  = get_int_or_abort(request.args.get("page"), 1)
 	num   = min(40, get_int_or_abort(request.args.get("n"), 100))
-	query = query.paginate(page=page, per_page=num)
+	if "cursor" in request.args:
+		query = qb.paginate_by_cursor(query, request.args["cursor"], num)
+	else:
+		page  = get_int_or_abort(request.args.get("page"), 1)
+		query = query.paginate(page=page, per_page=num)
 
 	search = request.args.get("q")
 	type_name = request.args.get("type")
 
 	authors = []
 	if search:
-		authors = User.query \
-			.filter(or_(*[func.lower(User.username) == name.lower().strip() for name in search.split(" ")])) \
-			.all()
+		names = [name.lower() for name in search.split()]
+		authors = User.query.filter(func.lower(User.username).in_(names)).all()
 
 		authors = [(author.username, search.lower().replace(author.username.lower(), "")) for author in authors]
 
@@ -97,10 +102,10 @@ def list_all():
 	if qb.search and not query.has_next:
 		topics = qb.build_topic_query().all()
 
-	tags_query = db.session.query(func.count(Tags.c.tag_id), Tag) \
-		.select_from(Tag).join(Tags).join(Package).filter(Package.state==PackageState.APPROVED) \
-		.group_by(Tag.id).order_by(db.asc(Tag.title))
-	tags = qb.filter_package_query(tags_query).all()
+	with timed("facets"):
+		tag_counts = get_package_facets(qb.build_facet_query())["tags"]
+		tags = Tag.query.filter(Tag.id.in_(list(tag_counts.keys()))).order_by(db.asc(Tag.title)).all()
+		tags = [(tag_counts[tag.id], tag) for tag in tags]
 
 	selected_tags = set(qb.tags)
 
@@ -183,6 +188,8 @@ def view(package):
 	else:
 		reviews = package.reviews.filter_by(approved=True).all()
 
+	PackageReview.load_user_votes(reviews, current_user)
+
 	has_review = current_user.is_authenticated and \
 		PackageReview.query.filter_by(package=package, author=current_user).count() > 0
 
@@ -205,18 +212,15 @@ def view(package):
 			Collection.name == "favorites").count() > 0
 
 	luanti_versions = LuantiRelease.query.filter(LuantiRelease.protocol > 0).order_by(db.asc(LuantiRelease.id)).all()
-	import time
-	start = time.perf_counter()
-	latest_by_version = get_latest_releases_per_version(db.session, package.id)
-	end = time.perf_counter()
-	elapsed = f'Time taken: {(end - start):.6f} seconds'
+	with timed("latest_releases"):
+		latest_by_version = get_latest_releases_per_version(db.session, package.id)
 
 	return render_template("packages/view.html",
 			package=package, releases=releases.all(), packages_uses=packages_uses,
 			review_thread=review_thread, threads=threads.all(), reviews=reviews, validation=validation,
 			has_review=has_review, favorites_count=favorites_count, is_favorited=is_favorited,
 			public_collection_count=public_collection_count, luanti_versions=luanti_versions,
-			latest_by_version=latest_by_version, elapsed=elapsed)
+			latest_by_version=latest_by_version)
 
 
 @bp.route("/packages/<author>/<name>/shields/<type>/")
@@ -548,6 +552,7 @@ def remove(package):
 			True, package.title, package.short_desc, package.get_thumb_url(2, True, "png"))
 
 		remove_package_game_support.delay(package.id)
+		update_release_index.delay(package.id)
 
 		flash(gettext("Deleted package"), "success")
 
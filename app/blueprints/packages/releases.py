@@ -2,8 +2,6 @@
 # SPDX-License-Identifier: AGPL-3.0-or-later
 # Copyright (C) 2018-2025 rubenwardy <rw@rubenwardy>
 
-import os
-
 from flask import render_template, request, redirect, flash, url_for, abort
 from flask_babel import lazy_gettext, gettext
 from flask_login import login_required, current_user
@@ -14,10 +12,12 @@ from wtforms.validators import InputRequired, Length, Optional, Regexp
 from wtforms_sqlalchemy.fields import QuerySelectField
 
 from app.domain.releases import do_create_vcs_release, DomainError, do_create_zip_release
-from app.models import Package, db, User, PackageState, Permission, UserRank, PackageDailyStats, LuantiRelease, \
+from app.domain.stats_buffer import notify_download, notify_unique_download
+from app.models import Package, db, User, PackageState, Permission, UserRank, LuantiRelease, \
 	PackageRelease, PackageUpdateTrigger, PackageUpdateConfig, ReleaseState
 from app.rediscache import has_key, set_temp_key, make_download_key
 from app.tasks.importtasks import check_update_config
+from app.tasks.zipgrep import update_release_index
 from app.utils.models import is_package_page
 from app.utils.flask import is_user_bot
 from app.utils.misc import nonempty_or_none, normalize_line_endings
@@ -123,7 +123,7 @@ def download_release(package, id):
 		is_luanti = user_agent.startswith("Luanti") or user_agent.startswith("Minetest")
 		is_v510 = is_luanti and is_luanti_v510(request.headers.get("User-Agent"))
 		reason = request.args.get("reason")
-		PackageDailyStats.notify_download(package, is_luanti, is_v510, reason)
+		notify_download(package, is_luanti, is_v510, reason)
 
 		key = make_download_key(ip, release.package)
 		if not has_key(key):
@@ -135,17 +135,7 @@ def download_release(package, id):
 			elif reason == "dependency" or reason == "update":
 				bonus = 0.5
 
-			PackageRelease.query.filter_by(id=release.id).update({
-					"downloads": PackageRelease.downloads + 1
-				})
-
-			Package.query.filter_by(id=package.id).update({
-					"downloads": Package.downloads + 1,
-					"score_downloads": Package.score_downloads + bonus,
-					"score": Package.score + bonus
-				})
-
-		db.session.commit()
+			notify_unique_download(package, release, bonus)
 
 	return redirect(release.url)
 
@@ -201,6 +191,10 @@ def edit_release(package, id):
 				release.state = ReleaseState.UNAPPROVED
 
 		db.session.commit()
+
+		if canApprove:
+			update_release_index.delay(package.id)
+
 		return redirect(package.get_url("packages.list_releases"))
 
 	return render_template("packages/release_edit.html", package=package, release=release, form=form)
@@ -260,8 +254,7 @@ def delete_release(package, id):
 	db.session.delete(release)
 	db.session.commit()
 
-	if release.file_path and os.path.isfile(release.file_path):
-		os.remove(release.file_path)
+	update_release_index.delay(package.id)
 
 	return redirect(package.get_url("packages.view"))
 
@@ -20,16 +20,24 @@ from app.utils.models import is_package_page, add_notification, add_audit_log
 from app.utils.flask import get_int_or_abort, is_safe_url, has_blocked_domains, should_return_json
 from app.utils.user import rank_required
 from app.utils.misc import is_yes, normalize_line_endings
+from app.utils.pagination import paginate_by_cursor
 from app.markdown import render_markdown, get_links
 from . import bp
 
 
 @bp.route("/reviews/")
 def list_reviews():
-	page = get_int_or_abort(request.args.get("page"), 1)
 	num = min(40, get_int_or_abort(request.args.get("n"), 100))
 
-	pagination = PackageReview.query.filter_by(approved=True).order_by(db.desc(PackageReview.created_at)).paginate(page=page, per_page=num)
+	query = PackageReview.query.filter_by(approved=True)
+	if "cursor" in request.args:
+		pagination = paginate_by_cursor(query, "created_at", [PackageReview.created_at, PackageReview.id], True,
+				request.args["cursor"], num)
+	else:
+		page = get_int_or_abort(request.args.get("page"), 1)
+		pagination = query.order_by(db.desc(PackageReview.created_at)).paginate(page=page, per_page=num)
+
+	PackageReview.load_user_votes(pagination.items, current_user)
 	return render_template("packages/reviews_list.html", pagination=pagination, reviews=pagination.items)
 
 
@@ -246,7 +254,6 @@ def handle_review_vote(package: Package, review_id: int) -> typing.Optional[str]
 	else:
 		vote.is_positive = is_positive
 
-	review.update_score()
 	db.session.commit()
 
 
@@ -1,7 +1,6 @@
 # ContentDB
 # SPDX-License-Identifier: AGPL-3.0-or-later
 # Copyright (C) 2018-2025 rubenwardy <rw@rubenwardy>
-import os
 
 from flask import render_template, request, redirect, flash, url_for, abort
 from flask_babel import lazy_gettext, gettext
@@ -133,6 +132,4 @@ def delete_screenshot(package, id):
 	db.session.delete(screenshot)
 	db.session.commit()
 
-	os.remove(screenshot.file_path)
-
 	return redirect(package.get_url("packages.screenshots"))
@@ -6,7 +6,8 @@ from flask import Blueprint, jsonify, url_for, request, redirect, render_templat
 from flask_login import login_required, current_user
 
 from app import csrf
-from app.models import UserRank
+from app.domain.bulk_jobs import get_bulk_job_status
+from app.models import UserRank, BulkJob, db
 from app.tasks import celery
 from app.tasks.importtasks import get_meta
 from app.utils.flask import should_return_json
@@ -27,8 +28,27 @@ def start_getmeta():
 	})
 
 
+def check_bulk_job(job: BulkJob):
+	info = get_bulk_job_status(job)
+	if info["status"] == "SUCCESS" and not (current_user.is_authenticated and current_user.rank.at_least(UserRank.ADMIN)):
+		del info["result"]["errors"]
+
+	if should_return_json():
+		return jsonify(info)
+
+	r = request.args.get("r")
+	if r is not None and info["status"] == "SUCCESS" and info["result"]["failed"] == 0:
+		return redirect(r)
+	else:
+		return render_template("tasks/view.html", info=info)
+
+
 @bp.route("/tasks/<id>/")
 def check(id):
+	job = db.session.get(BulkJob, id)
+	if job is not None:
+		return check_bulk_job(job)
+
 	result = celery.AsyncResult(id)
 	status = result.status
 	traceback = result.traceback
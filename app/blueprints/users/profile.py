@@ -2,18 +2,20 @@
 # SPDX-License-Identifier: AGPL-3.0-or-later
 # Copyright (C) 2018-2025 rubenwardy <rw@rubenwardy>
 
-import math
 from typing import Optional, Tuple, List
 
 from flask import redirect, url_for, abort, render_template, request
 from flask_babel import gettext
 from flask_login import current_user, login_required
-from sqlalchemy import func, text, and_
+from sqlalchemy import func, and_
 from sqlalchemy.sql.functions import coalesce
 
-from app.models import User, db, Package, PackageReview, PackageState, PackageType, UserRank, Collection, Permission
+from app.domain.user_rankings import get_ranking_for_user
+from app.models import User, db, Package, PackageState, PackageType, UserRank, Collection, Permission, PackageReview
+from app.rediscache import claim_user_rankings_rebuild
 from app.utils.flask import get_daterange_options
 from app.tasks.forumtasks import check_forum_account
+from app.tasks.usertasks import update_user_medal_rankings
 
 from . import bp
 
@@ -91,24 +93,21 @@ def get_user_medals(user: User) -> Tuple[List[Medal], List[Medal]]:
 	# REVIEWS
 	#
 
-	users_by_reviews = db.session.query(User.username, func.sum(PackageReview.score).label("karma")) \
-		.select_from(User).join(PackageReview) \
-		.group_by(User.username).order_by(text("karma DESC")).all()
-	try:
-		review_boundary = users_by_reviews[math.floor(len(users_by_reviews) * 0.25)][1] + 1
-	except IndexError:
-		review_boundary = None
-	usernames_by_reviews = [username for username, _ in users_by_reviews]
+	entry = get_ranking_for_user(user)
+	if entry is None:
+		# Medals are hidden until the task has computed the rankings
+		if claim_user_rankings_rebuild():
+			update_user_medal_rankings.delay()
+		return [], []
 
-	review_idx = None
+	meta, ranking = entry
+	review_boundary = meta["review_boundary"]
+
+	review_idx = ranking.get("review_place")
 	review_percent = None
-	review_karma = 0
-	try:
-		review_idx = usernames_by_reviews.index(user.username)
-		review_percent = round(100 * review_idx / len(users_by_reviews), 1)
-		review_karma = max(users_by_reviews[review_idx][1], 0)
-	except ValueError:
-		pass
+	review_karma = ranking.get("review_karma", 0)
+	if review_idx is not None:
+		review_percent = round(100 * review_idx / meta["reviewers"], 1)
 
 	if review_percent is not None and review_percent < 25:
 		if review_idx == 0:
@@ -140,26 +139,9 @@ def get_user_medals(user: User) -> Tuple[List[Medal], List[Medal]]:
 	#
 	# TOP PACKAGES
 	#
-	all_package_ranks = db.session.query(
-			Package.type,
-			Package.author_id,
-			func.rank().over(
-					order_by=db.desc(Package.score),
-					partition_by=Package.type) \
-				.label("rank")).order_by(db.asc(text("rank"))) \
-		.filter_by(state=PackageState.APPROVED).subquery()
-
-	user_package_ranks = db.session.query(all_package_ranks) \
-		.filter_by(author_id=user.id) \
-		.filter(text("rank <= 30")) \
-		.all()
-
-	user_package_ranks = next(
-			(x for x in user_package_ranks if x[0] == PackageType.MOD or x[2] <= 10),
-			None)
-	if user_package_ranks:
-		top_rank = user_package_ranks[2]
-		top_type = PackageType.coerce(user_package_ranks[0])
+	if "package_rank" in ranking:
+		top_rank = ranking["package_rank"]
+		top_type = PackageType.coerce(ranking["package_type"])
 		title = top_type.get_top_ordinal(top_rank)
 		if top_type == PackageType.MOD:
 			icon = "fa-box"
@@ -175,11 +157,7 @@ def get_user_medals(user: User) -> Tuple[List[Medal], List[Medal]]:
 	#
 	# DOWNLOADS
 	#
-	total_downloads = db.session.query(func.sum(Package.downloads)) \
-		.select_from(User) \
-		.join(User.packages) \
-		.filter(User.id == user.id,
-			Package.state == PackageState.APPROVED).scalar()
+	total_downloads = ranking.get("downloads")
 	if total_downloads is None:
 		pass
 	elif total_downloads < 50000:
@@ -228,6 +206,7 @@ def profile(username):
 			Collection.pinned == True, Collection.packages.any()).all()
 
 	reviews = [x for x in user.reviews if x.check_perm(current_user, Permission.SEE_REVIEW)]
+	PackageReview.load_user_votes(reviews, current_user)
 
 	unlocked, locked = get_user_medals(user)
 	# Process GET or invalid POST
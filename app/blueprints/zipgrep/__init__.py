@@ -3,7 +3,7 @@
 # Copyright (C) 2018-2025 rubenwardy <rw@rubenwardy>
 
 from celery import uuid
-from flask import Blueprint, render_template, redirect, request, abort, url_for
+from flask import Blueprint, render_template, redirect, request, url_for
 from flask_babel import lazy_gettext
 from flask_wtf import FlaskForm
 from wtforms import StringField, BooleanField, SubmitField, SelectMultipleField
@@ -19,7 +19,8 @@ from app.tasks.zipgrep import search_in_releases
 
 
 class SearchForm(FlaskForm):
-	query = StringField(lazy_gettext("Text to find (regex)"), [InputRequired(), Length(1, 100)])
+	query = StringField(lazy_gettext("Text to find"), [InputRequired(), Length(1, 100)])
+	literal = BooleanField(lazy_gettext("Match text literally, rather than as a regex"), default=False)
 	file_filter = StringField(lazy_gettext("File filter"), [InputRequired(), Length(1, 100)], default="*.lua")
 	type = SelectMultipleField(lazy_gettext("Type"), [Optional()],
 			choices=PackageType.choices(), coerce=PackageType.coerce)
@@ -32,9 +33,8 @@ def zipgrep_search():
 	form = SearchForm(request.form)
 	if form.validate_on_submit():
 		task_id = uuid()
-		search_in_releases.apply_async((form.query.data, form.file_filter.data, [x.name for x in form.type.data]), task_id=task_id)
-		result_url = url_for("zipgrep.view_results", id=task_id)
-		return redirect(url_for("tasks.check", id=task_id, r=result_url))
+		search_in_releases.apply_async((form.query.data, form.file_filter.data, [x.name for x in form.type.data], form.literal.data), task_id=task_id)
+		return redirect(url_for("zipgrep.view_results", id=task_id))
 
 	return render_template("zipgrep/search.html", form=form)
 
@@ -42,17 +42,19 @@ def zipgrep_search():
 @bp.route("/zipgrep/<id>/")
 def view_results(id):
 	result = celery.AsyncResult(id)
-	if result.status == "PENDING":
-		abort(404)
-
-	if result.status != "SUCCESS" or isinstance(result.result, Exception):
+	if result.status == "FAILURE" or result.status == "REVOKED" or isinstance(result.result, Exception):
 		result_url = url_for("zipgrep.view_results", id=id)
 		return redirect(url_for("tasks.check", id=id, r=result_url))
 
-	matches = result.result["matches"]
+	# While the search is running, show the matches found so far
+	running = result.status != "SUCCESS"
+	info = result.info if isinstance(result.info, dict) else {}
+
+	matches = info.get("matches", [])
 	for match in matches:
 		match["package"] = Package.query.filter(
 				Package.name == match["package"]["name"],
 				Package.author.has(username=match["package"]["author"])).one()
 
-	return render_template("zipgrep/view_results.html", query=result.result["query"], matches=matches)
+	return render_template("zipgrep/view_results.html", id=id, running=running, query=info.get("query"),
+			matches=matches)
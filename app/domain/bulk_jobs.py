@@ -0,0 +1,267 @@
+# ContentDB
+# SPDX-License-Identifier: AGPL-3.0-or-later
+# Copyright (C) 2018-2025 rubenwardy <rw@rubenwardy>
+
+import datetime
+import typing
+
+from celery import uuid
+from sqlalchemy import func, insert, or_
+from sqlalchemy.orm import Session
+
+from app.models import BulkJob, BulkJobItem, BulkJobItemState
+from app.tasks import celery
+from app.utils.misc import truncate_string
+
+
+# Bulk jobs run a Celery task for many items, such as checking every release.
+#
+# The job and its items are stored in the database. The job is advanced by the short
+# `app.tasks.admintasks.run_bulk_job` task, which collects the results of running items, starts
+# pending items up to the job's concurrency, and then schedules itself to run again. As all state
+# is in the database, a job continues after workers restart: items whose task was lost are retried,
+# and `resume_bulk_jobs` starts a new chain of `run_bulk_job` tasks for jobs whose lease has expired.
+#
+# Each item's task also has callbacks that advance the job as soon as it finishes, so that throughput
+# isn't limited to `concurrency` items per run of `run_bulk_job`. The chain is still needed for items
+# whose callbacks are lost, and to notice lost tasks.
+#
+# The job's lease token is passed along its chain, and each run renews the lease. A chain stops when
+# the token no longer matches, so a chain that was only delayed in the queue stops once it has been
+# replaced, rather than advancing the job alongside the new one.
+#
+# The job's id is also used as a task id, so that its progress and summary can be viewed using
+# the `tasks.check` page.
+
+
+DEFAULT_CONCURRENCY = 8
+
+# Number of items to insert per statement when creating a job
+CHUNK_SIZE = 1000
+
+# How long after being sent a task can be running before its worker is assumed to have been lost
+LOST_TASK_TIMEOUT = datetime.timedelta(hours=1)
+
+# How long a task can be unknown to the result backend, which includes waiting in the queue,
+# before its message is assumed to have been lost
+LOST_QUEUED_TASK_TIMEOUT = datetime.timedelta(days=1)
+
+MAX_ATTEMPTS = 2
+
+# Tasks called when an item's task succeeds or fails, see `app.tasks.admintasks`
+ITEM_SUCCEEDED_TASK = "app.tasks.admintasks.bulk_job_item_succeeded"
+ITEM_FAILED_TASK = "app.tasks.admintasks.bulk_job_item_failed"
+
+# A job whose lease hasn't been renewed for this long is assumed to have lost its `run_bulk_job` chain
+LEASE_TIMEOUT = datetime.timedelta(minutes=10)
+
+
+def create_bulk_job(session: Session, title: str, task, args_list: typing.Iterable[typing.Sequence],
+		concurrency: int = DEFAULT_CONCURRENCY) -> BulkJob:
+	"""
+	Creates a job that calls `task` once for each set of arguments in args_list. Arguments must be JSON serializable.
+
+	The job doesn't start until `run_bulk_job` is called with its id and lease token, after committing.
+	"""
+	job = BulkJob()
+	job.id = uuid()
+	job.title = truncate_string(title, 100)
+	job.task_name = task.name
+	job.concurrency = concurrency
+	job.lease_token = uuid()
+	job.lease_expires_at = datetime.datetime.utcnow() + LEASE_TIMEOUT
+	session.add(job)
+	session.flush()
+
+	chunk = []
+	total = 0
+	for args in args_list:
+		chunk.append({ "job_id": job.id, "args": list(args), "state": BulkJobItemState.PENDING })
+		if len(chunk) >= CHUNK_SIZE:
+			session.execute(insert(BulkJobItem), chunk)
+			total += len(chunk)
+			chunk = []
+
+	if chunk:
+		session.execute(insert(BulkJobItem), chunk)
+		total += len(chunk)
+
+	job.total = total
+	if total == 0:
+		job.finished_at = datetime.datetime.utcnow()
+
+	return job
+
+
+def _collect_result(item: BulkJobItem, now: datetime.datetime) -> bool:
+	"""
+	Updates a running item from its task's result. Returns true if the task was lost and should be retried.
+	"""
+	result = celery.AsyncResult(item.task_id)
+	status = result.status
+	if status == "SUCCESS":
+		item.state = BulkJobItemState.SUCCESS
+	elif status in ["FAILURE", "REVOKED"]:
+		item.state = BulkJobItemState.FAILURE
+		item.error = str(result.result)
+	elif (status == "STARTED" and item.started_at < now - LOST_TASK_TIMEOUT) or \
+			(status == "PENDING" and item.started_at < now - LOST_QUEUED_TASK_TIMEOUT):
+		if item.attempts < MAX_ATTEMPTS:
+			return True
+
+		item.state = BulkJobItemState.FAILURE
+		item.error = "Task was lost"
+	else:
+		return False
+
+	# Results are stored in the job, so the result backend no longer needs them
+	result.forget()
+	return False
+
+
+def advance_bulk_job(session: Session, job_id: str, lease_token: typing.Optional[str]) -> typing.Optional[BulkJob]:
+	"""
+	Collects results of running items and starts pending items, then commits.
+
+	Returns the job, or None if the job doesn't exist, is being advanced by another worker,
+	or its lease is held by another chain.
+	"""
+	job = session.query(BulkJob).filter_by(id=job_id).with_for_update(skip_locked=True).one_or_none()
+	if job is None or job.lease_token != lease_token:
+		session.rollback()
+		return None
+
+	if job.is_finished:
+		session.rollback()
+		return job
+
+	now = datetime.datetime.utcnow()
+	job.lease_expires_at = now + LEASE_TIMEOUT
+
+	to_start = []
+	running = job.items.filter_by(state=BulkJobItemState.RUNNING).all()
+	for item in running:
+		if _collect_result(item, now):
+			to_start.append(item)
+
+	# Includes lost items that will be retried
+	free = job.concurrency - len([x for x in running if x.state == BulkJobItemState.RUNNING])
+	if free > 0:
+		to_start.extend(job.items.filter_by(state=BulkJobItemState.PENDING)
+				.order_by(BulkJobItem.id).limit(free).all())
+
+	to_send = []
+	for item in to_start:
+		item.state = BulkJobItemState.RUNNING
+		item.task_id = uuid()
+		item.started_at = now
+		item.attempts += 1
+		to_send.append((item.task_id, item.args))
+
+	counts = dict(session.query(BulkJobItem.state, func.count(BulkJobItem.id))
+			.filter(BulkJobItem.job_id == job.id)
+			.group_by(BulkJobItem.state).all())
+	job.succeeded = counts.get(BulkJobItemState.SUCCESS, 0)
+	job.failed = counts.get(BulkJobItemState.FAILURE, 0)
+	job.updated_at = now
+	if job.succeeded + job.failed == job.total:
+		job.finished_at = now
+
+	session.commit()
+
+	# Tasks are sent after committing, so that their items are never pending when they finish.
+	# If sending fails, the unsent items are made pending again.
+	sent = 0
+	try:
+		for task_id, args in to_send:
+			celery.send_task(job.task_name, args=args, task_id=task_id,
+					link=celery.signature(ITEM_SUCCEEDED_TASK, args=(job.id, task_id), immutable=True),
+					link_error=celery.signature(ITEM_FAILED_TASK, args=(job.id,), immutable=True))
+			sent += 1
+	except Exception:
+		session.query(BulkJobItem) \
+			.filter(BulkJobItem.task_id.in_([task_id for task_id, _ in to_send[sent:]])) \
+			.update({
+				"state": BulkJobItemState.PENDING,
+				"task_id": None,
+				"started_at": None,
+				"attempts": BulkJobItem.attempts - 1,
+			}, synchronize_session=False)
+		session.commit()
+		raise
+
+	return job
+
+
+def mark_bulk_job_item_succeeded(session: Session, job_id: str, task_id: str):
+	"""
+	Marks a running item as succeeded, then commits. Called by the item's task's callback, which runs
+	before the task's result is stored, so the result can't be collected as usual.
+	"""
+	session.query(BulkJobItem) \
+		.filter_by(job_id=job_id, task_id=task_id, state=BulkJobItemState.RUNNING) \
+		.update({ "state": BulkJobItemState.SUCCESS }, synchronize_session=False)
+	session.commit()
+
+
+def advance_bulk_job_now(session: Session, job_id: str) -> typing.Optional[BulkJob]:
+	"""
+	Advances a job outside of its `run_bulk_job` chain, such as when an item finishes. Doesn't wait if
+	the job is already being advanced, as the chain will then pick up any changes.
+	"""
+	lease_token = session.query(BulkJob.lease_token).filter_by(id=job_id).scalar()
+	if lease_token is None:
+		return None
+
+	return advance_bulk_job(session, job_id, lease_token)
+
+
+def take_expired_bulk_jobs(session: Session) -> list[tuple[str, str]]:
+	"""
+	Gives unfinished jobs whose lease has expired a new lease, then commits.
+	Returns (job id, lease token) for each job, to start a new chain with.
+	"""
+	now = datetime.datetime.utcnow()
+	jobs = (session.query(BulkJob)
+			.filter(BulkJob.finished_at.is_(None),
+					or_(BulkJob.lease_expires_at.is_(None), BulkJob.lease_expires_at < now))
+			.with_for_update(skip_locked=True)
+			.all())
+
+	ret = []
+	for job in jobs:
+		job.lease_token = uuid()
+		job.lease_expires_at = now + LEASE_TIMEOUT
+		ret.append((job.id, job.lease_token))
+
+	session.commit()
+	return ret
+
+
+def get_bulk_job_status(job: BulkJob, max_errors: int = 50) -> dict:
+	"""
+	Returns the job in the format used by `tasks.check`
+	"""
+	if not job.is_finished:
+		return {
+			"id": job.id,
+			"status": "PROGRESS",
+			"result": {
+				"current": job.succeeded + job.failed,
+				"total": job.total,
+			},
+		}
+
+	errors = job.items.filter_by(state=BulkJobItemState.FAILURE).order_by(BulkJobItem.id).limit(max_errors).all()
+	return {
+		"id": job.id,
+		"status": "SUCCESS",
+		"result": {
+			"title": job.title,
+			"total": job.total,
+			"succeeded": job.succeeded,
+			"failed": job.failed,
+			"duration": (job.finished_at - job.created_at).total_seconds(),
+			"errors": [{ "args": x.args, "error": x.error } for x in errors],
+		},
+	}
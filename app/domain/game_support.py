@@ -2,11 +2,13 @@
 # SPDX-License-Identifier: AGPL-3.0-or-later
 # Copyright (C) 2018-2025 rubenwardy <rw@rubenwardy>
 
-from typing import List, Dict, Optional, Tuple
+from typing import List, Dict, Optional, Tuple, Iterable
 
 import sqlalchemy
+from sqlalchemy.orm import joinedload, selectinload
 
-from app.models import PackageType, Package, PackageState, PackageGameSupport
+from app.models import PackageType, Package, PackageState, PackageGameSupport, Dependency, MetaPackage, User
+from app.rediscache import get_game_support_changes, GAME_SUPPORT_CHANGED_ALL
 from app.utils.models import post_bot_message
 
 
@@ -80,14 +82,64 @@ class GSPackage:
 	def add_error(self, error: str):
 		return self.errors.add(error)
 
+	def copy(self) -> "GSPackage":
+		"""
+		Returns an unresolved copy of the package's inputs
+		"""
+		ret = GSPackage(self.author, self.name, self.type, set(self.provides))
+		ret.depends = set(self.depends)
+		ret.user_supported_games = set(self.user_supported_games)
+		ret.user_unsupported_games = set(self.user_unsupported_games)
+		ret.supports_all_games = self.supports_all_games
+		ret.detection_disabled = self.detection_disabled
+		return ret
+
 
 class GameSupport:
 	packages: Dict[str, GSPackage]
 	modified_packages: set[GSPackage]
 
+	# Reverse indexes, from modname to package ids
+	_providers: Dict[str, Dict[str, None]]
+	_dependents: Dict[str, Dict[str, None]]
+	_indexed: Dict[str, Tuple[frozenset[str], frozenset[str]]]
+
+	# Packages and index entries that aren't shared with a fork, and so can be modified in place
+	_owned_packages: set[str]
+	_owned_providers: set[str]
+	_owned_dependents: set[str]
+
+	# Packages that can't be resolved, regardless of the path they're reached from
+	_unresolvable: set[str]
+	_cycle_cuts: int
+
 	def __init__(self):
 		self.packages = {}
 		self.modified_packages = set()
+		self._providers = {}
+		self._dependents = {}
+		self._indexed = {}
+		self._owned_packages = set()
+		self._owned_providers = set()
+		self._owned_dependents = set()
+		self._unresolvable = set()
+		self._cycle_cuts = 0
+
+	def fork(self) -> "GameSupport":
+		"""
+		Returns an unresolved instance with the same packages. Packages and indexes are shared
+		between the two instances, and are copied by either instance before being modified.
+		"""
+		ret = GameSupport()
+		ret.packages = dict(self.packages)
+		ret._providers = dict(self._providers)
+		ret._dependents = dict(self._dependents)
+		ret._indexed = dict(self._indexed)
+
+		self._owned_packages.clear()
+		self._owned_providers.clear()
+		self._owned_dependents.clear()
+		return ret
 
 	@property
 	def all_confirmed(self):
@@ -111,16 +163,66 @@ class GameSupport:
 
 	def add(self, package: GSPackage) -> GSPackage:
 		self.packages[package.id_] = package
+		self._owned_packages.add(package.id_)
+		self._index(package)
 		return package
 
+	def discard(self, id_: str):
+		"""
+		Removes a package without updating the packages that depend on it
+		"""
+		self.packages.pop(id_, None)
+		self._owned_packages.discard(id_)
+		self._unindex(id_)
+
 	def get(self, id_: str) -> Optional[GSPackage]:
 		return self.packages.get(id_)
 
+	def _own(self, package: GSPackage) -> GSPackage:
+		"""
+		Returns this instance's package with the same id, copying it first if it's shared with a fork
+		"""
+		current = self.packages.get(package.id_)
+		if current is None:
+			return package
+
+		if package.id_ not in self._owned_packages:
+			current = current.copy()
+			self.packages[package.id_] = current
+			self._owned_packages.add(package.id_)
+
+		return current
+
+	@staticmethod
+	def _get_index_entry(index: Dict[str, Dict[str, None]], owned: set[str], modname: str) -> Dict[str, None]:
+		entry = index.get(modname)
+		if entry is None or modname not in owned:
+			entry = dict(entry) if entry is not None else {}
+			index[modname] = entry
+			owned.add(modname)
+
+		return entry
+
+	def _unindex(self, id_: str):
+		provides, depends = self._indexed.pop(id_, (frozenset(), frozenset()))
+		for modname in provides:
+			self._get_index_entry(self._providers, self._owned_providers, modname).pop(id_, None)
+		for modname in depends:
+			self._get_index_entry(self._dependents, self._owned_dependents, modname).pop(id_, None)
+
+	def _index(self, package: GSPackage):
+		self._unindex(package.id_)
+		self._indexed[package.id_] = (frozenset(package.provides), frozenset(package.depends))
+		for modname in package.provides:
+			self._get_index_entry(self._providers, self._owned_providers, modname)[package.id_] = None
+		for modname in package.depends:
+			self._get_index_entry(self._dependents, self._owned_dependents, modname)[package.id_] = None
+
 	def get_all_that_provide(self, modname: str) -> List[GSPackage]:
-		return [package for package in self.packages.values() if modname in package.provides]
+		return [self.packages[id_] for id_ in self._providers.get(modname, {})]
 
 	def get_all_that_depend_on(self, modname: str) -> List[GSPackage]:
-		return [package for package in self.packages.values() if modname in package.depends]
+		return [self.packages[id_] for id_ in self._dependents.get(modname, {})]
 
 	def _get_supported_games_for_modname(self, depend: str, visited: list[str]):
 		dep_supports_all = False
@@ -161,20 +263,31 @@ class GameSupport:
 		return ret
 
 	def _get_supported_games(self, package: GSPackage, visited: list[str]) -> Optional[set[str]]:
+		package = self.packages.get(package.id_, package)
 		if package.id_ in visited:
+			self._cycle_cuts += 1
 			return None
 
 		if package.type == PackageType.GAME:
 			return {package.name}
 		elif package.is_confirmed:
 			return package.supported_games
+		elif package.id_ in self._unresolvable:
+			return None
 
+		package = self._own(package)
 		visited = visited.copy()
 		visited.append(package.id_)
 
+		cycle_cuts = self._cycle_cuts
 		ret = self._get_supported_games_for_deps(package, visited)
 		if ret is None:
 			assert len(package.errors) > 0
+
+			# A failure caused by a dependency cycle depends on where the search started from
+			if cycle_cuts == self._cycle_cuts:
+				self._unresolvable.add(package.id_)
+
 			return None
 
 		ret = ret.copy()
@@ -198,6 +311,11 @@ class GameSupport:
 		return package.supported_games
 
 	def on_update(self, package: GSPackage, old_provides: Optional[set[str]] = None):
+		# The package's provides or depends may have been changed in place
+		if self.packages.get(package.id_) is package:
+			self._index(package)
+		self._unresolvable.discard(package.id_)
+
 		to_update = {package}
 		checked = set()
 
@@ -214,113 +332,241 @@ class GameSupport:
 				for depending_package in self.get_all_that_depend_on(modname):
 					if depending_package not in checked:
 						if depending_package.id_ in self.packages and depending_package.type != PackageType.GAME:
+							depending_package = self._own(depending_package)
 							depending_package.is_confirmed = False
 							depending_package.detected_supported_games = []
+							self._unresolvable.discard(depending_package.id_)
 
 						to_update.add(depending_package)
 						checked.add(depending_package)
 
 	def on_remove(self, package: GSPackage):
 		del self.packages[package.id_]
+		self._unindex(package.id_)
 		self.on_update(package)
 
 	def on_first_run(self):
-		for package in self.packages.values():
+		for id_ in list(self.packages.keys()):
+			package = self.packages[id_]
 			if not package.is_confirmed:
 				self.on_update(package)
 
 
-def _convert_package(support: GameSupport, package: Package) -> GSPackage:
-	# Unapproved packages shouldn't be considered to fulfill anything
-	provides = set()
-	if package.state == PackageState.APPROVED:
-		provides = set([x.name for x in package.provides])
+def _load_packages(session: sqlalchemy.orm.Session, package_ids: Optional[Iterable[int]],
+		only_approved_games_and_mods: bool = True) -> Dict[int, GSPackage]:
+	"""
+	Loads the game support inputs of packages in a fixed number of queries.
+	If package_ids is None, all approved games and mods are loaded.
+	"""
+	query = session.query(Package).options(joinedload(Package.author), selectinload(Package.provides))
+	if only_approved_games_and_mods:
+		query = query.filter(Package.state == PackageState.APPROVED,
+				Package.type.in_([PackageType.GAME, PackageType.MOD]))
+	if package_ids is not None:
+		query = query.filter(Package.id.in_(package_ids))
+
+	packages: List[Package] = query.all()
+	if len(packages) == 0:
+		return {}
+
+	ids = [package.id for package in packages]
+
+	depends_query = (session.query(Dependency.depender_id, MetaPackage.name)
+			.select_from(Dependency)
+			.join(MetaPackage, Dependency.meta_package)
+			.filter(Dependency.optional.is_(False)))
+	game_support_query = (session.query(PackageGameSupport.package_id, PackageGameSupport.supports, Package.name)
+			.select_from(PackageGameSupport)
+			.join(Package, PackageGameSupport.game)
+			.filter(Package.state == PackageState.APPROVED, PackageGameSupport.confidence > 5))
+	if package_ids is not None:
+		depends_query = depends_query.filter(Dependency.depender_id.in_(ids))
+		game_support_query = game_support_query.filter(PackageGameSupport.package_id.in_(ids))
+
+	depends: Dict[int, set[str]] = {}
+	for depender_id, modname in depends_query.all():
+		depends.setdefault(depender_id, set()).add(modname)
+
+	existing_game_support: Dict[int, List[Tuple[bool, str]]] = {}
+	for package_id, supports, game_name in game_support_query.all():
+		existing_game_support.setdefault(package_id, []).append((supports, game_name))
+
+	ret = {}
+	for package in packages:
+		# Unapproved packages shouldn't be considered to fulfill anything
+		provides = set()
+		if package.state == PackageState.APPROVED:
+			provides = set([x.name for x in package.provides])
 
-	gs_package = GSPackage(package.author.username, package.name, package.type, provides)
-	gs_package.depends = set([x.meta_package.name for x in package.dependencies if not x.optional])
-	gs_package.detection_disabled = not package.enable_game_support_detection
-	gs_package.supports_all_games = package.supports_all_games
+		gs_package = GSPackage(package.author.username, package.name, package.type, provides)
+		gs_package.depends = depends.get(package.id, set())
+		gs_package.detection_disabled = not package.enable_game_support_detection
+		gs_package.supports_all_games = package.supports_all_games
 
-	existing_game_support = (package.supported_games
-			.filter(PackageGameSupport.game.has(state=PackageState.APPROVED),
-					PackageGameSupport.confidence > 5)
-			.all())
-	if not package.supports_all_games:
-		gs_package.user_supported_games = [x.game.name for x in existing_game_support if x.supports]
-	gs_package.user_unsupported_games = [x.game.name for x in existing_game_support if not x.supports]
-	return support.add(gs_package)
+		existing = existing_game_support.get(package.id, [])
+		if not package.supports_all_games:
+			gs_package.user_supported_games = set([game_name for supports, game_name in existing if supports])
+		gs_package.user_unsupported_games = set([game_name for supports, game_name in existing if not supports])
 
+		ret[package.id] = gs_package
 
-def _create_instance(session: sqlalchemy.orm.Session) -> GameSupport:
-	support = GameSupport()
+	return ret
 
-	packages: List[Package] = (session.query(Package)
-			.filter(Package.state == PackageState.APPROVED, Package.type.in_([PackageType.GAME, PackageType.MOD]))
-			.all())
 
-	for package in packages:
-		_convert_package(support, package)
+class _GameSupportCache:
+	"""
+	Game support inputs of all approved games and mods, kept up to date using the change log in Redis.
+
+	Instances are created by forking `support`, which shares the packages until they're modified.
+	"""
+
+	position: Optional[int]
+	packages: Dict[int, GSPackage]
+	support: GameSupport
+
+	def __init__(self):
+		self.position = None
+		self.packages = {}
+		self.support = GameSupport()
+
+	def _reload_all(self, session: sqlalchemy.orm.Session):
+		self.packages = _load_packages(session, None)
+		self.support = GameSupport()
+		for gs_package in self.packages.values():
+			self.support.add(gs_package)
+
+	def refresh(self, session: sqlalchemy.orm.Session):
+		position, changes = get_game_support_changes(self.position)
+		if changes is None or GAME_SUPPORT_CHANGED_ALL in changes:
+			self._reload_all(session)
+		elif len(changes) > 0:
+			changed_ids = set([int(x) for x in changes])
+
+			# Packages with user-specified support for a changed game use the game's name and state
+			changed_ids.update([x[0] for x in session.query(PackageGameSupport.package_id)
+					.filter(PackageGameSupport.game_id.in_(changed_ids), PackageGameSupport.confidence > 5)
+					.distinct().all()])
+
+			for package_id in changed_ids:
+				gs_package = self.packages.pop(package_id, None)
+				if gs_package is not None:
+					self.support.discard(gs_package.id_)
+
+			for package_id, gs_package in _load_packages(session, changed_ids).items():
+				self.packages[package_id] = gs_package
+				self.support.add(gs_package)
+
+		self.position = position
+
+
+_cache = _GameSupportCache()
+
+
+def _create_instance(session: sqlalchemy.orm.Session, package: Optional[Package] = None) -> GameSupport:
+	"""
+	Creates an unresolved GameSupport instance.
+
+	If given, `package` is loaded from the session even if it isn't approved,
+	as it may have uncommitted changes.
+	"""
+	_cache.refresh(session)
+
+	support = _cache.support.fork()
+	if package is not None:
+		for package_id, gs_package in _load_packages(session, [package.id], only_approved_games_and_mods=False).items():
+			# The package may have been renamed
+			cached = _cache.packages.get(package_id)
+			if cached is not None:
+				support.discard(cached.id_)
+
+			support.add(gs_package)
 
 	return support
 
 
-def _persist(session: sqlalchemy.orm.Session, support: GameSupport):
-	for gs_package in support.packages.values():
-		if len(gs_package.errors) != 0:
-			msg = "\n".join([f"- {x}" for x in gs_package.errors])
-			package = session.query(Package).filter(
-					Package.author.has(username=gs_package.author),
-					Package.name == gs_package.name).one()
-			post_bot_message(package, "Error when checking game support", msg, session)
-
-	for gs_package in support.modified_packages:
-		if not gs_package.detection_disabled:
-			package = session.query(Package).filter(
-					Package.author.has(username=gs_package.author),
-					Package.name == gs_package.name).one()
-
-			# Clear existing
-			session.query(PackageGameSupport) \
-				.filter_by(package=package, confidence=1) \
-				.delete()
-
-			# Add new
-			supported_games = gs_package.supported_games \
-				.difference(gs_package.user_supported_games)
-			for game_name in supported_games:
-				game_id = session.query(Package.id) \
-					.filter(Package.type == PackageType.GAME, Package.name == game_name, Package.state == PackageState.APPROVED) \
-					.one()[0]
-
-				new_support = PackageGameSupport()
-				new_support.package = package
-				new_support.game_id = game_id
-				new_support.confidence = 1
-				new_support.supports = True
-				session.add(new_support)
+def _get_packages_by_key(session: sqlalchemy.orm.Session, packages: Iterable[GSPackage]) -> Dict[str, Package]:
+	keys = set([(x.author, x.name) for x in packages])
+	if len(keys) == 0:
+		return {}
+
+	rows = (session.query(User.username, Package)
+			.select_from(Package)
+			.join(User, Package.author)
+			.filter(sqlalchemy.tuple_(User.username, Package.name).in_(keys))
+			.all())
+	return {f"{username}/{package.name}": package for username, package in rows}
+
+
+def _persist(session: sqlalchemy.orm.Session, support: GameSupport) -> int:
+	"""
+	Posts errors and writes detected game support, returning the number of rows inserted or deleted
+	"""
+	with_errors = [x for x in support.packages.values() if len(x.errors) != 0]
+	to_persist = [x for x in support.modified_packages if not x.detection_disabled]
+	packages = _get_packages_by_key(session, with_errors + to_persist)
+
+	for gs_package in with_errors:
+		msg = "\n".join([f"- {x}" for x in gs_package.errors])
+		post_bot_message(packages[gs_package.id_], "Error when checking game support", msg, session)
+
+	if len(to_persist) == 0:
+		return 0
+
+	detected: Dict[int, set[str]] = {}
+	for gs_package in to_persist:
+		detected[packages[gs_package.id_].id] = gs_package.supported_games \
+			.difference(gs_package.user_supported_games)
+
+	game_names = set().union(*detected.values())
+	game_ids: Dict[str, int] = {}
+	if len(game_names) > 0:
+		game_ids = dict(session.query(Package.name, Package.id)
+				.filter(Package.type == PackageType.GAME, Package.name.in_(game_names), Package.state == PackageState.APPROVED)
+				.all())
+
+	wanted = set()
+	for package_id, supported_games in detected.items():
+		for game_name in supported_games:
+			wanted.add((package_id, game_ids[game_name]))
+
+	existing: Dict[Tuple[int, int], int] = {}
+	for row_id, package_id, game_id in (session.query(PackageGameSupport.id, PackageGameSupport.package_id, PackageGameSupport.game_id)
+			.filter(PackageGameSupport.package_id.in_(detected.keys()), PackageGameSupport.confidence == 1)
+			.all()):
+		existing[(package_id, game_id)] = row_id
+
+	to_delete = [row_id for key, row_id in existing.items() if key not in wanted]
+	to_insert = [{ "package_id": package_id, "game_id": game_id, "confidence": 1, "supports": True }
+			for package_id, game_id in wanted if (package_id, game_id) not in existing]
+
+	if len(to_delete) > 0:
+		session.execute(sqlalchemy.delete(PackageGameSupport)
+				.where(PackageGameSupport.id.in_(to_delete))
+				.execution_options(synchronize_session=False))
+
+	if len(to_insert) > 0:
+		session.execute(sqlalchemy.insert(PackageGameSupport), to_insert)
+
+	return len(to_delete) + len(to_insert)
 
 
 def game_support_update(session: sqlalchemy.orm.Session, package: Package, old_provides: Optional[set[str]]) -> set[str]:
-	support = _create_instance(session)
+	support = _create_instance(session, package)
 	gs_package = support.get(package.get_id())
-	if gs_package is None:
-		gs_package = _convert_package(support, package)
 	support.on_update(gs_package, old_provides)
 	_persist(session, support)
 	return gs_package.errors
 
 
-def game_support_update_all(session: sqlalchemy.orm.Session):
+def game_support_update_all(session: sqlalchemy.orm.Session) -> int:
 	support = _create_instance(session)
 	support.on_first_run()
-	_persist(session, support)
+	return _persist(session, support)
 
 
 def game_support_remove(session: sqlalchemy.orm.Session, package: Package):
-	support = _create_instance(session)
+	support = _create_instance(session, package)
 	gs_package = support.get(package.get_id())
-	if gs_package is None:
-		gs_package = _convert_package(support, package)
 	support.on_remove(gs_package)
 	_persist(session, support)
 
@@ -0,0 +1,141 @@
+# ContentDB
+# SPDX-License-Identifier: AGPL-3.0-or-later
+# Copyright (C) 2018-2025 rubenwardy <rw@rubenwardy>
+
+import itertools
+from typing import Optional, Iterable, Tuple, List
+
+from sqlalchemy import event, select, update, func, and_, or_, not_
+from sqlalchemy.orm import Session
+
+from app.models import Package, PackageReview, PackageReviewVote
+
+
+# Review and vote counts are stored on Package and PackageReview so that they can be read
+# without counting rows:
+#
+# * Package.reviews_positive/neutral/negative: approved reviews by rating
+# * PackageReview.votes_helpful/unhelpful, and PackageReview.score which is derived from them
+#
+# They are updated when a session that changed reviews or votes is committed.
+# `get_inconsistent_review_counts` and `repair_review_counts` are used to detect and fix
+# counts that were changed outside of the ORM, for example by database cascades.
+
+
+def _get_review_counts(package_ids: Optional[Iterable[int]]):
+	query = (select(Package.id.label("package_id"),
+				func.count(PackageReview.id).filter(PackageReview.rating > 3).label("positive"),
+				func.count(PackageReview.id).filter(PackageReview.rating == 3).label("neutral"),
+				func.count(PackageReview.id).filter(PackageReview.rating < 3).label("negative"))
+			.select_from(Package)
+			.outerjoin(PackageReview, and_(PackageReview.package_id == Package.id, PackageReview.approved.is_(True)))
+			.group_by(Package.id))
+	if package_ids is not None:
+		query = query.where(Package.id.in_(list(package_ids)))
+
+	counts = query.subquery("review_counts")
+	is_inconsistent = or_(
+			Package.reviews_positive != counts.c.positive,
+			Package.reviews_neutral != counts.c.neutral,
+			Package.reviews_negative != counts.c.negative)
+	return counts, is_inconsistent
+
+
+def _get_vote_counts(review_ids: Optional[Iterable[int]]):
+	query = (select(PackageReview.id.label("review_id"),
+				func.count(PackageReviewVote.user_id).filter(PackageReviewVote.is_positive).label("helpful"),
+				func.count(PackageReviewVote.user_id).filter(not_(PackageReviewVote.is_positive)).label("unhelpful"))
+			.select_from(PackageReview)
+			.outerjoin(PackageReviewVote, PackageReviewVote.review_id == PackageReview.id)
+			.group_by(PackageReview.id))
+	if review_ids is not None:
+		query = query.where(PackageReview.id.in_(list(review_ids)))
+
+	counts = query.subquery("vote_counts")
+	score = 3 * (counts.c.helpful - counts.c.unhelpful) + 1
+	is_inconsistent = or_(
+			PackageReview.votes_helpful != counts.c.helpful,
+			PackageReview.votes_unhelpful != counts.c.unhelpful,
+			PackageReview.score != score)
+	return counts, score, is_inconsistent
+
+
+def update_review_counts(session: Session, package_ids: Optional[Iterable[int]] = None) -> int:
+	"""
+	Recounts the approved reviews of packages, returning the number of packages that changed.
+	If package_ids is None, all packages are recounted.
+	"""
+	counts, is_inconsistent = _get_review_counts(package_ids)
+	stmt = (update(Package)
+		.where(Package.id == counts.c.package_id, is_inconsistent)
+		.values(reviews_positive=counts.c.positive, reviews_neutral=counts.c.neutral,
+				reviews_negative=counts.c.negative)
+		.execution_options(synchronize_session=False))
+	return session.execute(stmt).rowcount
+
+
+def update_vote_counts(session: Session, review_ids: Optional[Iterable[int]] = None) -> int:
+	"""
+	Recounts the votes on reviews and updates their scores, returning the number of reviews that changed.
+	If review_ids is None, all reviews are recounted.
+	"""
+	counts, score, is_inconsistent = _get_vote_counts(review_ids)
+	stmt = (update(PackageReview)
+		.where(PackageReview.id == counts.c.review_id, is_inconsistent)
+		.values(votes_helpful=counts.c.helpful, votes_unhelpful=counts.c.unhelpful, score=score)
+		.execution_options(synchronize_session=False))
+	return session.execute(stmt).rowcount
+
+
+def get_inconsistent_review_counts(session: Session) -> Tuple[List[int], List[int]]:
+	"""
+	Returns the ids of packages and reviews whose stored counts don't match their reviews and votes
+	"""
+	counts, is_inconsistent = _get_review_counts(None)
+	package_ids = session.execute(select(Package.id)
+			.where(Package.id == counts.c.package_id, is_inconsistent)
+			.order_by(Package.id)).scalars().all()
+
+	counts, _, is_inconsistent = _get_vote_counts(None)
+	review_ids = session.execute(select(PackageReview.id)
+			.where(PackageReview.id == counts.c.review_id, is_inconsistent)
+			.order_by(PackageReview.id)).scalars().all()
+
+	return list(package_ids), list(review_ids)
+
+
+def repair_review_counts(session: Session) -> Tuple[int, int]:
+	"""
+	Recounts all reviews and votes, returning the number of packages and reviews that were fixed
+	"""
+	return update_review_counts(session), update_vote_counts(session)
+
+
+@event.listens_for(Session, "after_flush")
+def _track_review_changes(session: Session, _flush_context):
+	for obj in itertools.chain(session.new, session.dirty, session.deleted):
+		if isinstance(obj, PackageReview) and obj.package_id is not None:
+			session.info.setdefault("review_count_changes", set()).add(obj.package_id)
+		elif isinstance(obj, PackageReviewVote) and obj.review_id is not None:
+			session.info.setdefault("vote_count_changes", set()).add(obj.review_id)
+
+
+@event.listens_for(Session, "before_commit")
+def _update_counts_on_commit(session: Session):
+	if any(isinstance(obj, (PackageReview, PackageReviewVote))
+			for obj in itertools.chain(session.new, session.dirty, session.deleted)):
+		session.flush()
+
+	package_ids = session.info.pop("review_count_changes", None)
+	if package_ids:
+		update_review_counts(session, package_ids)
+
+	review_ids = session.info.pop("vote_count_changes", None)
+	if review_ids:
+		update_vote_counts(session, review_ids)
+
+
+@event.listens_for(Session, "after_rollback")
+def _clear_review_changes(session: Session):
+	session.info.pop("review_count_changes", None)
+	session.info.pop("vote_count_changes", None)
@@ -0,0 +1,35 @@
+# ContentDB
+# SPDX-License-Identifier: AGPL-3.0-or-later
+# Copyright (C) 2018-2025 rubenwardy <rw@rubenwardy>
+
+from typing import Optional, Iterable
+
+from sqlalchemy import select, update, func, and_
+
+from app.models import db, Package, PackageReview
+
+
+def recalculate_package_scores(package_ids: Optional[Iterable[int]] = None) -> int:
+	"""
+	Recalculates Package.score in one statement, returning the number of packages whose score changed.
+
+	The result is the same as calling `Package.recalculate_score()` on each package:
+	score_downloads plus 150 * as_weight() for each approved review.
+	If package_ids is None, all packages are recalculated.
+	"""
+	review_scores = (select(Package.id.label("package_id"),
+				func.coalesce(func.sum(150 * ((PackageReview.rating - 3.0) / 2.0)), 0.0).label("total"))
+			.select_from(Package)
+			.outerjoin(PackageReview, and_(PackageReview.package_id == Package.id, PackageReview.approved.is_(True)))
+			.group_by(Package.id))
+	if package_ids is not None:
+		review_scores = review_scores.where(Package.id.in_(list(package_ids)))
+
+	review_scores = review_scores.subquery("review_scores")
+	new_score = Package.score_downloads + review_scores.c.total
+
+	stmt = (update(Package)
+		.where(Package.id == review_scores.c.package_id, Package.score.is_distinct_from(new_score))
+		.values(score=new_score)
+		.execution_options(synchronize_session=False))
+	return db.session.execute(stmt).rowcount
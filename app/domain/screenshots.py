@@ -9,6 +9,7 @@ from flask_babel import lazy_gettext
 from app.domain.DomainError import DomainError
 from app.domain.uploads import upload_file
 from app.models import User, Package, PackageScreenshot, Permission, NotificationType, db, AuditSeverity
+from app.tasks.pkgtasks import create_screenshot_thumbnails
 from app.utils.models import add_notification, add_audit_log
 from app.utils.image import get_image_size
 
@@ -51,6 +52,8 @@ def do_create_screenshot(user: User, package: Package, title: str, file, is_cove
 
 	db.session.commit()
 
+	create_screenshot_thumbnails.delay(ss.id)
+
 	if is_cover_image:
 		package.cover_image = ss
 		db.session.commit()
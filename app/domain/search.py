@@ -0,0 +1,248 @@
+# ContentDB
+# SPDX-License-Identifier: AGPL-3.0-or-later
+# Copyright (C) 2018-2025 rubenwardy <rw@rubenwardy>
+
+import itertools
+from typing import Optional, Iterable
+
+from sqlalchemy import event, select, delete, func, and_, or_, case, cast, literal, String, inspect
+from sqlalchemy.dialects.postgresql import insert, REGCONFIG, TSVECTOR
+from sqlalchemy.orm import Session
+
+from app.models import db, Package, PackageTranslation, PackageSearchDocument, PackageProvides, MetaPackage, \
+	Tag, Tags, ContentWarnings, License, PackageType
+
+
+# Packages are searched using precomputed documents in PackageSearchDocument.
+#
+# Each package has an English document containing its name, title, provided modnames,
+# short description, tag titles, and long description. Each translation of a package adds a
+# document in that language, stemmed using the language's text search config.
+# A search in a language matches both the English document and the translated one, and
+# ranks a package by its best matching document.
+#
+# Weights: A is the title, name, and provided modnames; B is the short description; C is tags;
+# and D is the long description.
+#
+# Documents are updated when a session that changed their contents is committed. Renaming a
+# tag isn't tracked, the `rebuild_search_index` task fixes this.
+
+# Text search configs available in PostgreSQL, by language code
+LANGUAGE_CONFIGS = {
+	"ar": "arabic",
+	"ca": "catalan",
+	"da": "danish",
+	"de": "german",
+	"el": "greek",
+	"en": "english",
+	"es": "spanish",
+	"eu": "basque",
+	"fi": "finnish",
+	"fr": "french",
+	"ga": "irish",
+	"hi": "hindi",
+	"hu": "hungarian",
+	"hy": "armenian",
+	"id": "indonesian",
+	"it": "italian",
+	"lt": "lithuanian",
+	"nb": "norwegian",
+	"ne": "nepali",
+	"nl": "dutch",
+	"nn": "norwegian",
+	"pt": "portuguese",
+	"ro": "romanian",
+	"ru": "russian",
+	"sr": "serbian",
+	"sv": "swedish",
+	"ta": "tamil",
+	"tr": "turkish",
+	"yi": "yiddish",
+}
+
+SEARCHED_PACKAGE_ATTRIBUTES = ["name", "title", "short_desc", "desc", "tags", "provides"]
+SEARCHED_TRANSLATION_ATTRIBUTES = ["title", "short_desc", "desc"]
+
+
+def get_language_config(language_id: str) -> str:
+	# Regional variants, such as pt_BR, use the config of the language
+	return LANGUAGE_CONFIGS.get(language_id.split("_")[0], "simple")
+
+
+def _weighted(config, value, weight: str):
+	return func.setweight(func.to_tsvector(config, func.coalesce(value, "")), weight, type_=TSVECTOR)
+
+
+def _get_english_documents(package_ids: Optional[list[int]]):
+	config = cast(literal("english"), REGCONFIG)
+
+	provides = (select(func.string_agg(MetaPackage.name, " "))
+			.select_from(PackageProvides).join(MetaPackage)
+			.where(PackageProvides.c.package_id == Package.id)
+			.scalar_subquery())
+	tags = (select(func.string_agg(Tag.title, " "))
+			.select_from(Tags).join(Tag)
+			.where(Tags.c.package_id == Package.id)
+			.scalar_subquery())
+
+	vector = (_weighted(config, func.concat_ws(" ", Package.title, Package.name, provides), "A")
+			.op("||")(_weighted(config, Package.short_desc, "B"))
+			.op("||")(_weighted(config, tags, "C"))
+			.op("||")(_weighted(config, Package.desc, "D")))
+
+	query = select(Package.id, literal("en"), vector)
+	if package_ids is not None:
+		query = query.where(Package.id.in_(package_ids))
+	return query
+
+
+def _get_translated_documents(package_ids: Optional[list[int]]):
+	language = func.split_part(PackageTranslation.language_id, "_", 1)
+	config = cast(case(LANGUAGE_CONFIGS, value=language, else_="simple"), REGCONFIG)
+
+	translations = select(PackageTranslation, config.label("config")) \
+		.where(PackageTranslation.language_id != "en")
+	if package_ids is not None:
+		translations = translations.where(PackageTranslation.package_id.in_(package_ids))
+	translations = translations.subquery("translations")
+
+	vector = (_weighted(translations.c.config, translations.c.title, "A")
+			.op("||")(_weighted(translations.c.config, translations.c.short_desc, "B"))
+			.op("||")(_weighted(translations.c.config, translations.c.desc, "D")))
+
+	return select(translations.c.package_id, translations.c.language_id, vector)
+
+
+def update_search_index(session: Session, package_ids: Optional[Iterable[int]] = None) -> int:
+	"""
+	Recomputes the search documents of packages, returning the number of documents written.
+	If package_ids is None, all documents are recomputed.
+	"""
+	if package_ids is not None:
+		package_ids = list(package_ids)
+
+	stmt = delete(PackageSearchDocument)
+	if package_ids is not None:
+		stmt = stmt.where(PackageSearchDocument.package_id.in_(package_ids))
+	session.execute(stmt.execution_options(synchronize_session=False))
+
+	columns = [PackageSearchDocument.package_id, PackageSearchDocument.language_id, PackageSearchDocument.vector]
+	documents = _get_english_documents(package_ids).union_all(_get_translated_documents(package_ids))
+	stmt = insert(PackageSearchDocument).from_select(columns, documents)
+	stmt = stmt.on_conflict_do_update(index_elements=[PackageSearchDocument.package_id, PackageSearchDocument.language_id],
+			set_={"vector": stmt.excluded.vector})
+	return session.execute(stmt.execution_options(synchronize_session=False)).rowcount
+
+
+def _parse_query(config: str, search_query: str):
+	# parse_websearch is installed by sqlalchemy_searchable, it supports web search syntax
+	# and treats each word as a prefix
+	return func.parse_websearch(cast(literal(config), REGCONFIG), search_query)
+
+
+def get_search_ranks(search_query: str, lang: str = "en"):
+	"""
+	Returns a subquery of (package_id, rank) for packages matching search_query in lang
+	"""
+	doc = PackageSearchDocument
+	english_query = _parse_query("english", search_query)
+	if lang == "en":
+		matches = doc.vector.op("@@")(english_query)
+		rank = func.ts_rank(doc.vector, english_query)
+	else:
+		translated_query = _parse_query(get_language_config(lang), search_query)
+		matches = or_(
+				and_(doc.language_id == "en", doc.vector.op("@@")(english_query)),
+				and_(doc.language_id == lang, doc.vector.op("@@")(translated_query)))
+		rank = func.ts_rank(doc.vector, case((doc.language_id == "en", english_query), else_=translated_query))
+
+	return (select(doc.package_id, func.max(rank).label("rank"))
+			.where(doc.language_id.in_(["en", lang]), matches)
+			.group_by(doc.package_id)
+			.subquery("search_ranks"))
+
+
+def search_packages(query, search_query: str, lang: str = "en", sort: bool = True):
+	"""
+	Filters a package query to packages matching search_query.
+	If sort is true, results are ordered by relevance then score.
+	"""
+	ranks = get_search_ranks(search_query, lang)
+	query = query.join(ranks, ranks.c.package_id == Package.id)
+	if sort:
+		query = query.order_by(db.desc(ranks.c.rank), db.desc(Package.score))
+
+	return query
+
+
+def get_package_facets(query) -> dict[str, dict]:
+	"""
+	Counts the packages in a package query by tag, type, license, and content warning, using
+	one statement.
+
+	Returns a dictionary with the keys `tags`, `types`, `licenses`, and `content_warnings`.
+	Each maps from id (or PackageType) to number of packages, and only contains non-zero counts.
+	A package is counted under both its code and media license.
+	"""
+	matches = (query
+			.with_entities(Package.id, Package.type, Package.license_id, Package.media_license_id)
+			.order_by(None)
+			.cte("facet_matches"))
+
+	def count_by(facet: str, key, *joins):
+		stmt = select(literal(facet).label("facet"), cast(key, String).label("key"), func.count().label("count")) \
+			.select_from(matches)
+		for target, on in joins:
+			stmt = stmt.join(target, on)
+		return stmt.group_by(key)
+
+	facets = [
+		count_by("tags", Tags.c.tag_id, (Tags, Tags.c.package_id == matches.c.id)),
+		count_by("types", matches.c.type),
+		count_by("licenses", License.id,
+				(License, or_(License.id == matches.c.license_id, License.id == matches.c.media_license_id))),
+		count_by("content_warnings", ContentWarnings.c.content_warning_id,
+				(ContentWarnings, ContentWarnings.c.package_id == matches.c.id)),
+	]
+
+	ret = { "tags": {}, "types": {}, "licenses": {}, "content_warnings": {} }
+	for facet, key, count in db.session.execute(facets[0].union_all(*facets[1:])):
+		key = PackageType[key] if facet == "types" else int(key)
+		ret[facet][key] = count
+
+	return ret
+
+
+def _has_changes(obj, attributes: list[str]) -> bool:
+	state = inspect(obj)
+	return any(state.attrs[attr].history.has_changes() for attr in attributes)
+
+
+@event.listens_for(Session, "after_flush")
+def _track_search_changes(session: Session, _flush_context):
+	for obj in itertools.chain(session.new, session.dirty):
+		if isinstance(obj, Package) and (obj in session.new or _has_changes(obj, SEARCHED_PACKAGE_ATTRIBUTES)):
+			session.info.setdefault("search_changes", set()).add(obj.id)
+		elif isinstance(obj, PackageTranslation) and \
+				(obj in session.new or _has_changes(obj, SEARCHED_TRANSLATION_ATTRIBUTES)):
+			session.info.setdefault("search_changes", set()).add(obj.package_id)
+
+	for obj in session.deleted:
+		if isinstance(obj, PackageTranslation):
+			session.info.setdefault("search_changes", set()).add(obj.package_id)
+
+
+@event.listens_for(Session, "before_commit")
+def _update_search_on_commit(session: Session):
+	if any(isinstance(obj, (Package, PackageTranslation))
+			for obj in itertools.chain(session.new, session.dirty, session.deleted)):
+		session.flush()
+
+	package_ids = session.info.pop("search_changes", None)
+	if package_ids:
+		update_search_index(session, package_ids)
+
+
+@event.listens_for(Session, "after_rollback")
+def _clear_search_changes(session: Session):
+	session.info.pop("search_changes", None)
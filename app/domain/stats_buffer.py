@@ -0,0 +1,172 @@
+# ContentDB
+# SPDX-License-Identifier: AGPL-3.0-or-later
+# Copyright (C) 2018-2025 rubenwardy <rw@rubenwardy>
+
+import datetime
+from typing import Optional
+
+from sqlalchemy import update, values, column, Integer, Float
+from sqlalchemy.dialects.postgresql import insert
+
+from app.models import db, Package, PackageRelease, PackageDailyStats, StatsBufferFlush
+from app.rediscache import buffer_stats, take_buffered_stats, delete_buffered_stats
+
+
+# Download and view counters are buffered in Redis rather than written to the database
+# on each request, to avoid row locking hot packages. `flush_buffered_stats` writes them
+# in bulk.
+#
+# Buffer fields are:
+#
+# * `daily/<package_id>/<date>/<column>`: PackageDailyStats column
+# * `package/<package_id>/downloads`: Package.downloads
+# * `package/<package_id>/score`: bonus added to Package.score_downloads and Package.score
+# * `release/<release_id>/downloads`: PackageRelease.downloads
+
+DAILY_STATS_COLUMNS = ["platform_minetest", "platform_other", "reason_new", "reason_dependency", "reason_update",
+		"downloads_v510", "views_luanti"]
+
+
+def _daily_prefix(package: Package) -> str:
+	date = datetime.datetime.utcnow().date()
+	return f"daily/{package.id}/{date.isoformat()}/"
+
+
+def notify_download(package: Package, is_luanti: bool, is_v510: bool, reason: Optional[str]):
+	prefix = _daily_prefix(package)
+	increments = {
+		prefix + ("platform_minetest" if is_luanti else "platform_other"): 1,
+	}
+
+	if reason == "new":
+		increments[prefix + "reason_new"] = 1
+	elif reason == "dependency":
+		increments[prefix + "reason_dependency"] = 1
+	elif reason == "update":
+		increments[prefix + "reason_update"] = 1
+
+	if is_v510:
+		increments[prefix + "downloads_v510"] = 1
+
+	buffer_stats(increments)
+
+
+def notify_view(package: Package, is_luanti: bool):
+	if not is_luanti:
+		return
+
+	buffer_stats({ _daily_prefix(package) + "views_luanti": 1 })
+
+
+def notify_unique_download(package: Package, release: PackageRelease, bonus: float):
+	buffer_stats({
+		f"package/{package.id}/downloads": 1,
+		f"package/{package.id}/score": float(bonus),
+		f"release/{release.id}/downloads": 1,
+	})
+
+
+class BufferedStats:
+	daily: dict[tuple[int, datetime.date], dict[str, int]]
+	package_downloads: dict[int, int]
+	package_score: dict[int, float]
+	release_downloads: dict[int, int]
+
+	def __init__(self, fields: dict[str, str]):
+		self.daily = {}
+		self.package_downloads = {}
+		self.package_score = {}
+		self.release_downloads = {}
+
+		for field, value in fields.items():
+			parts = field.split("/")
+			if parts[0] == "daily" and len(parts) == 4 and parts[3] in DAILY_STATS_COLUMNS:
+				key = (int(parts[1]), datetime.date.fromisoformat(parts[2]))
+				row = self.daily.setdefault(key, { column_name: 0 for column_name in DAILY_STATS_COLUMNS })
+				row[parts[3]] += int(value)
+			elif parts[0] == "package" and len(parts) == 3 and parts[2] == "downloads":
+				self.package_downloads[int(parts[1])] = int(value)
+			elif parts[0] == "package" and len(parts) == 3 and parts[2] == "score":
+				self.package_score[int(parts[1])] = float(value)
+			elif parts[0] == "release" and len(parts) == 3 and parts[2] == "downloads":
+				self.release_downloads[int(parts[1])] = int(value)
+			else:
+				raise ValueError(f"Unknown buffered stat {field}")
+
+	@property
+	def package_ids(self) -> set[int]:
+		return set(self.package_downloads.keys()) | set(self.package_score.keys()) | \
+				set(package_id for package_id, _ in self.daily.keys())
+
+
+def _apply_batch(batch_id: str, stats: BufferedStats) -> int:
+	if db.session.get(StatsBufferFlush, batch_id) is not None:
+		# Already written, but the worker stopped before removing it from Redis
+		return 0
+
+	package_ids = set(x[0] for x in db.session.query(Package.id).filter(Package.id.in_(stats.package_ids)).all())
+	release_ids = set(x[0] for x in db.session.query(PackageRelease.id)
+			.filter(PackageRelease.id.in_(stats.release_downloads.keys())).all())
+
+	rows = 0
+
+	daily_rows = [{ "package_id": package_id, "date": date, **counts }
+			for (package_id, date), counts in stats.daily.items() if package_id in package_ids]
+	if daily_rows:
+		stmt = insert(PackageDailyStats).values(daily_rows)
+		stmt = stmt.on_conflict_do_update(
+			index_elements=[PackageDailyStats.package_id, PackageDailyStats.date],
+			set_={ name: getattr(PackageDailyStats, name) + getattr(stmt.excluded, name) for name in DAILY_STATS_COLUMNS })
+		rows += db.session.execute(stmt).rowcount
+
+	package_rows = [(package_id, stats.package_downloads.get(package_id, 0), stats.package_score.get(package_id, 0.0))
+			for package_id in package_ids if package_id in stats.package_downloads or package_id in stats.package_score]
+	if package_rows:
+		buffered = values(column("id", Integer), column("downloads", Integer), column("score", Float),
+				name="buffered").data(package_rows)
+		stmt = (update(Package)
+			.where(Package.id == buffered.c.id)
+			.values(downloads=Package.downloads + buffered.c.downloads,
+				score_downloads=Package.score_downloads + buffered.c.score,
+				score=Package.score + buffered.c.score)
+			.execution_options(synchronize_session=False))
+		rows += db.session.execute(stmt).rowcount
+
+	release_rows = [(release_id, downloads) for release_id, downloads in stats.release_downloads.items()
+			if release_id in release_ids]
+	if release_rows:
+		buffered = values(column("id", Integer), column("downloads", Integer), name="buffered").data(release_rows)
+		stmt = (update(PackageRelease)
+			.where(PackageRelease.id == buffered.c.id)
+			.values(downloads=PackageRelease.downloads + buffered.c.downloads)
+			.execution_options(synchronize_session=False))
+		rows += db.session.execute(stmt).rowcount
+
+	week_ago = datetime.datetime.utcnow() - datetime.timedelta(days=7)
+	StatsBufferFlush.query.filter(StatsBufferFlush.flushed_at < week_ago).delete(synchronize_session=False)
+	db.session.add(StatsBufferFlush(id=batch_id))
+	db.session.commit()
+
+	return rows
+
+
+def flush_buffered_stats() -> int:
+	"""
+	Writes buffered counters to the database, returning the number of rows updated.
+
+	Each batch is recorded in StatsBufferFlush in the same transaction as the counters,
+	so counts stay exact if the worker is stopped at any point.
+	"""
+	rows = 0
+
+	# At most two batches: one left over from an interrupted flush, and the current one
+	for _ in range(2):
+		batch = take_buffered_stats()
+		if batch is None:
+			break
+
+		batch_id, fields = batch
+		rows += _apply_batch(batch_id, BufferedStats(fields))
+		delete_buffered_stats(batch_id)
+
+	return rows
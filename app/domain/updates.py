@@ -0,0 +1,84 @@
+# ContentDB
+# SPDX-License-Identifier: AGPL-3.0-or-later
+# Copyright (C) 2018-2025 rubenwardy <rw@rubenwardy>
+
+import hashlib
+import json
+from typing import Optional
+
+from sqlalchemy import or_, func
+
+from app.models import db, User, Package, PackageState, PackageRelease, PackageAlias, ReleaseState, LuantiRelease
+from app.rediscache import make_updates_snapshot_key, get_updates_snapshot, set_updates_snapshot
+
+
+def get_latest_releases(version: Optional[LuantiRelease]) -> dict[str, int]:
+	"""
+	Returns a map from "author/name" to the latest approved release id supported by `version`.
+	Aliases map to the release of the package they point to.
+	"""
+
+	# Subquery to get the latest release for each package
+	latest_release_query = (db.session.query(
+		PackageRelease.package_id,
+		func.max(PackageRelease.id).label('max_release_id'))
+			.select_from(PackageRelease)
+			.filter(PackageRelease.state == ReleaseState.APPROVED))
+
+	if version:
+		latest_release_query = (latest_release_query
+			.filter(or_(PackageRelease.min_rel_id == None,
+				PackageRelease.min_rel_id <= version.id))
+			.filter(or_(PackageRelease.max_rel_id == None,
+				PackageRelease.max_rel_id >= version.id)))
+
+	latest_release_subquery = (
+		latest_release_query
+		.group_by(PackageRelease.package_id)
+		.subquery()
+	)
+
+	# Get package id and latest release
+	query = (db.session.query(User.username, Package.name, latest_release_subquery.c.max_release_id)
+		.select_from(Package)
+		.join(User, Package.author)
+		.join(latest_release_subquery, Package.id == latest_release_subquery.c.package_id)
+		.filter(Package.state == PackageState.APPROVED)
+		.all())
+
+	ret = {}
+	for author_username, package_name, release_id in query:
+		ret[f"{author_username}/{package_name}"] = release_id
+
+	# Get aliases
+	aliases = (db.session.query(PackageAlias.author, PackageAlias.name, User.username, Package.name)
+		.select_from(PackageAlias)
+		.join(Package, PackageAlias.package)
+		.join(User, Package.author)
+		.filter(Package.state == PackageState.APPROVED)
+		.all())
+
+	for old_author, old_name, new_author, new_name in aliases:
+		new_release = ret.get(f"{new_author}/{new_name}")
+		if new_release is not None:
+			ret[f"{old_author}/{old_name}"] = new_release
+
+	return ret
+
+
+def get_updates(version: Optional[LuantiRelease]) -> tuple[str, bytes]:
+	"""
+	Returns the ETag and JSON body for `/api/updates/`.
+
+	The result is stored in Redis until a release is approved or deleted, or a package changes
+	state, name or aliases, so most calls are a single key lookup.
+	"""
+	key = make_updates_snapshot_key(version.id if version else None)
+	snapshot = get_updates_snapshot(key)
+	if snapshot is not None:
+		return snapshot
+
+	body = json.dumps(get_latest_releases(version), sort_keys=True, separators=(",", ":")).encode("utf-8")
+	etag = hashlib.sha1(body).hexdigest()
+	set_updates_snapshot(key, etag, body)
+	return etag, body
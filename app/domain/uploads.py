@@ -2,14 +2,53 @@
 # SPDX-License-Identifier: AGPL-3.0-or-later
 # Copyright (C) 2018-2025 rubenwardy <rw@rubenwardy>
 
-import magic
+import collections
+import datetime
+import hashlib
+import itertools
 import os
+import sys
+import typing
 
+import magic
 from flask_babel import lazy_gettext, LazyString
+from sqlalchemy import event, inspect, update, select, func, union_all
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.orm import Session
 
 from app import app
 from app.domain.DomainError import DomainError
+from app.models import Upload, PackageRelease, PackageScreenshot, ReportAttachment, User
 from app.utils.misc import random_string
+from app.utils.models import create_session
+
+
+# Uploads are content-addressed: each file is stored once, named after the SHA-256 of its content.
+# The content is hashed whilst it's written to a temporary file, which is then renamed.
+#
+# Upload rows count the URLs that refer to each file. The counts are updated when a session that
+# changes a URL column is committed. `delete_unused_uploads` deletes files that have been
+# unreferenced for longer than UNUSED_UPLOAD_GRACE_PERIOD, which gives time for new uploads to be
+# referenced.
+#
+# URLs changed outside of the ORM, such as by bulk deletes or database cascades, aren't counted.
+# `recount_upload_references` fixes counts that are too high, so that their files can be deleted,
+# and runs before each clean up.
+
+
+UPLOAD_URL_PREFIX = "/uploads/"
+TEMP_PREFIX = ".tmp-"
+CHUNK_SIZE = 64 * 1024
+
+UNUSED_UPLOAD_GRACE_PERIOD = datetime.timedelta(days=1)
+
+# Columns containing upload URLs
+UPLOAD_COLUMNS = [
+	PackageRelease.url,
+	PackageScreenshot.url,
+	ReportAttachment.url,
+	User.profile_pic,
+]
 
 
 def get_extension(filename):
@@ -18,13 +57,96 @@ def get_extension(filename):
 
 ALLOWED_IMAGES = {"image/jpeg", "image/png", "image/webp"}
 
+# libmagic only needs the start of the file
+MAGIC_BYTES = 2048
+
 
 def is_allowed_image(data):
 	mime = magic.from_buffer(data, mime=True)
 	return mime in ALLOWED_IMAGES
 
 
-def upload_file(file, file_type: str, file_type_desc: LazyString | str, length: int=10):
+def get_upload_filename(url: typing.Optional[str]) -> typing.Optional[str]:
+	if url and url.startswith(UPLOAD_URL_PREFIX):
+		return url[len(UPLOAD_URL_PREFIX):]
+
+	return None
+
+
+def _store(temp_path: str, digest: str, size: int, ext: str) -> tuple[str, str]:
+	filename = f"{digest}.{ext}"
+	filepath = os.path.join(app.config["UPLOAD_DIR"], filename)
+
+	# The row is created or touched first, so that it can't be deleted as unused whilst the
+	# file is being moved into place
+	with create_session() as session:
+		now = datetime.datetime.utcnow()
+		session.execute(insert(Upload)
+				.values(filename=filename, digest=digest, size=size, ref_count=0, created_at=now, updated_at=now)
+				.on_conflict_do_update(index_elements=[Upload.filename], set_={ "updated_at": now }))
+		session.commit()
+
+	if os.path.isfile(filepath):
+		os.remove(temp_path)
+	else:
+		os.replace(temp_path, filepath)
+
+	return UPLOAD_URL_PREFIX + filename, filepath
+
+
+def store_stream(chunks: typing.Iterable[bytes], ext: str) -> tuple[str, str]:
+	"""
+	Writes chunks to the upload storage, returning the URL and path.
+
+	If the chunks raise an exception, nothing is stored.
+	"""
+	upload_dir = app.config["UPLOAD_DIR"]
+	temp_path = os.path.join(upload_dir, TEMP_PREFIX + random_string(10))
+
+	digest = hashlib.sha256()
+	size = 0
+	try:
+		with open(temp_path, "wb") as f:
+			for chunk in chunks:
+				digest.update(chunk)
+				size += len(chunk)
+				f.write(chunk)
+	except BaseException:
+		os.remove(temp_path)
+		raise
+
+	return _store(temp_path, digest.hexdigest(), size, ext)
+
+
+def _read_chunks(f: typing.BinaryIO) -> typing.Iterator[bytes]:
+	while True:
+		chunk = f.read(CHUNK_SIZE)
+		if not chunk:
+			return
+		yield chunk
+
+
+def store_file(path: str, ext: str) -> tuple[str, str]:
+	"""
+	Moves a file into the upload storage, returning the URL and path.
+	The file must be in UPLOAD_DIR, use `make_temp_upload_path`.
+	"""
+	digest = hashlib.sha256()
+	with open(path, "rb") as f:
+		for chunk in _read_chunks(f):
+			digest.update(chunk)
+
+	return _store(path, digest.hexdigest(), os.path.getsize(path), ext)
+
+
+def make_temp_upload_path() -> str:
+	"""
+	Returns a path in UPLOAD_DIR for a file that will be passed to `store_file`
+	"""
+	return os.path.join(app.config["UPLOAD_DIR"], TEMP_PREFIX + random_string(10))
+
+
+def upload_file(file, file_type: str, file_type_desc: LazyString | str):
 	if not file or file is None or file.filename == "":
 		raise DomainError(400, "Expected file")
 
@@ -46,13 +168,162 @@ def upload_file(file, file_type: str, file_type_desc: LazyString | str, length:
 	if ext is None or ext not in allowed_extensions:
 		raise DomainError(400, lazy_gettext("Please upload %(file_desc)s", file_desc=file_type_desc))
 
-	if is_image and not is_allowed_image(file.stream.read()):
+	if is_image and not is_allowed_image(file.stream.read(MAGIC_BYTES)):
 		raise DomainError(400, lazy_gettext("Uploaded image isn't actually an image"))
 
 	file.stream.seek(0)
 
-	filename = random_string(length) + "." + ext
-	filepath = os.path.join(app.config["UPLOAD_DIR"], filename)
-	file.save(filepath)
+	return store_stream(_read_chunks(file.stream), ext)
+
+
+def _get_ref_counts(session: Session, filenames: typing.Collection[str]) -> dict[str, int]:
+	urls = [UPLOAD_URL_PREFIX + x for x in filenames]
+	refs = union_all(*[select(column.label("url")).where(column.in_(urls)) for column in UPLOAD_COLUMNS]).subquery()
+	rows = select(refs.c.url, func.count()).group_by(refs.c.url)
+	return { get_upload_filename(url): count for url, count in session.execute(rows).all() }
+
+
+def recount_upload_references(session: Session) -> int:
+	"""
+	Fixes reference counts that don't match the URLs, then commits. Returns the number of counts fixed.
+	"""
+	refs = union_all(*[select(column.label("url")).where(column.startswith(UPLOAD_URL_PREFIX))
+			for column in UPLOAD_COLUMNS]).subquery()
+	counts = select(refs.c.url, func.count().label("count")).group_by(refs.c.url).subquery()
+	actual_count = func.coalesce(counts.c.count, 0)
+
+	# Counts are read in one statement, so that they're consistent with each other
+	rows = session.query(Upload.filename, Upload.ref_count, actual_count) \
+		.outerjoin(counts, counts.c.url == UPLOAD_URL_PREFIX + Upload.filename) \
+		.filter(Upload.ref_count != actual_count) \
+		.all()
+
+	now = datetime.datetime.utcnow()
+	fixed = 0
+	for filename, ref_count, actual in rows:
+		print(f"Upload {filename} has {actual} references, but the count was {ref_count}", file=sys.stderr)
+
+		# Skipped if the count was changed by a commit since it was read. Files get a new grace period,
+		# in case the count was too low
+		fixed += session.execute(update(Upload)
+				.where(Upload.filename == filename, Upload.ref_count == ref_count)
+				.values(ref_count=actual, updated_at=now)).rowcount
+
+	session.commit()
+	return fixed
+
+
+def delete_unused_uploads(session: Session, include_untracked: bool = False) -> tuple[int, int]:
+	"""
+	Deletes files that have been unreferenced for longer than the grace period, then commits.
+
+	Reference counts are checked before deleting, in case they were changed outside of the ORM.
+
+	:param include_untracked: also delete files in UPLOAD_DIR that don't have an Upload row
+	:returns: number of files deleted, and the number of bytes freed
+	"""
+	upload_dir = app.config["UPLOAD_DIR"]
+	cutoff = datetime.datetime.utcnow() - UNUSED_UPLOAD_GRACE_PERIOD
+
+	# Locks the rows, so that uploads of the same content wait until this commits
+	candidates = session.query(Upload) \
+		.filter(Upload.ref_count <= 0, Upload.updated_at < cutoff) \
+		.with_for_update(skip_locked=True).all()
+
+	actual_counts = _get_ref_counts(session, [x.filename for x in candidates]) if candidates else {}
+
+	deleted = 0
+	freed = 0
+	for upload in candidates:
+		ref_count = actual_counts.get(upload.filename, 0)
+		if ref_count > 0:
+			print(f"Upload {upload.filename} has {ref_count} references, but the count was {upload.ref_count}",
+					file=sys.stderr)
+			upload.ref_count = ref_count
+			continue
+
+		path = os.path.join(upload_dir, upload.filename)
+		try:
+			freed += os.path.getsize(path)
+			os.remove(path)
+		except FileNotFoundError:
+			pass
+
+		session.delete(upload)
+		deleted += 1
+
+	if include_untracked:
+		tracked = set([x[0] for x in session.query(Upload.filename).all()])
+		kept_backup = f"backup-{datetime.datetime.utcnow().strftime('%Y-%m-%d')}.zip"
+		for entry in os.scandir(upload_dir):
+			if not entry.is_file() or entry.name in tracked or entry.name == kept_backup:
+				continue
+
+			# Includes files being stored, whose row may have been created after `tracked` was read
+			stat = entry.stat()
+			if datetime.datetime.utcfromtimestamp(stat.st_mtime) > cutoff:
+				continue
+
+			os.remove(entry.path)
+			freed += stat.st_size
+			deleted += 1
+
+	session.commit()
+
+	return deleted, freed
+
+
+@event.listens_for(Session, "after_flush")
+def _track_upload_references(session: Session, _flush_context):
+	changes = collections.Counter()
+
+	for obj in itertools.chain(session.new, session.dirty, session.deleted):
+		for column in UPLOAD_COLUMNS:
+			if not isinstance(obj, column.class_):
+				continue
+
+			history = inspect(obj).attrs[column.key].history
+			if obj in session.deleted:
+				removed, added = itertools.chain(history.unchanged, history.deleted), []
+			else:
+				removed, added = history.deleted, history.added
+
+			for url in removed:
+				filename = get_upload_filename(url)
+				if filename:
+					changes[filename] -= 1
+
+			for url in added:
+				filename = get_upload_filename(url)
+				if filename:
+					changes[filename] += 1
+
+	if changes:
+		session.info.setdefault("upload_ref_changes", collections.Counter()).update(changes)
+
+
+@event.listens_for(Session, "before_commit")
+def _update_ref_counts_on_commit(session: Session):
+	if any(isinstance(obj, tuple(x.class_ for x in UPLOAD_COLUMNS))
+			for obj in itertools.chain(session.new, session.dirty, session.deleted)):
+		session.flush()
+
+	changes = session.info.pop("upload_ref_changes", None)
+	if not changes:
+		return
+
+	now = datetime.datetime.utcnow()
+	by_delta = collections.defaultdict(list)
+	for filename, delta in changes.items():
+		if delta != 0:
+			by_delta[delta].append(filename)
+
+	for delta, filenames in by_delta.items():
+		session.execute(update(Upload)
+				.where(Upload.filename.in_(filenames))
+				.values(ref_count=Upload.ref_count + delta, updated_at=now))
+
 
-	return "/uploads/" + filename, filepath
+@event.listens_for(Session, "after_rollback")
+def _clear_upload_changes(session: Session):
+	session.info.pop("upload_ref_changes", None)
@@ -0,0 +1,106 @@
+# ContentDB
+# SPDX-License-Identifier: AGPL-3.0-or-later
+# Copyright (C) 2018-2025 rubenwardy <rw@rubenwardy>
+
+import datetime
+import json
+import math
+from typing import Tuple, Optional
+
+from sqlalchemy import func, text
+
+from app.models import db, User, Package, PackageReview, PackageState, PackageType
+from app.rediscache import set_user_rankings, get_user_ranking
+
+
+# Rankings are computed for all users at once by a periodic task, so that profile pages
+# don't need site-wide queries to place one user.
+#
+# The ranking of a user may contain:
+#
+# * `review_place`: 0-indexed place when ordered by review karma, and `review_karma`
+# * `package_type` and `package_rank`: the user's best package rank, if it earns a medal
+# * `downloads`: total downloads of the user's approved packages
+#
+# Meta contains `review_boundary`, the karma needed to be in the top 25% of reviewers,
+# `reviewers`, the number of users with reviews, and `computed_at`.
+
+
+def compute_user_rankings() -> Tuple[dict, dict[int, dict]]:
+	"""
+	Returns (meta, rankings), where rankings maps from user id to ranking
+	"""
+	rankings: dict[int, dict] = {}
+
+	users_by_reviews = db.session.query(User.id, func.sum(PackageReview.score).label("karma")) \
+		.select_from(User).join(PackageReview) \
+		.group_by(User.id).order_by(text("karma DESC"), User.id).all()
+	try:
+		review_boundary = users_by_reviews[math.floor(len(users_by_reviews) * 0.25)][1] + 1
+	except IndexError:
+		review_boundary = None
+
+	for i, (user_id, karma) in enumerate(users_by_reviews):
+		rankings.setdefault(user_id, {}).update({
+			"review_place": i,
+			"review_karma": max(karma, 0),
+		})
+
+	all_package_ranks = db.session.query(
+			Package.type,
+			Package.author_id,
+			func.rank().over(
+					order_by=db.desc(Package.score),
+					partition_by=Package.type) \
+				.label("rank")) \
+		.filter_by(state=PackageState.APPROVED).subquery()
+
+	top_package_ranks = db.session.query(all_package_ranks) \
+		.filter(text("rank <= 30")) \
+		.order_by(db.asc(text("rank"))) \
+		.all()
+
+	for package_type, author_id, rank in top_package_ranks:
+		ranking = rankings.setdefault(author_id, {})
+		if "package_rank" not in ranking and (package_type == PackageType.MOD or rank <= 10):
+			ranking["package_type"] = package_type.name
+			ranking["package_rank"] = rank
+
+	downloads_by_author = db.session.query(Package.author_id, func.sum(Package.downloads)) \
+		.filter(Package.state == PackageState.APPROVED) \
+		.group_by(Package.author_id).all()
+	for author_id, downloads in downloads_by_author:
+		rankings.setdefault(author_id, {})["downloads"] = downloads
+
+	meta = {
+		"review_boundary": review_boundary,
+		"reviewers": len(users_by_reviews),
+		"computed_at": datetime.datetime.utcnow().isoformat(),
+	}
+	return meta, rankings
+
+
+def _store_user_rankings(meta: dict, rankings: dict[int, dict]):
+	set_user_rankings(json.dumps(meta), { user_id: json.dumps(ranking) for user_id, ranking in rankings.items() })
+
+
+def update_user_rankings() -> int:
+	"""
+	Computes and stores the rankings of all users, returning the number of users ranked
+	"""
+	meta, rankings = compute_user_rankings()
+	_store_user_rankings(meta, rankings)
+	return len(rankings)
+
+
+def get_ranking_for_user(user: User) -> Optional[Tuple[dict, dict]]:
+	"""
+	Returns (meta, ranking) for a user, or None if the rankings haven't been computed.
+	Rankings are never computed here, as every profile view would do so at once when they expire.
+	"""
+	entry = get_user_ranking(user.id)
+	if entry is None:
+		return None
+
+	meta, ranking = entry
+	return json.loads(meta), json.loads(ranking) if ranking else {}
@@ -288,6 +288,79 @@ class ForumTopic(db.Model):
 			raise Exception("Permission {} is not related to topics".format(perm.name))
 
 
+class Upload(db.Model):
+	"""
+	A file in UPLOAD_DIR, see app.domain.uploads
+	"""
+
+	filename   = db.Column(db.String(100), primary_key=True)
+
+	# SHA-256 of the content, null for files uploaded before uploads were content-addressed
+	digest     = db.Column(db.String(64), nullable=True, default=None)
+	size       = db.Column(db.BigInteger, nullable=True, default=None)
+
+	# Number of URLs in the database that refer to the file
+	ref_count  = db.Column(db.Integer, nullable=False, default=0)
+
+	created_at = db.Column(db.DateTime, nullable=False, default=datetime.datetime.utcnow)
+	updated_at = db.Column(db.DateTime, nullable=False, default=datetime.datetime.utcnow)
+
+
+class BulkJobItemState(enum.Enum):
+	PENDING = "pending"
+	RUNNING = "running"
+	SUCCESS = "success"
+	FAILURE = "failure"
+
+	def __str__(self):
+		return self.name
+
+
+class BulkJob(db.Model):
+	"""
+	A Celery task run for many items, see app.domain.bulk_jobs
+	"""
+
+	# A Celery task id, so that the job can be viewed using tasks.check
+	id          = db.Column(db.String(36), primary_key=True)
+	title       = db.Column(db.String(100), nullable=False)
+	task_name   = db.Column(db.String(100), nullable=False)
+	concurrency = db.Column(db.Integer, nullable=False)
+
+	created_at  = db.Column(db.DateTime, nullable=False, default=datetime.datetime.utcnow)
+	updated_at  = db.Column(db.DateTime, nullable=False, default=datetime.datetime.utcnow)
+	finished_at = db.Column(db.DateTime, nullable=True, default=None)
+
+	# Only the run_bulk_job chain with this token advances the job
+	lease_token      = db.Column(db.String(36), nullable=True, default=None)
+	lease_expires_at = db.Column(db.DateTime, nullable=True, default=None)
+
+	total       = db.Column(db.Integer, nullable=False, default=0)
+	succeeded   = db.Column(db.Integer, nullable=False, default=0)
+	failed      = db.Column(db.Integer, nullable=False, default=0)
+
+	items = db.relationship("BulkJobItem", back_populates="job", lazy="dynamic", cascade="all, delete, delete-orphan")
+
+	@property
+	def is_finished(self):
+		return self.finished_at is not None
+
+
+class BulkJobItem(db.Model):
+	id         = db.Column(db.Integer, primary_key=True)
+
+	job_id     = db.Column(db.String(36), db.ForeignKey("bulk_job.id", ondelete="CASCADE"), nullable=False, index=True)
+	job        = db.relationship("BulkJob", foreign_keys=[job_id], back_populates="items")
+
+	args       = db.Column(db.JSON, nullable=False)
+	state      = db.Column(db.Enum(BulkJobItemState), nullable=False, default=BulkJobItemState.PENDING)
+
+	task_id    = db.Column(db.String(36), nullable=True, default=None)
+	started_at = db.Column(db.DateTime, nullable=True, default=None)
+	attempts   = db.Column(db.Integer, nullable=False, default=0)
+	error      = db.Column(db.Text, nullable=True, default=None)
+
+
 if app.config.get("LOG_SQL"):
 	import logging
 	logging.basicConfig()
@@ -12,7 +12,7 @@ from flask import url_for
 from flask_babel import lazy_gettext, get_locale, gettext, pgettext
 from flask_sqlalchemy.query import Query
 from sqlalchemy import or_, func
-from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.dialects.postgresql import TSVECTOR
 from sqlalchemy_utils.types import TSVectorType
 
 from app import app
@@ -461,7 +461,13 @@ class Package(db.Model):
 	search_vector = db.Column(TSVectorType("name", "title", "short_desc", "desc",
 			weights={ "name": "A", "title": "B", "short_desc": "C" }))
 
-	__table_args__ = (db.UniqueConstraint("author_id", "name", name="_package_uc"),)
+	# The indexes on sort keys are used by cursor pagination, see QueryBuilder.get_cursor_keys
+	__table_args__ = (
+		db.UniqueConstraint("author_id", "name", name="_package_uc"),
+		db.Index("ix_package_score_id", "score", "id"),
+		db.Index("ix_package_downloads_id", "downloads", "id"),
+		db.Index("ix_package_created_at_id", "created_at", "id"),
+	)
 
 	license_id   = db.Column(db.Integer, db.ForeignKey("license.id"), nullable=False, default=1)
 	license      = db.relationship("License", foreign_keys=[license_id])
@@ -482,6 +488,11 @@ class Package(db.Model):
 	score_downloads = db.Column(db.Float, nullable=False, default=0)
 	downloads     = db.Column(db.Integer, nullable=False, default=0)
 
+	# Counts of approved reviews, kept up to date by app.domain.review_counts
+	reviews_positive = db.Column(db.Integer, nullable=False, default=0)
+	reviews_neutral  = db.Column(db.Integer, nullable=False, default=0)
+	reviews_negative = db.Column(db.Integer, nullable=False, default=0)
+
 	review_thread_id = db.Column(db.Integer, db.ForeignKey("thread.id"), nullable=True, default=None)
 	review_thread    = db.relationship("Thread", uselist=False, foreign_keys=[review_thread_id],
 			back_populates="is_review_thread", post_update=True)
@@ -704,15 +715,37 @@ class Package(db.Model):
 
 		return ret
 
-	def as_dict(self, base_url, version=None, lang="en", screenshots_dict=False):
-		tnurl = self.get_thumb_url(1, format="png")
-		release = self.get_download_release(version=version)
+	def as_dict(self, base_url, version=None, lang="en", screenshots_dict=False,
+			releases: typing.Optional[list["PackageRelease"]] = None,
+			screenshots: typing.Optional[list["PackageScreenshot"]] = None,
+			game_support: typing.Optional[list[dict]] = None):
+		"""
+		releases, screenshots, and game_support can be given to avoid querying them, such as when
+		they were loaded for many packages at once. game_support is in the format returned.
+		"""
+		if screenshots is None:
+			screenshots = self.screenshots.all()
+			tnurl = self.get_thumb_url(1, format="png")
+		else:
+			main_screenshot = next((ss for ss in screenshots if ss.approved), None)
+			tnurl = main_screenshot.get_thumb_url(1, format="png") if main_screenshot else None
+
+		release = self.get_download_release(version=version, releases=releases)
 		meta = self.get_translated(lang)
 
 		if screenshots_dict:
-			screenshots = [ss.as_short_dict(base_url) for ss in self.screenshots]
+			screenshots = [ss.as_short_dict(base_url) for ss in screenshots]
 		else:
-			screenshots = [base_url + ss.url for ss in self.screenshots]
+			screenshots = [base_url + ss.url for ss in screenshots]
+
+		if game_support is None:
+			game_support = [
+				{
+					"supports": support.supports,
+					"confidence": support.confidence,
+					"game": support.game.as_short_dict(base_url, version)
+				} for support in self.supported_games.all()
+			]
 
 		return {
 			"author": self.author.username,
@@ -757,13 +790,7 @@ class Package(db.Model):
 			"downloads": self.downloads,
 
 			"supports_all_games": self.supports_all_games,
-			"game_support": [
-				{
-					"supports": support.supports,
-					"confidence": support.confidence,
-					"game": support.game.as_short_dict(base_url, version)
-				} for support in self.supported_games.all()
-			]
+			"game_support": game_support,
 		}
 
 	def get_thumb_or_placeholder(self, level=2, format="webp"):
@@ -827,8 +854,12 @@ class Package(db.Model):
 		return url_for("packages.move_to_state",
 				author=self.author.username, name=self.name, state=state.name.lower())
 
-	def get_download_release(self, version=None) -> typing.Optional["PackageRelease"]:
-		for rel in self.releases:
+	def get_download_release(self, version=None, releases: typing.Optional[list["PackageRelease"]] = None) \
+			-> typing.Optional["PackageRelease"]:
+		"""
+		:param releases: the package's releases, newest first, to avoid querying them
+		"""
+		for rel in (self.releases if releases is None else releases):
 			if rel.approved and (version is None or
 					((rel.min_rel is None or rel.min_rel_id <= version.id) and
 					(rel.max_rel is None or rel.max_rel_id >= version.id))):
@@ -938,25 +969,7 @@ class Package(db.Model):
 			return "game.conf"
 
 	def get_review_summary(self):
-		from app.models import PackageReview
-		rows = (db.session.query(PackageReview.rating, func.count(PackageReview.id))
-			.select_from(PackageReview)
-			.where(PackageReview.package_id == self.id)
-			.group_by(PackageReview.rating)
-			.all())
-
-		negative = 0
-		neutral = 0
-		positive = 0
-		for rating, count in rows:
-			if rating > 3:
-				positive += count
-			elif rating == 3:
-				neutral += count
-			else:
-				negative += count
-
-		return [positive, neutral, negative]
+		return [self.reviews_positive, self.reviews_neutral, self.reviews_negative]
 
 	def get_review_descriptor(self):
 		[positive, neutral, negative] = self.get_review_summary()
@@ -981,6 +994,9 @@ class Package(db.Model):
 			return [lazy_gettext("Negative (%(perc)d%% of %(total)d)", perc=perc, total=total), "text-danger"]
 
 
+db.Index("ix_package_approved_at_id", func.coalesce(Package.approved_at, Package.created_at), Package.id)
+
+
 class Language(db.Model):
 	id = db.Column(db.String(10), primary_key=True)
 	title = db.Column(db.String(100), unique=True, nullable=False)
@@ -1011,6 +1027,18 @@ class PackageTranslation(db.Model):
 	desc = db.Column(db.UnicodeText, nullable=True)
 
 
+class PackageSearchDocument(db.Model):
+	"""
+	Weighted search vector of a package in one language, kept up to date by app.domain.search
+	"""
+
+	package_id = db.Column(db.Integer, db.ForeignKey("package.id", ondelete="CASCADE"), primary_key=True)
+	language_id = db.Column(db.String(10), db.ForeignKey("language.id"), primary_key=True)
+	vector = db.Column(TSVECTOR, nullable=False)
+
+	__table_args__ = (db.Index("ix_package_search_document_vector", "vector", postgresql_using="gin"),)
+
+
 class MetaPackage(db.Model):
 	id = db.Column(db.Integer, primary_key=True)
 	name = db.Column(db.String(100), unique=True, nullable=False)
@@ -1227,6 +1255,8 @@ class PackageRelease(db.Model):
 	title        = db.Column(db.String(100), nullable=False)
 	created_at  = db.Column(db.DateTime,    nullable=False)
 	url          = db.Column(db.String(200), nullable=False, default="")
+
+	__table_args__ = (db.Index("ix_package_release_created_at_id", "created_at", "id"),)
 	state     = db.Column(db.Enum(ReleaseState), nullable=False, default=ReleaseState.PROCESSING)
 
 	@property
@@ -1584,59 +1614,12 @@ class PackageDailyStats(db.Model):
 
 	views_luanti = db.Column(db.Integer, nullable=False, default=0)
 
-	@staticmethod
-	def notify_download(package: Package, is_luanti: bool, is_v510: bool, reason: str):
-		date = datetime.datetime.utcnow().date()
-
-		to_update = dict()
-		kwargs = {
-			"package_id": package.id, "date": date
-		}
-
-		field_platform = "platform_minetest" if is_luanti else "platform_other"
-		to_update[field_platform] = getattr(PackageDailyStats, field_platform) + 1
-		kwargs[field_platform] = 1
-
-		field_reason = None
-		if reason == "new":
-			field_reason = "reason_new"
-		elif reason == "dependency":
-			field_reason = "reason_dependency"
-		elif reason == "update":
-			field_reason = "reason_update"
-
-		if field_reason:
-			to_update[field_reason] = getattr(PackageDailyStats, field_reason) + 1
-			kwargs[field_reason] = 1
-
-		if is_v510:
-			to_update["downloads_v510"] = PackageDailyStats.downloads_v510 + 1
-			kwargs["downloads_v510"] = 1
-
-		stmt = insert(PackageDailyStats).values(**kwargs)
-		stmt = stmt.on_conflict_do_update(
-			index_elements=[PackageDailyStats.package_id, PackageDailyStats.date],
-			set_=to_update
-		)
-
-		conn = db.session.connection()
-		conn.execute(stmt)
-
-	@staticmethod
-	def notify_view(package: Package, is_luanti: bool):
-		if not is_luanti:
-			return
-
-		date = datetime.datetime.utcnow().date()
-
-		to_update = {"views_luanti": PackageDailyStats.views_luanti + 1}
-		kwargs = {"package_id": package.id, "date": date, "views_luanti": 1}
 
-		stmt = insert(PackageDailyStats).values(**kwargs)
-		stmt = stmt.on_conflict_do_update(
-			index_elements=[PackageDailyStats.package_id, PackageDailyStats.date],
-			set_=to_update
-		)
+class StatsBufferFlush(db.Model):
+	"""
+	Records a batch of buffered download/view counters that has been written to the database,
+	so that a batch is never applied twice if a worker dies before clearing it from Redis.
+	"""
 
-		conn = db.session.connection()
-		conn.execute(stmt)
+	id = db.Column(db.String(32), primary_key=True)
+	flushed_at = db.Column(db.DateTime, nullable=False, default=datetime.datetime.utcnow)
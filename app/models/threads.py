@@ -3,7 +3,7 @@
 # Copyright (C) 2018-2025 rubenwardy <rw@rubenwardy>
 
 import datetime
-from typing import Tuple, List
+from typing import Tuple, Iterable
 
 from flask import url_for
 from sqlalchemy import select, func, text
@@ -172,6 +172,8 @@ class PackageReview(db.Model):
 
 	created_at = db.Column(db.DateTime, nullable=False, default=datetime.datetime.utcnow)
 
+	__table_args__ = (db.Index("ix_package_review_created_at_id", "created_at", "id"),)
+
 	author_id  = db.Column(db.Integer, db.ForeignKey("user.id"), nullable=False)
 	author     = db.relationship("User", foreign_keys=[author_id], back_populates="reviews")
 
@@ -185,14 +187,38 @@ class PackageReview(db.Model):
 	thread     = db.relationship("Thread", uselist=False, back_populates="review")
 	votes      = db.relationship("PackageReviewVote", back_populates="review", cascade="all, delete, delete-orphan")
 
+	# Kept up to date by app.domain.review_counts
 	score      = db.Column(db.Integer, nullable=False, default=1)
+	votes_helpful   = db.Column(db.Integer, nullable=False, default=0)
+	votes_unhelpful = db.Column(db.Integer, nullable=False, default=0)
+
+	@staticmethod
+	def load_user_votes(reviews: Iterable["PackageReview"], current_user):
+		"""
+		Loads the user's votes on reviews using one query, so that get_totals() doesn't need to query for each review
+		"""
+		reviews = list(reviews)
+		if current_user is None or not current_user.is_authenticated or len(reviews) == 0:
+			return
+
+		votes = dict(db.session.query(PackageReviewVote.review_id, PackageReviewVote.is_positive)
+				.filter(PackageReviewVote.user_id == current_user.id,
+						PackageReviewVote.review_id.in_([review.id for review in reviews]))
+				.all())
+		for review in reviews:
+			review._user_vote = (current_user.id, votes.get(review.id))
 
 	def get_totals(self, current_user = None) -> Tuple[int,int,bool]:
-		votes: List[PackageReviewVote] = self.votes
-		pos = sum([ 1 for vote in votes if vote.is_positive ])
-		neg = sum([ 1 for vote in votes if not vote.is_positive])
-		user_vote = next(filter(lambda vote: vote.user == current_user, votes), None)
-		return pos, neg, user_vote.is_positive if user_vote else None
+		is_positive = None
+		if current_user is not None and current_user.is_authenticated:
+			loaded = getattr(self, "_user_vote", None)
+			if loaded is not None and loaded[0] == current_user.id:
+				is_positive = loaded[1]
+			else:
+				user_vote = PackageReviewVote.query.filter_by(review_id=self.id, user_id=current_user.id).first()
+				is_positive = user_vote.is_positive if user_vote else None
+
+		return self.votes_helpful, self.votes_unhelpful, is_positive
 
 	def as_dict(self, include_package=False):
 		pos, neg, _user = self.get_totals()
@@ -250,10 +276,6 @@ class PackageReview(db.Model):
 				review_id=self.id,
 				r=next_url)
 
-	def update_score(self):
-		(pos, neg, _) = self.get_totals()
-		self.score = 3 * (pos - neg) + 1
-
 	def check_perm(self, user, perm):
 		if type(perm) == str:
 			perm = Permission[perm]
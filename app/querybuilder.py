@@ -8,13 +8,15 @@ from flask_babel import lazy_gettext, gettext, get_locale
 from sqlalchemy import or_, and_
 from sqlalchemy.orm import subqueryload, joinedload
 from sqlalchemy.sql.expression import func
-from sqlalchemy_searchable import search
 from urllib.parse import urlparse
 
 from .models import db, PackageType, Package, ForumTopic, License, LuantiRelease, PackageRelease, User, Tag, \
 	ContentWarning, PackageState, PackageDevState, ReleaseState, PackageAIDisclosure, PackageTranslation
+from app.domain.search import search_packages
 from app.utils.misc import is_yes
+from app.utils.reference_data import get_tag, get_content_warning, get_license, get_license_names, get_luanti_release
 from app.utils.flask import get_int_or_abort
+from app.utils.pagination import CursorPagination, paginate_by_cursor
 
 
 class QueryBuilder:
@@ -106,7 +108,7 @@ class QueryBuilder:
 
 		# Get tags types
 		tags = args.getlist("tag")
-		tags = [Tag.query.filter_by(name=tname).first() for tname in tags]
+		tags = [get_tag(tname) for tname in tags]
 		if not emit_http_errors:
 			tags = [tag for tag in tags if tag is not None]
 		elif any([tag is None for tag in tags]):
@@ -117,7 +119,7 @@ class QueryBuilder:
 
 		self.hide_tags = []
 		for flag in set(self.hide_flags):
-			tag = Tag.query.filter_by(name=flag).first()
+			tag = get_tag(flag)
 			if tag is not None:
 				self.hide_tags.append(tag)
 				self.hide_flags.remove(flag)
@@ -126,11 +128,9 @@ class QueryBuilder:
 		self.flags = set(args.getlist("flag"))
 
 		# License
-		self.licenses = [License.query.filter(func.lower(License.name) == name.lower()).first() for name in args.getlist("license")]
+		self.licenses = [get_license(name) for name in args.getlist("license")]
 		if emit_http_errors and any(map(lambda x: x is None, self.licenses)):
-			all_licenses = db.session.query(License.name).order_by(db.asc(License.name)).all()
-			all_licenses = [x[0] for x in all_licenses]
-			abort(make_response("Unknown license. Expected license name from: " + ", ".join(all_licenses)), 400)
+			abort(make_response("Unknown license. Expected license name from: " + ", ".join(get_license_names())), 400)
 
 		self.types  = types
 		self.tags   = tags
@@ -169,7 +169,7 @@ class QueryBuilder:
 			engine_version = None
 
 		if protocol_version or engine_version:
-			version = LuantiRelease.get(engine_version, protocol_version)
+			version = get_luanti_release(engine_version, protocol_version)
 		else:
 			version = None
 
@@ -264,6 +264,20 @@ class QueryBuilder:
 
 		return query
 
+	def build_facet_query(self):
+		"""
+		Returns the packages matching the filters and search, unordered, for `get_package_facets`
+		"""
+		query = Package.query
+		if self.only_approved:
+			query = query.filter(Package.state == PackageState.APPROVED)
+
+		query = self.filter_package_query(query)
+		if self.search:
+			query = search_packages(query, self.search, self.lang, sort=False)
+
+		return query
+
 	def filter_package_query(self, query):
 		if len(self.types) > 0:
 			query = query.filter(Package.type.in_(self.types))
@@ -287,19 +301,21 @@ class QueryBuilder:
 		for tag in self.hide_tags:
 			query = query.filter(~Package.tags.contains(tag))
 
-		if "genai" in self.hide_flags or "anyai" in self.hide_flags:
-			self.hide_flags.discard("genai")
+		# Copied so that the query can be built more than once
+		hide_flags = set(self.hide_flags)
+		if "genai" in hide_flags or "anyai" in hide_flags:
+			hide_flags.discard("genai")
 			query = query.filter(Package.ai_disclosure != PackageAIDisclosure.GENERATED)
 
-			if "anyai" in self.hide_flags:
-				self.hide_flags.discard("anyai")
+			if "anyai" in hide_flags:
+				hide_flags.discard("anyai")
 				query = query.filter(Package.ai_disclosure != PackageAIDisclosure.ASSISTED)
 
-		if "*" in self.hide_flags:
+		if "*" in hide_flags:
 			query = query.filter(~ Package.content_warnings.any())
 		else:
-			for flag in self.hide_flags:
-				warning = ContentWarning.query.filter_by(name=flag).first()
+			for flag in hide_flags:
+				warning = get_content_warning(flag)
 				if warning:
 					query = query.filter(~ Package.content_warnings.any(ContentWarning.id == warning.id))
 				elif self.emit_http_errors:
@@ -321,7 +337,7 @@ class QueryBuilder:
 			flags.discard("*")
 		else:
 			for flag in flags:
-				warning = ContentWarning.query.filter_by(name=flag).first()
+				warning = get_content_warning(flag)
 				if warning:
 					query = query.filter(Package.content_warnings.any(ContentWarning.id == warning.id))
 
@@ -352,7 +368,7 @@ class QueryBuilder:
 
 	def order_package_query(self, query):
 		if self.search:
-			query = search(query, self.search, sort=self.order_by is None)
+			query = search_packages(query, self.search, self.lang, sort=self.order_by is None)
 
 		if self.random:
 			query = query.order_by(func.random())
@@ -393,6 +409,37 @@ class QueryBuilder:
 
 		return query
 
+	def get_cursor_keys(self) -> Optional[list]:
+		"""
+		Returns the columns to order by for cursor pagination, or None if the sort order isn't supported
+		"""
+		if self.random or (self.search and self.order_by is None):
+			return None
+
+		order_by = self.order_by or "score"
+		if order_by == "score":
+			return [Package.score, Package.id]
+		elif order_by == "reviews":
+			return [Package.score - Package.score_downloads, Package.id]
+		elif order_by == "downloads":
+			return [Package.downloads, Package.id]
+		elif order_by == "created_at" or order_by == "date":
+			return [Package.created_at, Package.id]
+		elif order_by == "approved_at":
+			return [func.coalesce(Package.approved_at, Package.created_at), Package.id]
+		elif order_by == "last_release":
+			return [PackageRelease.created_at, PackageRelease.id]
+
+		return None
+
+	def paginate_by_cursor(self, query, cursor: Optional[str], per_page: int, count: bool = True) -> CursorPagination:
+		keys = self.get_cursor_keys()
+		if keys is None:
+			abort(make_response("Cursor pagination isn't supported for this sort order"), 400)
+
+		return paginate_by_cursor(query, f"{self.order_by or 'score'}/{self.order_dir}", keys,
+				self.order_dir != "asc", cursor, per_page, count)
+
 	def build_topic_query(self, show_added=False):
 		query = ForumTopic.query
 
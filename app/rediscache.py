@@ -2,8 +2,18 @@
 # SPDX-License-Identifier: AGPL-3.0-or-later
 # Copyright (C) 2018-2025 rubenwardy <rw@rubenwardy>
 
+import itertools
+import json
+import typing
+import uuid
+
+import redis
+from sqlalchemy import event, inspect
+from sqlalchemy.orm import Session
+
 from . import redis_client
-from .models import Package
+from .models import Package, PackageRelease, PackageAlias, PackageScreenshot, PackageReview, Tag, User, \
+	Dependency, PackageGameSupport, ContentWarning, License, LuantiRelease, Language
 
 # This file acts as a facade between the rest of the code and redis,
 # and also means that the rest of the code avoids knowing about `app`
@@ -32,9 +42,466 @@ def has_key(key):
 	return redis_client.exists(key)
 
 
-def increment_key(key):
-	redis_client.incrby(key, 1)
+def increment_key(key, amount: int = 1):
+	redis_client.incrby(key, amount)
 
 
 def get_key(key, default=None):
 	return redis_client.get(key) or default
+
+
+def get_lock(name: str, timeout: int, blocking_timeout: typing.Optional[float] = None) -> redis.lock.Lock:
+	"""
+	Returns a lock shared by all processes. It expires after `timeout` seconds,
+	and acquiring it gives up after waiting `blocking_timeout` seconds, or as long as `timeout` if not given.
+	"""
+	return redis_client.lock(f"lock/{name}", timeout=timeout,
+			blocking_timeout=timeout if blocking_timeout is None else blocking_timeout)
+
+
+# Shared API response cache
+#
+# Entries are keyed on a generation number, so bumping the generation invalidates
+# every cached response at once without having to scan for keys.
+
+RESPONSE_CACHE_GENERATION_KEY = "api_cache/generation"
+RESPONSE_CACHE_HITS_KEY = "api_cache/hits"
+RESPONSE_CACHE_MISSES_KEY = "api_cache/misses"
+
+
+def make_response_cache_key(endpoint: str, view_args: dict, args: list[tuple[str, str]], lang: str) -> str:
+	generation = int(get_key(RESPONSE_CACHE_GENERATION_KEY, "0"))
+	view_args_str = "&".join(f"{key}={value}" for key, value in sorted(view_args.items()))
+	query_str = "&".join(f"{key}={value}" for key, value in sorted(args))
+	return f"api_cache/{generation}/{endpoint}/{view_args_str}?{query_str}#{lang}"
+
+
+def get_cached_response(key: str) -> typing.Optional[tuple[str, bytes]]:
+	value = redis_client.get(key)
+	if value is None:
+		increment_key(RESPONSE_CACHE_MISSES_KEY)
+		return None
+
+	increment_key(RESPONSE_CACHE_HITS_KEY)
+	mimetype, body = value.split(b"\n", 1)
+	return mimetype.decode("utf-8"), body
+
+
+def set_cached_response(key: str, mimetype: str, body: bytes, max_age: int):
+	redis_client.set(key, mimetype.encode("utf-8") + b"\n" + body, ex=max_age)
+
+
+def invalidate_response_cache():
+	increment_key(RESPONSE_CACHE_GENERATION_KEY)
+
+
+# Snapshot of the latest release per package, used by /api/updates/
+
+UPDATES_SNAPSHOT_GENERATION_KEY = "updates/generation"
+UPDATES_SNAPSHOT_EXPIRY_S = 24*60*60
+
+
+def make_updates_snapshot_key(luanti_release_id: typing.Optional[int]) -> str:
+	generation = int(get_key(UPDATES_SNAPSHOT_GENERATION_KEY, "0"))
+	return f"updates/{generation}/{luanti_release_id or 'all'}"
+
+
+def get_updates_snapshot(key: str) -> typing.Optional[tuple[str, bytes]]:
+	value = redis_client.get(key)
+	if value is None:
+		return None
+
+	etag, body = value.split(b"\n", 1)
+	return etag.decode("utf-8"), body
+
+
+def set_updates_snapshot(key: str, etag: str, body: bytes):
+	redis_client.set(key, etag.encode("utf-8") + b"\n" + body, ex=UPDATES_SNAPSHOT_EXPIRY_S)
+
+
+def invalidate_updates_snapshot():
+	increment_key(UPDATES_SNAPSHOT_GENERATION_KEY)
+
+
+# Buffered download and view counters
+#
+# Counters are accumulated in a hash and periodically flushed to the database. A flush renames the
+# hash to a batch key first, so new counts go to a fresh hash while the batch is being written.
+
+STATS_BUFFER_KEY = "stats_buffer/pending"
+STATS_BUFFER_BATCH_PREFIX = "stats_buffer/batch/"
+
+
+def buffer_stats(increments: dict[str, typing.Union[int, float]]):
+	pipe = redis_client.pipeline()
+	for field, amount in increments.items():
+		if isinstance(amount, float):
+			pipe.hincrbyfloat(STATS_BUFFER_KEY, field, amount)
+		else:
+			pipe.hincrby(STATS_BUFFER_KEY, field, amount)
+	pipe.execute()
+
+
+def take_buffered_stats() -> typing.Optional[tuple[str, dict[str, str]]]:
+	"""
+	Returns the id and counters of the next batch to flush, or None if there's nothing to do.
+	A batch left behind by an interrupted flush is returned before a new one is started.
+	"""
+	for key in redis_client.scan_iter(match=STATS_BUFFER_BATCH_PREFIX + "*"):
+		batch_id = key.decode("utf-8")[len(STATS_BUFFER_BATCH_PREFIX):]
+		return batch_id, _decode_hash(redis_client.hgetall(key))
+
+	batch_id = uuid.uuid4().hex
+	try:
+		redis_client.rename(STATS_BUFFER_KEY, STATS_BUFFER_BATCH_PREFIX + batch_id)
+	except redis.exceptions.ResponseError:
+		# Nothing buffered
+		return None
+
+	return batch_id, _decode_hash(redis_client.hgetall(STATS_BUFFER_BATCH_PREFIX + batch_id))
+
+
+def delete_buffered_stats(batch_id: str):
+	redis_client.delete(STATS_BUFFER_BATCH_PREFIX + batch_id)
+
+
+def _decode_hash(values: dict[bytes, bytes]) -> dict[str, str]:
+	return {key.decode("utf-8"): value.decode("utf-8") for key, value in values.items()}
+
+
+# Log of packages whose game support inputs have changed
+#
+# Workers keep the game support graph in memory and use this log to reload only the packages that
+# have changed since. A position is the number of entries ever written; old entries are trimmed and
+# counted in the offset, so a worker that has fallen too far behind knows to reload everything.
+
+GAME_SUPPORT_CHANGES_KEY = "game_support/changes"
+GAME_SUPPORT_CHANGES_OFFSET_KEY = "game_support/changes_offset"
+GAME_SUPPORT_CHANGES_MAX = 10000
+
+# Logged when every package needs to be reloaded
+GAME_SUPPORT_CHANGED_ALL = "*"
+
+
+def record_game_support_changes(package_ids: typing.Iterable[typing.Union[int, str]]):
+	package_ids = [str(x) for x in package_ids]
+	if len(package_ids) == 0:
+		return
+
+	length = redis_client.rpush(GAME_SUPPORT_CHANGES_KEY, *package_ids)
+	if length > GAME_SUPPORT_CHANGES_MAX:
+		to_remove = length - GAME_SUPPORT_CHANGES_MAX // 2
+		pipe = redis_client.pipeline(transaction=True)
+		pipe.ltrim(GAME_SUPPORT_CHANGES_KEY, to_remove, -1)
+		pipe.incrby(GAME_SUPPORT_CHANGES_OFFSET_KEY, to_remove)
+		pipe.execute()
+
+
+def get_game_support_changes(position: typing.Optional[int]) -> tuple[int, typing.Optional[list[str]]]:
+	"""
+	Returns the current position and the package ids changed since `position`.
+	The list is None if the changes since `position` are no longer known.
+	"""
+	with redis_client.pipeline() as pipe:
+		while True:
+			try:
+				pipe.watch(GAME_SUPPORT_CHANGES_OFFSET_KEY)
+				offset = int(pipe.get(GAME_SUPPORT_CHANGES_OFFSET_KEY) or 0)
+				start = 0 if position is None or position < offset else position - offset
+
+				pipe.multi()
+				pipe.lrange(GAME_SUPPORT_CHANGES_KEY, start, -1)
+				entries = [x.decode("utf-8") for x in pipe.execute()[0]]
+
+				new_position = offset + start + len(entries)
+				if position is None or position < offset:
+					return new_position, None
+
+				return new_position, entries
+			except redis.exceptions.WatchError:
+				continue
+
+
+# Packages whose reviews changed, for incremental score updates
+
+SCORE_CHANGES_KEY = "package_scores/changed"
+
+
+def record_score_changes(package_ids: typing.Iterable[int]):
+	package_ids = list(package_ids)
+	if len(package_ids) > 0:
+		redis_client.sadd(SCORE_CHANGES_KEY, *package_ids)
+
+
+def take_score_changes() -> set[int]:
+	pipe = redis_client.pipeline(transaction=True)
+	pipe.smembers(SCORE_CHANGES_KEY)
+	pipe.delete(SCORE_CHANGES_KEY)
+	members, _ = pipe.execute()
+	return set([int(x) for x in members])
+
+
+# User rankings, used for profile medals
+#
+# A hash from user id to that user's ranking, plus the "meta" field with site-wide values.
+# It's replaced as a whole so readers never see a partially written ranking.
+# Rankings are updated hourly, but kept for longer so that stale rankings can be shown if an update fails.
+
+USER_RANKINGS_KEY = "user_rankings"
+USER_RANKINGS_META_FIELD = "meta"
+USER_RANKINGS_EXPIRY_S = 24*60*60
+USER_RANKINGS_REBUILD_KEY = "user_rankings/rebuild"
+USER_RANKINGS_REBUILD_EXPIRY_S = 10*60
+
+
+def set_user_rankings(meta: str, rankings: dict[int, str]):
+	temp_key = f"{USER_RANKINGS_KEY}/{uuid.uuid4().hex}"
+	pipe = redis_client.pipeline(transaction=True)
+	pipe.hset(temp_key, mapping={ USER_RANKINGS_META_FIELD: meta, **rankings })
+	pipe.expire(temp_key, USER_RANKINGS_EXPIRY_S)
+	pipe.rename(temp_key, USER_RANKINGS_KEY)
+	pipe.delete(USER_RANKINGS_REBUILD_KEY)
+	pipe.execute()
+
+
+def claim_user_rankings_rebuild() -> bool:
+	"""
+	Returns True if the caller should start rebuilding the rankings, so that only one rebuild
+	is started at once when they're missing
+	"""
+	return bool(redis_client.set(USER_RANKINGS_REBUILD_KEY, "1", nx=True, ex=USER_RANKINGS_REBUILD_EXPIRY_S))
+
+
+def get_user_ranking(user_id: int) -> typing.Optional[tuple[str, typing.Optional[str]]]:
+	"""
+	Returns (meta, ranking), or None if the rankings have expired
+	"""
+	meta, ranking = redis_client.hmget(USER_RANKINGS_KEY, [USER_RANKINGS_META_FIELD, str(user_id)])
+	if meta is None:
+		return None
+
+	return meta.decode("utf-8"), ranking.decode("utf-8") if ranking else None
+
+
+# Aggregate metrics, computed periodically by a task
+
+METRICS_KEY = "metrics/aggregate"
+METRICS_EXPIRY_S = 60*60
+
+
+def set_cached_metrics(updated_at: float, body: str):
+	redis_client.set(METRICS_KEY, f"{updated_at}\n{body}".encode("utf-8"), ex=METRICS_EXPIRY_S)
+
+
+def get_cached_metrics() -> typing.Optional[tuple[float, str]]:
+	value = redis_client.get(METRICS_KEY)
+	if value is None:
+		return None
+
+	updated_at, body = value.decode("utf-8").split("\n", 1)
+	return float(updated_at), body
+
+
+# Query statistics per endpoint and task, see app/utils/query_stats.py
+#
+# A hash per kind, with `<name>/<stat>` fields
+
+QUERY_STATS_PREFIX = "query_stats/"
+QUERY_STATS_FIELDS = ["runs", "queries", "seconds", "repeated"]
+
+
+def record_query_stats(kind: str, name: str, queries: int, seconds: float, repeated: int):
+	key = QUERY_STATS_PREFIX + kind
+	pipe = redis_client.pipeline(transaction=False)
+	pipe.hincrby(key, f"{name}/runs", 1)
+	pipe.hincrby(key, f"{name}/queries", queries)
+	pipe.hincrbyfloat(key, f"{name}/seconds", seconds)
+	if repeated > 0:
+		pipe.hincrby(key, f"{name}/repeated", repeated)
+	pipe.execute()
+
+
+def get_query_stats(kind: str) -> dict[str, dict[str, float]]:
+	"""
+	Returns a map from endpoint or task name to its totals
+	"""
+	ret = {}
+	for field, value in _decode_hash(redis_client.hgetall(QUERY_STATS_PREFIX + kind)).items():
+		name, stat = field.rsplit("/", 1)
+		ret.setdefault(name, { x: 0 for x in QUERY_STATS_FIELDS })[stat] = float(value)
+
+	return ret
+
+
+# Reference data, see app/utils/reference_data.py
+#
+# Each change increments the version and publishes it, so that processes can reload their caches.
+
+REFERENCE_DATA_VERSION_KEY = "reference_data/version"
+REFERENCE_DATA_CHANNEL = "reference_data/changed"
+
+
+def get_reference_data_version() -> int:
+	return int(get_key(REFERENCE_DATA_VERSION_KEY, "0"))
+
+
+def publish_reference_data_changed():
+	version = redis_client.incr(REFERENCE_DATA_VERSION_KEY)
+	redis_client.publish(REFERENCE_DATA_CHANNEL, version)
+
+
+def subscribe_to_reference_data() -> redis.client.PubSub:
+	subscription = redis_client.pubsub()
+	subscription.subscribe(REFERENCE_DATA_CHANNEL)
+	return subscription
+
+
+def has_reference_data_changed(subscription: redis.client.PubSub, version: int) -> bool:
+	"""
+	Reads messages published since the last call without blocking, returning whether a version
+	newer than `version` was published. Returns True if the subscription was interrupted, as
+	messages may have been missed.
+	"""
+	changed = False
+	try:
+		while True:
+			message = subscription.get_message(timeout=0.0)
+			if message is None:
+				return changed
+			if message["type"] == "message" and int(message["data"]) > version:
+				changed = True
+	except redis.exceptions.ConnectionError:
+		return True
+
+
+# Link checker results, see app/utils/link_checker.py
+#
+# Failures expire sooner, so that temporary problems are rechecked
+
+LINK_CHECK_PREFIX = "link_check/"
+LINK_CHECK_OK_EXPIRY_S = 3*24*60*60
+LINK_CHECK_FAILED_EXPIRY_S = 6*60*60
+
+
+def get_link_check_results(urls: list[str]) -> dict[str, str]:
+	"""
+	Returns a map from URL to cached result, for URLs that have one
+	"""
+	if len(urls) == 0:
+		return {}
+
+	values = redis_client.mget([LINK_CHECK_PREFIX + url for url in urls])
+	return { url: value.decode("utf-8") for url, value in zip(urls, values) if value is not None }
+
+
+def set_link_check_results(results: dict[str, str]):
+	pipe = redis_client.pipeline(transaction=False)
+	for url, result in results.items():
+		pipe.set(LINK_CHECK_PREFIX + url, result,
+				ex=LINK_CHECK_OK_EXPIRY_S if result == "" else LINK_CHECK_FAILED_EXPIRY_S)
+	pipe.execute()
+
+
+# Pages of forum topic lists, see ForumTopicFetcher in app/utils/phpbbparser.py
+
+FORUM_PAGE_PREFIX = "forum_page/"
+FORUM_PAGE_EXPIRY_S = 7*24*60*60
+
+
+def get_forum_pages(urls: list[str]) -> dict[str, dict]:
+	if len(urls) == 0:
+		return {}
+
+	values = redis_client.mget([FORUM_PAGE_PREFIX + url for url in urls])
+	return { url: json.loads(value) for url, value in zip(urls, values) if value is not None }
+
+
+def set_forum_pages(pages: dict[str, dict]):
+	pipe = redis_client.pipeline(transaction=False)
+	for url, page in pages.items():
+		pipe.set(FORUM_PAGE_PREFIX + url, json.dumps(page), ex=FORUM_PAGE_EXPIRY_S)
+	pipe.execute()
+
+
+# Invalidation on write
+
+_RESPONSE_CACHE_MODELS = (Package, PackageRelease, PackageAlias, PackageScreenshot, PackageReview, Tag)
+_REFERENCE_DATA_MODELS = (Tag, ContentWarning, License, LuantiRelease, Language)
+
+
+def _has_changed(obj, *attrs: str) -> bool:
+	state = inspect(obj)
+	return any(state.attrs[attr].history.has_changes() for attr in attrs)
+
+
+def _affects_updates_snapshot(obj, is_new_or_deleted: bool) -> bool:
+	if isinstance(obj, PackageAlias):
+		return True
+	elif isinstance(obj, PackageRelease):
+		return is_new_or_deleted or _has_changed(obj, "state", "min_rel_id", "max_rel_id", "package_id")
+	elif isinstance(obj, Package):
+		return is_new_or_deleted or _has_changed(obj, "state", "name", "author_id")
+	elif isinstance(obj, User):
+		return not is_new_or_deleted and _has_changed(obj, "username")
+
+	return False
+
+
+def _get_game_support_change(obj, is_new_or_deleted: bool) -> typing.Optional[typing.Union[int, str]]:
+	if isinstance(obj, Package):
+		if is_new_or_deleted or _has_changed(obj, "state", "type", "name", "author_id", "provides",
+				"supports_all_games", "enable_game_support_detection"):
+			return obj.id
+	elif isinstance(obj, Dependency):
+		return obj.depender_id
+	elif isinstance(obj, PackageGameSupport):
+		# Detected support (confidence 1) is an output, not an input
+		if obj.confidence != 1:
+			return obj.package_id
+	elif isinstance(obj, User):
+		if not is_new_or_deleted and _has_changed(obj, "username"):
+			return GAME_SUPPORT_CHANGED_ALL
+
+	return None
+
+
+@event.listens_for(Session, "after_flush")
+def _track_cache_changes(session: Session, _flush_context):
+	for obj, is_new_or_deleted in itertools.chain(
+			((obj, True) for obj in session.new),
+			((obj, False) for obj in session.dirty),
+			((obj, True) for obj in session.deleted)):
+		if isinstance(obj, _RESPONSE_CACHE_MODELS):
+			session.info["invalidate_response_cache"] = True
+		if isinstance(obj, _REFERENCE_DATA_MODELS):
+			session.info["reference_data_changed"] = True
+		if _affects_updates_snapshot(obj, is_new_or_deleted):
+			session.info["invalidate_updates_snapshot"] = True
+
+		game_support_change = _get_game_support_change(obj, is_new_or_deleted)
+		if game_support_change is not None:
+			session.info.setdefault("game_support_changes", set()).add(game_support_change)
+
+		if isinstance(obj, PackageReview) and obj.package_id is not None:
+			session.info.setdefault("score_changes", set()).add(obj.package_id)
+
+
+@event.listens_for(Session, "after_commit")
+def _invalidate_caches_on_commit(session: Session):
+	if session.info.pop("invalidate_response_cache", False):
+		invalidate_response_cache()
+	if session.info.pop("invalidate_updates_snapshot", False):
+		invalidate_updates_snapshot()
+	if session.info.pop("reference_data_changed", False):
+		publish_reference_data_changed()
+	record_game_support_changes(session.info.pop("game_support_changes", set()))
+	record_score_changes(session.info.pop("score_changes", set()))
+
+
+@event.listens_for(Session, "after_rollback")
+def _clear_cache_changes(session: Session):
+	session.info.pop("invalidate_response_cache", None)
+	session.info.pop("invalidate_updates_snapshot", None)
+	session.info.pop("game_support_changes", None)
+	session.info.pop("score_changes", None)
+	session.info.pop("reference_data_changed", None)
@@ -8,6 +8,7 @@ import flask
 from celery import Celery, signals
 from celery.schedules import crontab
 from app import app
+from app.utils.query_stats import start_collecting, stop_collecting, record_stats
 
 
 class TaskError(Exception):
@@ -61,6 +62,23 @@ def make_celery(app):
 celery = make_celery(app)
 
 
+_query_stats_tokens = {}
+
+
+@signals.task_prerun.connect
+def _start_query_stats(task_id=None, **_kwargs):
+	_query_stats_tokens[task_id] = start_collecting()
+
+
+@signals.task_postrun.connect
+def _record_query_stats(task_id=None, task=None, **_kwargs):
+	token = _query_stats_tokens.pop(task_id, None)
+	if token is not None:
+		# Runs after the task's app context has been popped
+		with app.app_context():
+			record_stats("task", task.name, stop_collecting(token))
+
+
 CELERYBEAT_SCHEDULE = {
 	'topic_list_import': {
 		'task': 'app.tasks.forumtasks.import_topic_list',
@@ -70,6 +88,30 @@ CELERYBEAT_SCHEDULE = {
 		'task': 'app.tasks.pkgtasks.update_package_scores',
 		'schedule': crontab(minute=10, hour=1), # 0110
 	},
+	'changed_package_score_update': {
+		'task': 'app.tasks.pkgtasks.update_changed_package_scores',
+		'schedule': crontab(minute='*/10'), # every 10 minutes
+	},
+	'check_review_counts': {
+		'task': 'app.tasks.pkgtasks.check_review_counts',
+		'schedule': crontab(minute=20, hour=1), # 0120
+	},
+	'rebuild_search_index': {
+		'task': 'app.tasks.pkgtasks.rebuild_search_index',
+		'schedule': crontab(minute=30, hour=1), # 0130
+	},
+	'update_metrics': {
+		'task': 'app.tasks.admintasks.update_metrics',
+		'schedule': crontab(minute='*/5'), # every 5 minutes
+	},
+	'resume_bulk_jobs': {
+		'task': 'app.tasks.admintasks.resume_bulk_jobs',
+		'schedule': crontab(minute='*/5'), # every 5 minutes
+	},
+	'flush_stats_buffer': {
+		'task': 'app.tasks.pkgtasks.flush_stats_buffer',
+		'schedule': crontab(minute='*'), # every minute
+	},
 	'check_for_updates': {
 		'task': 'app.tasks.importtasks.check_for_updates',
 		'schedule': crontab(minute=10, hour=2), # 0210
@@ -90,14 +132,27 @@ CELERYBEAT_SCHEDULE = {
 		'task': 'app.tasks.usertasks.upgrade_new_members',
 		'schedule': crontab(minute=10, hour=3), # 0310
 	},
+	'update_user_medal_rankings': {
+		'task': 'app.tasks.usertasks.update_user_medal_rankings',
+		'schedule': crontab(minute=40), # every hour at 40 past
+	},
 	'delete_old_notifications': {
 		'task': 'app.tasks.usertasks.delete_old_notifications',
 		'schedule': crontab(minute=10, hour=3),  # 0310
 	},
+	'clean_unused_uploads': {
+		'task': 'app.tasks.admintasks.clean_unused_uploads',
+		'schedule': crontab(minute=40, hour=4), # 0440
+	},
 	'create_database_dump': {
 		'task': 'app.tasks.dumptask.create_database_dump',
 		'schedule': crontab(minute=0, hour=5),  # 0510
 	},
+	'create_incremental_database_dump': {
+		'task': 'app.tasks.dumptask.create_database_dump',
+		'schedule': crontab(minute=30, hour='*/6'), # every 6 hours at 30 past
+		'kwargs': { 'incremental': True },
+	},
 }
 celery.conf.beat_schedule = CELERYBEAT_SCHEDULE
 
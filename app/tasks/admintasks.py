@@ -2,7 +2,14 @@
 # SPDX-License-Identifier: AGPL-3.0-or-later
 # Copyright (C) 2018-2025 rubenwardy <rw@rubenwardy>
 
+from typing import Optional
+
 from . import celery
+from app.domain.bulk_jobs import advance_bulk_job, take_expired_bulk_jobs, mark_bulk_job_item_succeeded, \
+	advance_bulk_job_now
+from app.domain.metrics import update_aggregate_metrics
+from app.domain.uploads import delete_unused_uploads, recount_upload_references
+from app.utils.misc import format_file_size
 from app.models import db, Thread
 
 
@@ -14,3 +21,54 @@ def delete_empty_threads():
 		thread.watchers.clear()
 		db.session.delete(thread)
 	db.session.commit()
+
+
+@celery.task()
+def update_metrics():
+	duration = update_aggregate_metrics()
+	return f"Computed aggregate metrics in {duration:.2f}s"
+
+
+@celery.task()
+def clean_unused_uploads(include_untracked: bool = False):
+	fixed = recount_upload_references(db.session)
+	deleted, freed = delete_unused_uploads(db.session, include_untracked)
+	return f"Fixed {fixed} reference counts, and deleted {deleted} unused uploads, freeing {format_file_size(freed)}"
+
+
+# Seconds between advancing a bulk job. Jobs are also advanced when an item finishes
+BULK_JOB_INTERVAL = 2
+
+
+@celery.task()
+def run_bulk_job(job_id: str, lease_token: Optional[str] = None):
+	job = advance_bulk_job(db.session, job_id, lease_token)
+	if job is None:
+		return
+
+	if job.is_finished:
+		return f"{job.title}: {job.succeeded} succeeded and {job.failed} failed out of {job.total}"
+
+	run_bulk_job.apply_async((job_id, lease_token), countdown=BULK_JOB_INTERVAL)
+
+
+@celery.task()
+def bulk_job_item_succeeded(job_id: str, task_id: str):
+	mark_bulk_job_item_succeeded(db.session, job_id, task_id)
+	advance_bulk_job_now(db.session, job_id)
+
+
+# Only takes one argument, as Celery calls error callbacks with more arguments directly rather than as a task
+@celery.task()
+def bulk_job_item_failed(job_id: str):
+	# The failure is collected from the result backend, as it's stored before calling error callbacks
+	advance_bulk_job_now(db.session, job_id)
+
+
+@celery.task()
+def resume_bulk_jobs():
+	jobs = take_expired_bulk_jobs(db.session)
+	for job_id, lease_token in jobs:
+		run_bulk_job.delay(job_id, lease_token)
+
+	return f"Resumed {len(jobs)} bulk jobs"
@@ -2,28 +2,227 @@
 # SPDX-License-Identifier: AGPL-3.0-or-later
 # Copyright (C) 2026 rubenwardy <rw@rubenwardy>
 
+import collections
+import datetime
+import glob
+import hashlib
+import json
+import os
+import resource
+import time
+import typing
+import zipfile
+from concurrent.futures import ThreadPoolExecutor, Future
+
+from sqlalchemy.orm import joinedload, selectinload
+
 from . import celery
 from app import app
-from app.models import User, Package, PackageState
-import json, os, zipfile, datetime
+from app.models import db, User, Package, PackageState, PackageRelease, PackageScreenshot, PackageGameSupport
 
-@celery.task()
-def create_database_dump():
-	date = datetime.datetime.utcnow().strftime("%Y-%m-%d")
-	dest_path = os.path.join(app.config["UPLOAD_DIR"], f"backup-{date}.zip")
-	with zipfile.ZipFile(dest_path, "w", zipfile.ZIP_DEFLATED) as zipf:
-		zipf.writestr("backup/index.json", json.dumps({ "created_at": datetime.datetime.utcnow().isoformat() }, indent=4))
-
-		users = User.query.filter(User.packages.any(state=PackageState.APPROVED)).all()
-		for user in users:
-			str = json.dumps(user.get_dict(), indent=4)
-			zipf.writestr(f"backup/{user.username}/index.json", str)
-
-		packages = Package.query.filter_by(state=PackageState.APPROVED).all()
+
+# The dump is written in chunks of rows, which are loaded with their relationships and serialized to JSON.
+# Chunks are compressed and written to the zip file by a thread whilst the next chunk is loaded, as zlib
+# releases the GIL. At most MAX_PENDING_CHUNKS are waiting to be written, so only a few chunks are in
+# memory at once.
+#
+# Celery's prefork workers are daemonic processes, which can't start child processes, so a process pool
+# can't be used here.
+#
+# backup/manifest.json lists the SHA-256 of every entry in the full dump. An incremental dump only
+# contains the entries that differ from the previous dump's manifest, and lists removed entries.
+
+
+CHUNK_SIZE = 200
+
+# Number of chunks that can be waiting to be compressed or written
+MAX_PENDING_CHUNKS = 4
+
+MANIFEST_PATH = "backup/manifest.json"
+
+
+def _to_json(value) -> bytes:
+	return json.dumps(value, separators=(",", ":"), ensure_ascii=False).encode("utf-8")
+
+
+def _chunks(ids: list[int]) -> typing.Iterator[list[int]]:
+	for i in range(0, len(ids), CHUNK_SIZE):
+		yield ids[i:i + CHUNK_SIZE]
+
+
+def _get_user_entries() -> typing.Iterator[list[tuple[str, bytes]]]:
+	user_ids = [x[0] for x in db.session.query(User.id)
+			.filter(User.packages.any(state=PackageState.APPROVED))
+			.order_by(User.id).all()]
+
+	for chunk in _chunks(user_ids):
+		users = User.query.filter(User.id.in_(chunk)).order_by(User.id).all()
+		yield [(f"backup/{user.username}/index.json", _to_json(user.get_dict())) for user in users]
+		db.session.expunge_all()
+
+
+def _get_package_entries(game_dicts: dict[int, dict]) -> typing.Iterator[list[tuple[str, bytes]]]:
+	base_url = app.config["BASE_URL"]
+	package_ids = [x[0] for x in db.session.query(Package.id)
+			.filter_by(state=PackageState.APPROVED)
+			.order_by(Package.id).all()]
+
+	for chunk in _chunks(package_ids):
+		packages = Package.query.filter(Package.id.in_(chunk)).order_by(Package.id).options(
+				joinedload(Package.author),
+				joinedload(Package.license),
+				joinedload(Package.media_license),
+				selectinload(Package.maintainers),
+				selectinload(Package.tags),
+				selectinload(Package.content_warnings),
+				selectinload(Package.provides)).all()
+
+		releases = collections.defaultdict(list)
+		for release in PackageRelease.query.filter(PackageRelease.package_id.in_(chunk)) \
+				.options(joinedload(PackageRelease.min_rel), joinedload(PackageRelease.max_rel)) \
+				.order_by(db.desc(PackageRelease.created_at)).all():
+			releases[release.package_id].append(release)
+
+		screenshots = collections.defaultdict(list)
+		for screenshot in PackageScreenshot.query.filter(PackageScreenshot.package_id.in_(chunk)) \
+				.order_by(db.asc(PackageScreenshot.order)).all():
+			screenshots[screenshot.package_id].append(screenshot)
+
+		game_support = collections.defaultdict(list)
+		for support in PackageGameSupport.query.filter(PackageGameSupport.package_id.in_(chunk)) \
+				.order_by(PackageGameSupport.id).all():
+			if support.game_id not in game_dicts:
+				game_dicts[support.game_id] = support.game.as_short_dict(base_url)
+
+			game_support[support.package_id].append({
+				"supports": support.supports,
+				"confidence": support.confidence,
+				"game": game_dicts[support.game_id],
+			})
+
+		entries = []
 		for package in packages:
-			str = json.dumps(package.as_dict(base_url=app.config["BASE_URL"]), indent=4)
-			zipf.writestr(f"backup/{package.author.username}/{package.name}/index.json", str)
+			path = f"backup/{package.author.username}/{package.name}"
+			entries.append((f"{path}/index.json", _to_json(package.as_dict(base_url,
+					releases=releases[package.id], screenshots=screenshots[package.id],
+					game_support=game_support[package.id]))))
+			entries.append((f"{path}/releases.json",
+					_to_json([release.as_dict() for release in releases[package.id]])))
+
+		yield entries
+		db.session.expunge_all()
+
+
+def _find_previous_dump(dest_path: str) -> typing.Optional[tuple[str, dict[str, str]]]:
+	"""
+	Returns the name and manifest of the most recent dump
+	"""
+	paths = glob.glob(os.path.join(app.config["UPLOAD_DIR"], "backup-*.zip"))
+	paths = [x for x in paths if x != dest_path]
+	if len(paths) == 0:
+		return None
+
+	path = max(paths, key=os.path.getmtime)
+	try:
+		with zipfile.ZipFile(path) as zipf:
+			manifest = json.loads(zipf.read(MANIFEST_PATH))
+			return os.path.basename(path), manifest["entries"]
+	except (KeyError, ValueError, zipfile.BadZipFile):
+		# Dumps from before manifests were added
+		return None
+
+
+def get_dump_filename(now: datetime.datetime, incremental: bool) -> str:
+	if incremental:
+		return f"backup-{now.strftime('%Y-%m-%d-%H%M%S')}-incremental.zip"
+	else:
+		return f"backup-{now.strftime('%Y-%m-%d')}.zip"
+
+
+def _write_entries(zipf: zipfile.ZipFile, entries: list[tuple[str, bytes]]):
+	for name, data in entries:
+		zipf.writestr(name, data)
+
+
+def write_database_dump(dest_path: str, incremental: bool = False) -> dict:
+	"""
+	Returns the manifest, without entries
+	"""
+	start = time.monotonic()
+	now = datetime.datetime.utcnow()
+
+	previous = _find_previous_dump(dest_path) if incremental else None
+	previous_entries = previous[1] if previous else {}
+
+	manifest = {
+		"created_at": now.isoformat(),
+		"incremental": previous is not None,
+		"base": previous[0] if previous else None,
+		"rows": 0,
+		"changed": 0,
+		"removed": [],
+		"entries": {},
+	}
+
+	def filter_entries(entries: list[tuple[str, bytes]]) -> list[tuple[str, bytes]]:
+		ret = []
+		for name, data in entries:
+			digest = hashlib.sha256(data).hexdigest()
+			manifest["entries"][name] = digest
+			if previous_entries.get(name) != digest:
+				ret.append((name, data))
+
+		manifest["rows"] += len(entries)
+		manifest["changed"] += len(ret)
+		return ret
+
+	temp_path = dest_path + ".tmp"
+	game_dicts = {}
+	try:
+		with zipfile.ZipFile(temp_path, "w", zipfile.ZIP_DEFLATED) as zipf:
+			zipf.writestr("backup/index.json", json.dumps({ "created_at": now.isoformat() }, indent=4))
+
+			# A single thread, so that entries are written in order
+			with ThreadPoolExecutor(max_workers=1) as executor:
+				pending: collections.deque[Future] = collections.deque()
+				for chunk in _chunks_of_entries(game_dicts):
+					pending.append(executor.submit(_write_entries, zipf, filter_entries(chunk)))
+					while len(pending) > MAX_PENDING_CHUNKS:
+						pending.popleft().result()
+
+				for future in pending:
+					future.result()
+
+			if previous is not None:
+				manifest["removed"] = sorted(set(previous_entries.keys()) - set(manifest["entries"].keys()))
+
+			manifest["seconds"] = round(time.monotonic() - start, 2)
+			zipf.writestr(MANIFEST_PATH, json.dumps(manifest, indent=4))
+	except BaseException:
+		if os.path.isfile(temp_path):
+			os.remove(temp_path)
+		raise
+
+	os.replace(temp_path, dest_path)
+
+	del manifest["entries"]
+	return manifest
+
+
+def _chunks_of_entries(game_dicts: dict[int, dict]) -> typing.Iterator[list[tuple[str, bytes]]]:
+	yield from _get_user_entries()
+	yield from _get_package_entries(game_dicts)
+
+
+@celery.task()
+def create_database_dump(incremental: bool = False):
+	now = datetime.datetime.utcnow()
+	dest_path = os.path.join(app.config["UPLOAD_DIR"], get_dump_filename(now, incremental))
+	manifest = write_database_dump(dest_path, incremental)
 
-			releases = [release.as_dict() for release in package.releases]
-			str = json.dumps(releases, indent=4)
-			zipf.writestr(f"backup/{package.author.username}/{package.name}/releases.json", str)
+	# This is the highest RSS of the worker process since it started, so it includes earlier tasks.
+	# ru_maxrss is in kilobytes on Linux
+	max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+	kind = f"incremental dump from {manifest['base']}" if manifest["incremental"] else "full dump"
+	return f"Created {kind} with {manifest['changed']} of {manifest['rows']} rows in {manifest['seconds']:.1f}s " \
+			f"({manifest['rows'] / max(manifest['seconds'], 0.01):.0f} rows/s), worker max RSS {max_rss:.0f} MB"
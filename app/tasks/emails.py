@@ -2,14 +2,18 @@
 # SPDX-License-Identifier: AGPL-3.0-or-later
 # Copyright (C) 2018-2025 rubenwardy <rw@rubenwardy>
 
+import itertools
 import smtplib
+import sys
+import time
 import typing
-from typing import Dict
+from typing import Dict, List, Tuple, Callable, Optional
 
 from flask import render_template
 from flask_babel import force_locale, gettext, lazy_gettext, LazyString
 from flask_mail import Message
 from markupsafe import escape
+from sqlalchemy.orm import joinedload
 
 from app import mail, app
 from app.models import Notification, db, EmailSubscription, User
@@ -116,89 +120,209 @@ def send_anon_email(email: str, locale: str, subject: str, text: str, html=None)
 			lazy_gettext("You are receiving this email because someone (hopefully you) entered your email address as a user's email."))
 
 
-def send_single_email(notification, locale):
-	sub = get_email_subscription(notification.user.email)
-	if sub.blacklisted:
-		return
+def make_single_email(notification: Notification, sub: EmailSubscription) -> Message:
+	msg = Message(notification.title, recipients=[notification.user.email], reply_to=reply_to, extra_headers=gen_headers(sub))
 
-	with force_locale(locale or "en"):
-		msg = Message(notification.title, recipients=[notification.user.email], reply_to=reply_to, extra_headers=gen_headers(sub))
+	msg.body = """
+			New notification: {}
+			
+			View: {}
+			
+			Manage email settings: {}
+			Unsubscribe: {}
+		""".format(notification.title, abs_url(notification.url),
+					abs_url_for("users.email_notifications", username=notification.user.username),
+					abs_url_for("users.unsubscribe", token=sub.token))
 
-		msg.body = """
-				New notification: {}
-				
-				View: {}
-				
-				Manage email settings: {}
-				Unsubscribe: {}
-			""".format(notification.title, abs_url(notification.url),
-						abs_url_for("users.email_notifications", username=notification.user.username),
-						abs_url_for("users.unsubscribe", token=sub.token))
-
-		msg.html = render_template("emails/notification.html", notification=notification, sub=sub)
-		mail.send(msg)
-		increment_key("emails_sent")
+	msg.html = render_template("emails/notification.html", notification=notification, sub=sub)
+	return msg
 
 
-def send_notification_digest(notifications: typing.List[Notification], locale):
+def make_notification_digest(notifications: List[Notification], sub: EmailSubscription) -> Message:
 	user = notifications[0].user
 
-	sub = get_email_subscription(user.email)
-	if sub.blacklisted:
-		return
+	msg = Message(gettext("%(num)d new notifications", num=len(notifications)), reply_to=reply_to, recipients=[user.email], extra_headers=gen_headers(sub))
 
-	with force_locale(locale or "en"):
-		msg = Message(gettext("%(num)d new notifications", num=len(notifications)), reply_to=reply_to, recipients=[user.email], extra_headers=gen_headers(sub))
+	msg.body = "".join(["<{}> {}\n{}: {}\n\n".format(notification.causer.display_name, notification.title, gettext("View"), abs_url(notification.url)) for notification in notifications])
 
-		msg.body = "".join(["<{}> {}\n{}: {}\n\n".format(notification.causer.display_name, notification.title, gettext("View"), abs_url(notification.url)) for notification in notifications])
+	msg.body += "{}: {}\n{}: {}".format(
+			gettext("Manage email settings"),
+			abs_url_for("users.email_notifications", username=user.username),
+			gettext("Unsubscribe"),
+			abs_url_for("users.unsubscribe", token=sub.token))
 
-		msg.body += "{}: {}\n{}: {}".format(
-				gettext("Manage email settings"),
-				abs_url_for("users.email_notifications", username=user.username),
-				gettext("Unsubscribe"),
-				abs_url_for("users.unsubscribe", token=sub.token))
+	msg.html = render_template("emails/notification_digest.html", notifications=notifications, user=user, sub=sub)
+	return msg
 
-		msg.html = render_template("emails/notification_digest.html", notifications=notifications, user=user, sub=sub)
-		mail.send(msg)
-		increment_key("emails_sent")
 
+# Pending notifications are emailed in batches of users. Each batch loads its users, notifications
+# and subscriptions up front, renders emails grouped by locale, marks the notifications as emailed
+# using one UPDATE, and then sends all of its emails over one SMTP connection.
 
-@celery.task()
-def send_pending_digests():
-	for user in User.query.filter(User.notifications.any(emailed=False)).all():
-		to_send = []
-		for notification in user.notifications.all():
-			if not notification.emailed and notification.can_send_digest():
-				to_send.append(notification)
-				notification.emailed = True
+EMAIL_BATCH_SIZE = 100
 
-		if len(to_send) > 0:
-			send_notification_digest(to_send, user.locale or "en")
 
-		db.session.commit()
+def get_email_subscriptions(emails: typing.Iterable[str]) -> Dict[str, EmailSubscription]:
+	"""
+	Like get_email_subscription for many emails, but new subscriptions are added without committing
+	"""
+	emails = set(emails)
+	if len(emails) == 0:
+		return {}
 
+	ret = { sub.email: sub for sub in EmailSubscription.query.filter(EmailSubscription.email.in_(emails)).all() }
+	for email in emails:
+		if email not in ret:
+			sub = EmailSubscription(email)
+			sub.token = random_string(32)
+			db.session.add(sub)
+			ret[email] = sub
 
-@celery.task()
-def send_pending_notifications():
-	for user in User.query.filter(User.notifications.any(emailed=False)).all():
-		to_send = []
-		for notification in user.notifications:
-			if not notification.emailed:
-				if notification.can_send_email():
-					to_send.append(notification)
-					notification.emailed = True
-				elif not notification.can_send_digest():
-					notification.emailed = True
+	return ret
 
-		db.session.commit()
 
+def deliver_emails(messages: List[Message], connection,
+		on_done: Optional[Callable[[int], None]] = None) -> Tuple[int, List[Exception]]:
+	"""
+	Sends messages using one connection, returning the number sent and the errors of rejected messages.
+	A rejected message doesn't stop the rest from being sent.
+
+	:param connection: a flask_mail Connection, or anything with a compatible `send` method
+	:param on_done: called with the index of each message once it has been sent or rejected
+	"""
+	sent = 0
+	errors = []
+	for i, msg in enumerate(messages):
 		try:
-			if len(to_send) > 1:
-				send_notification_digest(to_send, user.locale or "en")
-			elif len(to_send) > 0:
-				send_single_email(to_send[0], user.locale or "en")
+			connection.send(msg)
+			sent += 1
 		except smtplib.SMTPDataError as e:
 			if "Message rejected under suspicion of SPAM" in str(e):
-				raise Exception(f"Failed to send email to {user.username} due to yandex spam filter") from e
+				print(f"Failed to send email to {', '.join(msg.recipients)} due to yandex spam filter", file=sys.stderr)
 			else:
-				raise e
+				print(f"Failed to send email to {', '.join(msg.recipients)}: {e}", file=sys.stderr)
+			errors.append(e)
+
+		if on_done:
+			on_done(i)
+
+	return sent, errors
+
+
+def _select_notifications(notifications: List[Notification], is_digest: bool) -> Tuple[List[Notification], List[Notification]]:
+	"""
+	Returns the notifications of a user to send and to mark as emailed
+	"""
+	if is_digest:
+		to_send = [notification for notification in notifications if notification.can_send_digest()]
+		return to_send, to_send
+
+	to_send = []
+	to_mark = []
+	for notification in notifications:
+		if notification.can_send_email():
+			to_send.append(notification)
+			to_mark.append(notification)
+		elif not notification.can_send_digest():
+			to_mark.append(notification)
+
+	return to_send, to_mark
+
+
+def _send_notification_batch(user_ids: List[int], is_digest: bool) -> Tuple[int, List[Exception]]:
+	users = (User.query
+			.filter(User.id.in_(user_ids))
+			.options(joinedload(User.notification_preferences))
+			.all())
+
+	notifications_by_user: Dict[int, List[Notification]] = {}
+	for notification in (Notification.query
+			.filter(Notification.user_id.in_(user_ids), Notification.emailed == False)
+			.options(joinedload(Notification.causer), joinedload(Notification.package))
+			.order_by(db.desc(Notification.created_at))
+			.all()):
+		notifications_by_user.setdefault(notification.user_id, []).append(notification)
+
+	to_send_by_user: Dict[int, List[Notification]] = {}
+	to_mark = []
+	for user in users:
+		to_send, user_to_mark = _select_notifications(notifications_by_user.get(user.id, []), is_digest)
+		if len(to_send) > 0:
+			to_send_by_user[user.id] = to_send
+		to_mark.extend(user_to_mark)
+
+	subs = get_email_subscriptions([user.email for user in users if user.id in to_send_by_user])
+
+	messages = []
+	message_notifications: List[List[Notification]] = []
+	users_with_email = sorted([user for user in users if user.id in to_send_by_user], key=lambda x: x.locale or "en")
+	for locale, locale_users in itertools.groupby(users_with_email, key=lambda x: x.locale or "en"):
+		with force_locale(locale):
+			for user in locale_users:
+				sub = subs[user.email]
+				if sub.blacklisted:
+					continue
+
+				to_send = to_send_by_user[user.id]
+				if is_digest or len(to_send) > 1:
+					messages.append(make_notification_digest(to_send, sub))
+				else:
+					messages.append(make_single_email(to_send[0], sub))
+				message_notifications.append(to_send)
+
+	# Notifications in an email are only marked as emailed once the email has been sent or rejected,
+	# so that they're sent by the next run if the connection fails
+	pending_ids = set([notification.id for notifications in message_notifications for notification in notifications])
+	emailed_ids = set([notification.id for notification in to_mark if notification.id not in pending_ids])
+
+	def on_done(i: int):
+		emailed_ids.update([notification.id for notification in message_notifications[i]])
+
+	sent = 0
+	errors = []
+	try:
+		if len(messages) > 0:
+			with mail.connect() as connection:
+				sent, errors = deliver_emails(messages, connection, on_done)
+	finally:
+		if len(emailed_ids) > 0:
+			Notification.query \
+				.filter(Notification.id.in_(list(emailed_ids))) \
+				.update({ "emailed": True }, synchronize_session=False)
+		db.session.commit()
+
+	increment_key("emails_sent", sent)
+	return sent, errors
+
+
+def send_pending_notification_emails(is_digest: bool) -> str:
+	start = time.monotonic()
+
+	user_ids = [x[0] for x in db.session.query(Notification.user_id)
+			.filter(Notification.emailed == False)
+			.distinct()
+			.order_by(Notification.user_id)
+			.all()]
+
+	sent = 0
+	errors = []
+	for i in range(0, len(user_ids), EMAIL_BATCH_SIZE):
+		batch_sent, batch_errors = _send_notification_batch(user_ids[i:i + EMAIL_BATCH_SIZE], is_digest)
+		sent += batch_sent
+		errors.extend(batch_errors)
+
+	if len(errors) > 0:
+		raise Exception(f"Failed to send {len(errors)} emails") from errors[0]
+
+	duration = time.monotonic() - start
+	return f"Sent {sent} emails for {len(user_ids)} users in {duration:.2f}s ({sent / max(duration, 0.001):.1f} emails/s)"
+
+
+@celery.task()
+def send_pending_digests():
+	return send_pending_notification_emails(True)
+
+
+@celery.task()
+def send_pending_notifications():
+	return send_pending_notification_emails(False)
@@ -5,21 +5,24 @@
 import json
 import re
 import sys
+import time
 import urllib.request
 from typing import Optional
 from urllib.parse import urljoin
 
-from sqlalchemy import or_
+from sqlalchemy import or_, delete
+from sqlalchemy.dialects.postgresql import insert
 
 from app.models import User, db, PackageType, ForumTopic
+from app.rediscache import get_forum_pages, set_forum_pages
 from app.tasks import celery
 from app.utils.user import make_valid_username
-from app.utils.phpbbparser import get_profile, get_topics_from_forum
+from app.utils.phpbbparser import get_profile, ForumTopicFetcher
 from .usertasks import set_profile_picture_from_url, update_github_user_id_raw
 
 
 def _get_or_create_user(forums_username: str, cache: Optional[dict] = None) -> Optional[User]:
-	if cache:
+	if cache is not None:
 		user = cache.get(forums_username)
 		if user:
 			return user
@@ -36,7 +39,7 @@ def _get_or_create_user(forums_username: str, cache: Optional[dict] = None) -> O
 		user.display_name = forums_username
 		db.session.add(user)
 
-	if cache:
+	if cache is not None:
 		cache[forums_username] = user
 	return user
 
@@ -141,30 +144,33 @@ def get_links_from_mod_search():
 	return links
 
 
+FORUMS = [
+	(15, {"type": PackageType.GAME, "wip": False}),
+	(50, {"type": PackageType.GAME, "wip": True}),
+	(11, {"type": PackageType.MOD, "wip": False}),
+	(9, {"type": PackageType.MOD, "wip": True}),
+	(4, {"type": PackageType.TXP, "wip": False}),
+]
+
+FORUM_TOPIC_UPDATE_COLUMNS = ["author_id", "type", "title", "name", "link", "wip", "posts", "views", "created_at"]
+
+
 @celery.task()
 def import_topic_list():
+	start = time.monotonic()
+
 	links_by_id = get_links_from_mod_search()
 
-	info_by_id = {}
-	get_topics_from_forum(15, out=info_by_id, extra={'type': PackageType.GAME, 'wip': False})
-	get_topics_from_forum(50, out=info_by_id, extra={'type': PackageType.GAME, 'wip': True})
-	get_topics_from_forum(11, out=info_by_id, extra={'type': PackageType.MOD, 'wip': False})
-	get_topics_from_forum(9, out=info_by_id, extra={'type': PackageType.MOD, 'wip': True})
-	get_topics_from_forum(4, out=info_by_id, extra={'type': PackageType.TXP, 'wip': False})
+	fetcher = ForumTopicFetcher(get_cached=get_forum_pages, set_cached=set_forum_pages)
+	info_by_id = fetcher.get_topics(FORUMS)
 
 	# Caches
-	username_to_user = {}
-	topics_by_id     = {}
-	for topic in ForumTopic.query.all():
-		if topic.topic_id in info_by_id:
-			topics_by_id[topic.topic_id] = topic
-		else:
-			db.session.delete(topic)
-			print(f"Deleting topic {topic.topic_id} title {topic.title}", file=sys.stderr)
+	username_to_user = { user.forums_username: user for user in
+			User.query.filter(User.forums_username.in_(set(info["author"] for info in info_by_id.values()))).all() }
 
 	username_conflicts = set()
 
-	# Create or update
+	rows = []
 	for info in info_by_id.values():
 		id = int(info["id"])
 
@@ -175,31 +181,48 @@ def import_topic_list():
 			username_conflicts.add(username)
 			continue
 
-		# Get / add row
-		topic = topics_by_id.get(id)
-		if topic is None:
-			topic = ForumTopic()
-			db.session.add(topic)
-
 		# Parse title
 		title, name = parse_title(info["title"])
 
-		# Get link
-		link = links_by_id.get(id)
-
-		# Fill row
-		topic.topic_id   = int(id)
-		topic.author     = user
-		topic.type       = info["type"]
-		topic.title      = title
-		topic.name       = name
-		topic.link       = link
-		topic.wip        = info["wip"]
-		topic.posts      = int(info["posts"])
-		topic.views      = int(info["views"])
-		topic.created_at = info["date"]
+		rows.append({
+			"topic_id": id,
+			"type": info["type"],
+			"title": title,
+			"name": name,
+			"link": links_by_id.get(id),
+			"wip": info["wip"],
+			"posts": int(info["posts"]),
+			"views": int(info["views"]),
+			"created_at": info["date"],
+			"author": user,
+		})
+
+	# Assigns ids to new users
+	db.session.flush()
+	for row in rows:
+		row["author_id"] = row.pop("author").id
+
+	# Rows are only updated if they changed
+	if len(rows) > 0:
+		stmt = insert(ForumTopic)
+		stmt = stmt.on_conflict_do_update(
+				index_elements=[ForumTopic.topic_id],
+				set_={ column: stmt.excluded[column] for column in FORUM_TOPIC_UPDATE_COLUMNS },
+				where=or_(*[ForumTopic.__table__.c[column].is_distinct_from(stmt.excluded[column])
+						for column in FORUM_TOPIC_UPDATE_COLUMNS]))
+		db.session.execute(stmt, rows)
+
+	deleted = db.session.execute(delete(ForumTopic)
+			.where(ForumTopic.topic_id.not_in([int(x) for x in info_by_id.keys()]))
+			.returning(ForumTopic.topic_id, ForumTopic.title)
+			.execution_options(synchronize_session=False)).all()
+	for topic_id, title in deleted:
+		print(f"Deleting topic {topic_id} title {title}", file=sys.stderr)
 
 	db.session.commit()
 
 	if len(username_conflicts) > 0:
 		print("The following forum usernames could not be created: " + (", ".join(username_conflicts)))
+
+	return f"Imported {len(rows)} topics and deleted {len(deleted)} from {fetcher.pages_fetched} pages " \
+			f"({fetcher.pages_unchanged} unchanged) in {time.monotonic() - start:.1f}s"
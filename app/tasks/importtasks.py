@@ -2,12 +2,15 @@
 # SPDX-License-Identifier: AGPL-3.0-or-later
 # Copyright (C) 2018-2025 rubenwardy <rw@rubenwardy>
 
+import contextlib
 import datetime
 import json
 import os
+import posixpath
 import shutil
 import sys
 from json import JSONDecodeError
+from typing import Optional
 from zipfile import ZipFile, BadZipFile
 
 import gitdb
@@ -22,17 +25,20 @@ from app.models import AuditSeverity, db, NotificationType, PackageRelease, Meta
 	LuantiRelease, Package, PackageState, PackageScreenshot, PackageUpdateTrigger, PackageUpdateConfig, \
 	PackageGameSupport, PackageTranslation, Language, ReleaseState
 from app.tasks import celery, TaskError
-from app.utils.misc import random_string, truncate_string
+from app.utils.misc import truncate_string
 from app.utils.models import post_bot_message, add_system_notification, add_system_audit_log, \
 	get_games_from_list, add_audit_log
-from app.utils.git import clone_repo, get_latest_tag, get_latest_commit, get_temp_dir, get_release_notes
-from .luanticheck import build_tree, LuantiCheckError, ContentType, PackageTreeNode
+from app.utils.git import clone_repo, get_latest_tag, get_latest_commit, get_release_notes
+from .luanticheck import build_tree, LuantiCheckError, ContentType, PackageTreeNode, FileSystem, ZipFileSystem
 from .webhooktasks import post_discord_webhook
 from app import app
 from app.domain.DomainError import DomainError
+from app.domain.uploads import make_temp_upload_path, store_file
 from app.domain.packages import do_edit_package, ALIASES
 from app.domain.game_support import game_support_update, game_support_set, game_support_update_all, game_support_remove
 from app.utils.image import get_image_size
+from .pkgtasks import create_screenshot_thumbnails
+from .zipgrep import update_package_in_index
 
 
 @celery.task()
@@ -80,8 +86,9 @@ def get_meta(urlstr, author):
 
 @celery.task()
 def update_all_game_support():
-	game_support_update_all(db.session)
+	rows = game_support_update_all(db.session)
 	db.session.commit()
+	return f"Updated {rows} game support rows"
 
 
 @celery.task()
@@ -98,9 +105,9 @@ def remove_package_game_support(package_id: int):
 	db.session.commit()
 
 
-def post_release_check_update(self, release: PackageRelease, path):
+def post_release_check_update(self, release: PackageRelease, path, fs: Optional[FileSystem] = None):
 	tree: PackageTreeNode = build_tree(path, expected_type=ContentType[release.package.type.name],
-			author=release.package.author.username, name=release.package.name)
+			author=release.package.author.username, name=release.package.name, fs=fs)
 
 	if tree.name is not None and release.package.name != tree.name and tree.type == ContentType.MOD:
 		raise LuantiCheckError(f"Package name ({release.package.name}) does not match the name of the content in "
@@ -142,8 +149,11 @@ def post_release_check_update(self, release: PackageRelease, path):
 
 	package.provides.extend(get_meta_packages(tree.get_mod_names()))
 
-	# Delete all mod name dependencies
-	package.dependencies.filter(Dependency.meta_package != None).delete()
+	# Delete all mod name dependencies. These are deleted through the session so that the game support
+	# cache sees the change, and flushed so that they can be added again
+	for dependency in package.dependencies.filter(Dependency.meta_package != None).all():
+		db.session.delete(dependency)
+	db.session.flush()
 
 	# Get raw dependencies
 	depends = tree.fold("meta", "depends")
@@ -181,9 +191,8 @@ def post_release_check_update(self, release: PackageRelease, path):
 		release.max_rel = LuantiRelease.get(tree.meta["max_minetest_version"], None)
 
 	try:
-		with open(os.path.join(tree.baseDir, ".cdb.json"), "r") as f:
-			data = json.loads(f.read())
-			do_edit_package(package.author, package, False, False, data, "Post release hook")
+		data = json.loads(tree.read_text(".cdb.json"))
+		do_edit_package(package.author, package, False, False, data, "Post release hook")
 	except DomainError as e:
 		raise TaskError("Whilst applying .cdb.json: " + e.message)
 	except JSONDecodeError as e:
@@ -259,7 +268,7 @@ def update_translations(package: Package, tree: PackageTreeNode):
 			.update(to_update)
 
 
-def _check_zip_file(temp_dir: str, zf: ZipFile) -> bool:
+def _check_zip_file(zf: ZipFile) -> bool:
 	# No more than 300MB
 	total_size = sum(e.file_size for e in zf.infolist())
 	if total_size > 300 * 1024 * 1024:
@@ -273,28 +282,29 @@ def _check_zip_file(temp_dir: str, zf: ZipFile) -> bool:
 			print("zip file member contains invalid characters", file=sys.stderr)
 			return False
 
-		file_path = os.path.realpath(os.path.join(temp_dir, member.filename))
-		if not file_path.startswith(os.path.realpath(temp_dir)):
-			print(f"zip file contains path out-of-bounds: {file_path}", file=sys.stderr)
+		# Zip member names always use forward slashes
+		file_path = posixpath.normpath(member.filename.replace("\\", "/"))
+		if file_path.startswith("/") or file_path == ".." or file_path.startswith("../"):
+			print(f"zip file contains path out-of-bounds: {member.filename}", file=sys.stderr)
 			return False
 
 	return True
 
 
-def _safe_extract_zip(temp_dir: str, archive_path: str) -> bool:
+@contextlib.contextmanager
+def _open_safe_zip(archive_path: str):
+	"""
+	Yields the archive as a file system to read without extracting it, or None if it's unsafe
+	"""
 	try:
 		with ZipFile(archive_path, 'r') as zf:
-			if not _check_zip_file(temp_dir, zf):
-				return False
-
-			# Extract all
-			for member in zf.infolist():
-				zf.extract(member, temp_dir)
+			if not _check_zip_file(zf):
+				yield None
+			else:
+				yield ZipFileSystem(zf)
 	except BadZipFile as e:
 		raise TaskError(str(e))
 
-	return True
-
 
 @celery.task(bind=True)
 def check_zip_release(self, id, path):
@@ -305,19 +315,21 @@ def check_zip_release(self, id, path):
 		raise TaskError("No package attached to release")
 
 	try:
-		with get_temp_dir() as temp:
-			if not _safe_extract_zip(temp, path):
+		with _open_safe_zip(path) as fs:
+			if fs is None:
 				release.state = ReleaseState.FAILED
 				db.session.commit()
 				raise Exception(f"Unsafe zip file at {path}")
 
-			post_release_check_update(self, release, temp)
+			post_release_check_update(self, release, "/", fs)
 
 			release.task_id = None
 			release.calculate_file_size_bytes()
 			release.state = ReleaseState.UNAPPROVED
 			release.approve(release.package.author)
 			db.session.commit()
+
+			update_package_in_index(release.package)
 	except (LuantiCheckError, TaskError, DomainError) as err:
 		db.session.rollback()
 
@@ -341,7 +353,7 @@ def check_all_zip_files():
 	releases = PackageRelease.query.all()
 	for release in releases:
 		with ZipFile(release.file_path, 'r') as zf:
-			if not _check_zip_file("/tmp/example", zf):
+			if not _check_zip_file(zf):
 				print(f"Unsafe zip file for {release.package.get_id()} at {release.file_path}", file=sys.stderr)
 				result.append({
 					"package": release.package.get_id(),
@@ -359,16 +371,17 @@ def import_languages(self, id, path):
 	elif release.package is None:
 		raise TaskError("No package attached to release")
 
-	with get_temp_dir() as temp:
-		if not _safe_extract_zip(temp, path):
+	with _open_safe_zip(path) as fs:
+		if fs is None:
 			raise Exception(f"Unsafe zip file at {path}")
 
 		try:
-			tree: PackageTreeNode = build_tree(temp,
+			tree: PackageTreeNode = build_tree("/",
 					expected_type=ContentType[release.package.type.name],
 					author=release.package.author.username,
 					name=release.package.name,
-					strict=False)
+					strict=False,
+					fs=fs)
 			update_translations(release.package, tree)
 			db.session.commit()
 		except (LuantiCheckError, TaskError, DomainError) as err:
@@ -395,12 +408,9 @@ def make_vcs_release(self, id, branch):
 			release.commit_hash = repo.head.object.hexsha
 			post_release_check_update(self, release, repo.working_tree_dir)
 
-			filename = random_string(10) + ".zip"
-			dest_path = os.path.join(app.config["UPLOAD_DIR"], filename)
-
-			assert not os.path.isfile(dest_path)
+			dest_path = make_temp_upload_path()
 			archiver = GitArchiver(prefix=release.package.name, force_sub=True, main_repo_abspath=repo.working_tree_dir)
-			archiver.create(dest_path)
+			archiver.create(dest_path, output_format="zip")
 			assert os.path.isfile(dest_path)
 
 			file_stats = os.stat(dest_path)
@@ -408,13 +418,15 @@ def make_vcs_release(self, id, branch):
 				os.remove(dest_path)
 				raise TaskError("The .zip file created from Git is too large - needs to be less than 100MB")
 
-			release.url         = "/uploads/" + filename
+			release.url, _ = store_file(dest_path, "zip")
 			release.task_id     = None
 			release.calculate_file_size_bytes()
 			release.state = ReleaseState.UNAPPROVED
 			release.approve(release.package.author)
 			db.session.commit()
 
+			update_package_in_index(release.package)
+
 			return release.url
 	except (LuantiCheckError, TaskError, DomainError) as err:
 		db.session.rollback()
@@ -443,15 +455,15 @@ def import_repo_screenshot(id):
 			for ext in ["png", "jpg", "jpeg"]:
 				sourcePath = repo.working_tree_dir + "/screenshot." + ext
 				if os.path.isfile(sourcePath):
-					filename = random_string(10) + "." + ext
-					destPath = os.path.join(app.config["UPLOAD_DIR"], filename)
-					shutil.copyfile(sourcePath, destPath)
+					tempPath = make_temp_upload_path()
+					shutil.copyfile(sourcePath, tempPath)
+					url, destPath = store_file(tempPath, ext)
 
 					ss = PackageScreenshot()
 					ss.approved = True
 					ss.package = package
 					ss.title   = "screenshot.png"
-					ss.url	 = "/uploads/" + filename
+					ss.url	 = url
 					ss.width, ss.height = get_image_size(destPath)
 					if ss.is_too_small():
 						return None
@@ -459,7 +471,9 @@ def import_repo_screenshot(id):
 					db.session.add(ss)
 					db.session.commit()
 
-					return "/uploads/" + filename
+					create_screenshot_thumbnails.delay(ss.id)
+
+					return url
 
 	except TaskError as e:
 		# ignore download errors
@@ -41,13 +41,16 @@ class ContentType(Enum):
 			raise LuantiCheckError("Expected a " + self.value + ", found a " + other.value)
 
 
+from .fs import FileSystem, ZipFileSystem
 from .tree import PackageTreeNode, get_base_dir
 
 
-def build_tree(path, expected_type=None, author=None, repo=None, name=None, strict: bool = True):
-	path = get_base_dir(path)
+def build_tree(path, expected_type=None, author=None, repo=None, name=None, strict: bool = True,
+		fs: FileSystem = None):
+	fs = fs or FileSystem()
+	path = get_base_dir(path, fs)
 
-	root = PackageTreeNode(path, "/", author=author, repo=repo, name=name, strict=strict)
+	root = PackageTreeNode(path, "/", author=author, repo=repo, name=name, strict=strict, fs=fs)
 	assert root
 
 	if expected_type:
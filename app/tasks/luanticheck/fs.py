@@ -0,0 +1,116 @@
+# ContentDB
+# SPDX-License-Identifier: AGPL-3.0-or-later
+# Copyright (C) 2018-2025 rubenwardy <rw@rubenwardy>
+
+import io
+import os
+import posixpath
+from typing import Iterator, Tuple, List
+from zipfile import ZipFile
+
+
+class FileSystem:
+	"""
+	The files that a package tree is read from
+	"""
+
+	def join(self, *paths: str) -> str:
+		return os.path.join(*paths)
+
+	def is_file(self, path: str) -> bool:
+		return os.path.isfile(path)
+
+	def is_dir(self, path: str) -> bool:
+		return os.path.isdir(path)
+
+	def list_dir(self, path: str) -> Tuple[List[str], List[str]]:
+		"""
+		Returns the names of the subdirectories and files in a directory
+		"""
+		_, subdirs, files = next(os.walk(path))
+		return subdirs, files
+
+	def walk_files(self, path: str) -> Iterator[str]:
+		"""
+		Yields the paths of all files in a directory, recursively
+		"""
+		for root, _, files in os.walk(path):
+			for filename in files:
+				yield os.path.join(root, filename)
+
+	def read_text(self, path: str) -> str:
+		with open(path, "r", encoding="utf-8") as f:
+			return f.read()
+
+
+def _normalize(path: str) -> str:
+	# normpath keeps a leading "//"
+	return posixpath.normpath("/" + path.lstrip("/"))
+
+
+class ZipFileSystem(FileSystem):
+	"""
+	Reads files directly from a zip archive, without extracting it.
+	Paths are absolute POSIX paths, where "/" is the root of the archive.
+
+	The archive's member names must have been checked to be safe.
+	"""
+
+	zf: ZipFile
+	files: dict[str, str]
+	dirs: dict[str, Tuple[List[str], List[str]]]
+
+	def __init__(self, zf: ZipFile):
+		self.zf = zf
+		self.files = {}
+		self.dirs = { "/": ([], []) }
+
+		for info in zf.infolist():
+			path = _normalize(info.filename)
+			if info.is_dir():
+				self._add_dir(path)
+			else:
+				self._add_dir(posixpath.dirname(path))
+				parent = self.dirs[posixpath.dirname(path)]
+				if path not in self.files:
+					parent[1].append(posixpath.basename(path))
+				self.files[path] = info.filename
+
+	def _add_dir(self, path: str):
+		if path in self.dirs:
+			return
+
+		self._add_dir(posixpath.dirname(path))
+		self.dirs[posixpath.dirname(path)][0].append(posixpath.basename(path))
+		self.dirs[path] = ([], [])
+
+	def join(self, *paths: str) -> str:
+		return posixpath.join(*paths)
+
+	def is_file(self, path: str) -> bool:
+		return _normalize(path) in self.files
+
+	def is_dir(self, path: str) -> bool:
+		return _normalize(path) in self.dirs
+
+	def list_dir(self, path: str) -> Tuple[List[str], List[str]]:
+		entry = self.dirs.get(_normalize(path))
+		if entry is None:
+			raise FileNotFoundError(path)
+
+		return list(entry[0]), list(entry[1])
+
+	def walk_files(self, path: str) -> Iterator[str]:
+		path = _normalize(path)
+		prefix = path if path.endswith("/") else path + "/"
+		for file_path in self.files.keys():
+			if file_path.startswith(prefix):
+				yield file_path
+
+	def read_text(self, path: str) -> str:
+		name = self.files.get(_normalize(path))
+		if name is None:
+			raise FileNotFoundError(path)
+
+		with self.zf.open(name, "r") as f:
+			return io.TextIOWrapper(f, encoding="utf-8").read()
@@ -2,8 +2,10 @@
 # SPDX-License-Identifier: AGPL-3.0-or-later
 # Copyright (C) 2018-2025 rubenwardy <rw@rubenwardy>
 
+import io
 import os
 import re
+from typing import Optional
 
 
 class Translation:
@@ -17,7 +19,10 @@ class Translation:
 		self.entries = entries
 
 
-def parse_tr(filepath: str) -> Translation:
+def parse_tr(filepath: str, contents: Optional[str] = None) -> Translation:
+	"""
+	Parses a .tr file. If `contents` is given, it's used instead of reading `filepath`
+	"""
 	entries = {}
 	filename = os.path.basename(filepath)
 	filename_parts = filename.split(".")
@@ -28,7 +33,7 @@ def parse_tr(filepath: str) -> Translation:
 	textdomain = ".".join(filename_parts[0:-2])
 	had_textdomain_comment = False
 
-	with open(filepath, "r", encoding="utf-8") as existing_file:
+	with open(filepath, "r", encoding="utf-8") if contents is None else io.StringIO(contents) as existing_file:
 		lines = existing_file.readlines()
 		line_index = 0
 		while line_index < len(lines):
@@ -5,11 +5,12 @@
 
 import os
 import re
-import glob
+from fnmatch import fnmatch
 from typing import Optional
 
 from . import LuantiCheckError, ContentType
 from .config import parse_conf
+from .fs import FileSystem
 from .translation import Translation, parse_tr
 
 basenamePattern = re.compile(r"^([a-z0-9_]+)$")
@@ -21,28 +22,28 @@ DISALLOWED_NAMES = {
 }
 
 
-def get_base_dir(path) -> str:
-	if not os.path.isdir(path):
+def get_base_dir(path, fs: FileSystem) -> str:
+	if not fs.is_dir(path):
 		raise IOError("Expected dir")
 
-	root, subdirs, files = next(os.walk(path))
+	subdirs, files = fs.list_dir(path)
 	if len(subdirs) == 1 and len(files) == 0:
-		return get_base_dir(path + "/" + subdirs[0])
+		return get_base_dir(fs.join(path, subdirs[0]), fs)
 	else:
 		return path
 
 
-def detect_type(path) -> ContentType:
-	if os.path.isfile(path + "/game.conf"):
+def detect_type(path, fs: FileSystem) -> ContentType:
+	if fs.is_file(path + "/game.conf"):
 		return ContentType.GAME
-	elif os.path.isfile(path + "/init.lua"):
+	elif fs.is_file(path + "/init.lua"):
 		return ContentType.MOD
-	elif os.path.isfile(path + "/modpack.txt") or \
-			os.path.isfile(path + "/modpack.conf"):
+	elif fs.is_file(path + "/modpack.txt") or \
+			fs.is_file(path + "/modpack.conf"):
 		return ContentType.MODPACK
-	# elif os.path.isdir(path + "/mods"):
+	# elif fs.is_dir(path + "/mods"):
 	# 	return ContentType.GAME
-	elif os.path.isfile(path + "/texture_pack.conf"):
+	elif fs.is_file(path + "/texture_pack.conf"):
 		return ContentType.TXP
 	else:
 		return ContentType.UNKNOWN
@@ -69,6 +70,7 @@ def check_name_list(key: str, value: list[str], relative: str, allow_star: bool
 
 
 class PackageTreeNode:
+	fs: FileSystem
 	baseDir: str
 	relative: str
 	author: Optional[str]
@@ -84,7 +86,8 @@ class PackageTreeNode:
 	def __init__(self, base_dir: str, relative: str,
 			author: Optional[str] = None,
 			repo: Optional[str] = None, name: Optional[str] = None,
-			strict: bool = True):
+			strict: bool = True, fs: Optional[FileSystem] = None):
+		self.fs = fs or FileSystem()
 		self.baseDir = base_dir
 		self.relative = relative
 		self.author = author
@@ -97,11 +100,11 @@ class PackageTreeNode:
 		self.has_legacy_description = False
 
 		# Detect type
-		self.type = detect_type(base_dir)
+		self.type = detect_type(base_dir, self.fs)
 		self._read_meta()
 
 		if self.type == ContentType.GAME:
-			if not os.path.isdir(os.path.join(base_dir, "mods")):
+			if not self.fs.is_dir(self.fs.join(base_dir, "mods")):
 				raise LuantiCheckError("Game at {} does not have a mods/ folder".format(self.relative))
 			self._add_children_from_mod_dir("mods")
 		elif self.type == ContentType.MOD:
@@ -116,24 +119,28 @@ class PackageTreeNode:
 			self._add_children_from_mod_dir(None)
 
 	def find_license_file(self) -> Optional[str]:
-		for name in os.listdir(self.baseDir):
-			path = os.path.join(self.baseDir, name)
-			if os.path.isfile(path) and licensePattern.match(name):
-				return path
+		for name in self.fs.list_dir(self.baseDir)[1]:
+			if licensePattern.match(name):
+				return self.fs.join(self.baseDir, name)
 
 		return None
 
 	def _check_dir_casing(self, dirs):
-		for dir in next(os.walk(self.baseDir))[1]:
+		for dir in self.fs.list_dir(self.baseDir)[0]:
 			lowercase = dir.lower()
 			if lowercase != dir and lowercase in dirs:
 				raise LuantiCheckError(f"Incorrect case, {dir} should be {lowercase} at {self.relative}{dir}")
 
 	def get_readme_path(self):
-		for filename in os.listdir(self.baseDir):
-			path = os.path.join(self.baseDir, filename)
-			if os.path.isfile(path) and filename.lower().startswith("readme."):
-				return path
+		for filename in self.fs.list_dir(self.baseDir)[1]:
+			if filename.lower().startswith("readme."):
+				return self.fs.join(self.baseDir, filename)
+
+	def read_text(self, filename: str) -> str:
+		"""
+		Reads a file in this node's directory, raising IOError if it doesn't exist
+		"""
+		return self.fs.read_text(self.fs.join(self.baseDir, filename))
 
 	def get_meta_file_name(self):
 		if self.type == ContentType.GAME:
@@ -156,10 +163,9 @@ class PackageTreeNode:
 			meta_file_rel = self.relative + meta_file_name
 			meta_file_path = self.baseDir + "/" + meta_file_name
 			try:
-				with open(meta_file_path or "", "r") as f:
-					conf = parse_conf(f.read())
-					for key, value in conf.items():
-						result[key] = value
+				conf = parse_conf(self.fs.read_text(meta_file_path))
+				for key, value in conf.items():
+					result[key] = value
 			except SyntaxError as e:
 				raise LuantiCheckError("Error while reading {}: {}".format(meta_file_rel , e.msg))
 			except IOError:
@@ -171,14 +177,13 @@ class PackageTreeNode:
 		# description.txt
 		if "description" not in result:
 			try:
-				with open(self.baseDir + "/description.txt", "r") as f:
-					result["description"] = f.read()
+				result["description"] = self.fs.read_text(self.baseDir + "/description.txt")
 			except IOError:
 				pass
 
-		if os.path.isfile(self.baseDir + "/depends.txt"):
+		if self.fs.is_file(self.baseDir + "/depends.txt"):
 			self.has_legacy_depends = True
-		if os.path.isfile(self.baseDir + "/description.txt"):
+		if self.fs.is_file(self.baseDir + "/description.txt"):
 			self.has_legacy_description = True
 
 		# Read dependencies
@@ -186,23 +191,22 @@ class PackageTreeNode:
 			result["depends"] = get_csv_line(result.get("depends"))
 			result["optional_depends"] = get_csv_line(result.get("optional_depends"))
 
-		elif os.path.isfile(self.baseDir + "/depends.txt"):
+		elif self.fs.is_file(self.baseDir + "/depends.txt"):
 			pattern = re.compile(r"^([a-z0-9_]+)\??$")
 
-			with open(self.baseDir + "/depends.txt", "r") as f:
-				contents = f.read()
-				soft = []
-				hard = []
-				for line in contents.split("\n"):
-					line = line.strip()
-					if pattern.match(line):
-						if line[len(line) - 1] == "?":
-							soft.append( line[:-1])
-						else:
-							hard.append(line)
-
-				result["depends"] = hard
-				result["optional_depends"] = soft
+			contents = self.fs.read_text(self.baseDir + "/depends.txt")
+			soft = []
+			hard = []
+			for line in contents.split("\n"):
+				line = line.strip()
+				if pattern.match(line):
+					if line[len(line) - 1] == "?":
+						soft.append( line[:-1])
+					else:
+						hard.append(line)
+
+			result["depends"] = hard
+			result["optional_depends"] = soft
 
 		else:
 			result["depends"] = []
@@ -252,10 +256,10 @@ class PackageTreeNode:
 			dir += "/" + subdir
 			relative += subdir + "/"
 
-		for entry in next(os.walk(dir))[1]:
-			path = os.path.join(dir, entry)
-			if not entry.startswith('.') and os.path.isdir(path):
-				child = PackageTreeNode(path, relative + entry + "/", name=entry, strict=self.strict)
+		for entry in self.fs.list_dir(dir)[0]:
+			path = self.fs.join(dir, entry)
+			if not entry.startswith('.') and self.fs.is_dir(path):
+				child = PackageTreeNode(path, relative + entry + "/", name=entry, strict=self.strict, fs=self.fs)
 				if not child.type.is_mod_like():
 					raise LuantiCheckError("Expecting mod or modpack, found {} at {} inside {}" \
 						.format(child.type.value, child.relative, self.type.value))
@@ -315,9 +319,22 @@ class PackageTreeNode:
 		for child in self.children:
 			child.validate()
 
+	def _find_translation_files(self, filename_pattern: str) -> list[str]:
+		"""
+		Finds files matching `**/locale/<filename_pattern>`, skipping hidden files and directories like glob does
+		"""
+		ret = []
+		for path in self.fs.walk_files(self.baseDir):
+			parts = os.path.relpath(path, self.baseDir).split(os.sep)
+			if len(parts) >= 2 and parts[-2] == "locale" and fnmatch(parts[-1], filename_pattern) and \
+					not any(part.startswith(".") for part in parts):
+				ret.append(path)
+
+		return ret
+
 	def get_supported_languages(self) -> set[str]:
 		ret = set()
-		for name in glob.glob(f"{self.baseDir}/**/locale/*.*.tr", recursive=True):
+		for name in self._find_translation_files("*.*.tr"):
 			parts = os.path.basename(name).split(".")
 			ret.add(parts[-2])
 
@@ -326,14 +343,14 @@ class PackageTreeNode:
 	def get_translations(self, textdomain: str, allowed_languages: set[str]) -> list[Translation]:
 		ret = []
 
-		for name in glob.glob(f"{self.baseDir}/**/locale/{textdomain}.*.tr", recursive=True):
+		for name in self._find_translation_files(f"{textdomain}.*.tr"):
 			parts = os.path.basename(name).split(".")
 			lang = parts[-2]
 			if lang not in allowed_languages:
 				continue
 
 			try:
-				ret.append(parse_tr(name))
+				ret.append(parse_tr(name, self.fs.read_text(name)))
 			except SyntaxError as e:
 				relative_path = os.path.join(self.relative, os.path.relpath(name, self.baseDir))
 				raise LuantiCheckError(f"Syntax error whilst reading {relative_path}: {e}")
@@ -3,34 +3,93 @@
 # Copyright (C) 2018-2025 rubenwardy <rw@rubenwardy>
 
 import datetime
-import random
+import os
 import re
 import sys
-from time import sleep
+import time
 from urllib.parse import urlparse, urljoin
 from typing import Optional
 
-import requests
-import urllib3
 from app import app
 from sqlalchemy import or_, and_
 
+from app.domain.review_counts import get_inconsistent_review_counts, repair_review_counts
+from app.domain.search import update_search_index
+from app.domain.scores import recalculate_package_scores
+from app.domain.stats_buffer import flush_buffered_stats
 from app.markdown import get_links, render_markdown
 from app.models import db, Package, PackageState, PackageRelease, PackageScreenshot, AuditLogEntry
+from app.rediscache import take_score_changes, get_link_check_results, \
+	set_link_check_results
 from app.tasks import celery, TaskError
+from app.utils.link_checker import LinkChecker
 from app.utils.models import post_bot_message, post_to_approval_thread, get_system_user
+from app.utils.thumbnails import create_all_thumbnails
 
 
 @celery.task()
 def update_package_scores():
-	Package.query.update({ "score_downloads": Package.score_downloads * 0.93 })
+	start = time.monotonic()
+
+	# Every score is recalculated, so pending changes don't need to be
+	take_score_changes()
+
+	decayed = Package.query.update({ "score_downloads": Package.score_downloads * 0.93 })
+	changed = recalculate_package_scores()
+	db.session.commit()
+
+	return f"Decayed {decayed} packages and updated {changed} scores in {time.monotonic() - start:.2f}s"
+
+
+@celery.task()
+def update_changed_package_scores():
+	"""
+	Recalculates the scores of packages whose reviews changed since the last run.
+	Downloads don't need to be included, as flushing buffered stats adds them to the score.
+	"""
+	start = time.monotonic()
+
+	package_ids = take_score_changes()
+
+	changed = 0
+	if len(package_ids) > 0:
+		changed = recalculate_package_scores(package_ids)
+		db.session.commit()
+
+	return f"Checked {len(package_ids)} packages and updated {changed} scores in {time.monotonic() - start:.2f}s"
+
+
+@celery.task()
+def check_review_counts():
+	"""
+	Finds and repairs stored review and vote counts that don't match the reviews and votes
+	"""
+	package_ids, review_ids = get_inconsistent_review_counts(db.session)
+	if len(package_ids) == 0 and len(review_ids) == 0:
+		return "Review counts are consistent"
+
+	print(f"Inconsistent review counts for packages {package_ids} and reviews {review_ids}", file=sys.stderr)
+
+	packages, reviews = repair_review_counts(db.session)
 	db.session.commit()
 
-	for package in Package.query.all():
-		package.recalculate_score()
+	return f"Repaired review counts of {packages} packages and vote counts of {reviews} reviews"
 
+
+@celery.task()
+def rebuild_search_index():
+	start = time.monotonic()
+	documents = update_search_index(db.session)
 	db.session.commit()
 
+	return f"Rebuilt {documents} search documents in {time.monotonic() - start:.2f}s"
+
+
+@celery.task()
+def flush_stats_buffer():
+	rows = flush_buffered_stats()
+	return f"Updated {rows} rows from buffered download and view counters"
+
 
 def desc_contains(desc: str, search_str: str):
 	if search_str.startswith("https://forum.luanti.org/viewtopic.php?%t="):
@@ -96,27 +155,14 @@ def clear_removed_packages(all_packages: bool):
 	return f"Deleted {count} soft deleted packages packages"
 
 
-def _url_exists(url: str) -> str:
-	try:
-		headers = {
-			"User-Agent": "Mozilla/5.0 (compatible; ContentDB link checker; +https://content.luanti.org/)",
-		}
-		with requests.get(url, stream=True, headers=headers, timeout=10) as response:
-			response.raise_for_status()
-			return ""
-	except requests.exceptions.HTTPError as e:
-		if e.response.status_code == 403:
-			return ""
-
-		print(f"   - [{e.response.status_code}] <{url}>", file=sys.stderr)
-		return str(e.response.status_code)
-	except requests.exceptions.ConnectionError:
-		return "ConnectionError"
-	except urllib3.exceptions.ReadTimeoutError:
-		return "timeout"
+def _make_link_checker() -> LinkChecker:
+	return LinkChecker(get_cached=get_link_check_results, set_cached=set_link_check_results)
 
 
-def _check_for_dead_links(package: Package) -> dict[str, str]:
+def _get_package_links(package: Package) -> dict[str, str]:
+	"""
+	Returns a map from absolute URL to the link as written, for links that should be checked
+	"""
 	ignored_urls = set(app.config.get("LINK_CHECKER_IGNORED_URLS", ""))
 
 	base_url = package.get_url("packages.view", absolute=True)
@@ -133,10 +179,7 @@ def _check_for_dead_links(package: Package) -> dict[str, str]:
 	if package.desc:
 		links.update(get_links(render_markdown(package.desc)))
 
-	print(f"Checking {package.title} ({len(links)} links) for broken links", file=sys.stderr)
-
-	bad_urls = {}
-
+	ret = {}
 	for link in links:
 		if link is None:
 			continue
@@ -149,18 +192,22 @@ def _check_for_dead_links(package: Package) -> dict[str, str]:
 		if url.hostname in ignored_urls:
 			continue
 
-		res = _url_exists(abs_link)
-		if res != "":
-			bad_urls[link] = res
+		ret[abs_link] = link
 
-		# Prevent leaking information
-		sleep(random.uniform(0.4, 0.6))
+	return ret
 
-	return bad_urls
 
+def _get_bad_links(links: dict[str, str], results: dict[str, str]) -> dict[str, str]:
+	return { link: results[abs_link] for abs_link, link in links.items() if results.get(abs_link, "") != "" }
 
-def _check_package(package: Package) -> Optional[str]:
-	bad_urls = _check_for_dead_links(package)
+
+def _check_for_dead_links(package: Package) -> dict[str, str]:
+	links = _get_package_links(package)
+	print(f"Checking {package.title} ({len(links)} links) for broken links", file=sys.stderr)
+	return _get_bad_links(links, _make_link_checker().check_urls(links.keys()))
+
+
+def _format_bad_links(bad_urls: dict[str, str]) -> Optional[str]:
 	if len(bad_urls) > 0:
 		return ("The following broken links were found on your package:\n\n" +
 				"\n".join([f"- <{link}> [{res}]" for link, res in bad_urls.items()]))
@@ -168,6 +215,10 @@ def _check_package(package: Package) -> Optional[str]:
 	return None
 
 
+def _check_package(package: Package) -> Optional[str]:
+	return _format_bad_links(_check_for_dead_links(package))
+
+
 @celery.task()
 def check_package_on_submit(package_id: int):
 	package = Package.query.get(package_id)
@@ -184,7 +235,7 @@ def check_package_on_submit(package_id: int):
 		db.session.commit()
 
 
-@celery.task(rate_limit="5/m")
+@celery.task()
 def check_package_for_broken_links(package_id: int):
 	package = Package.query.get(package_id)
 	if package is None:
@@ -196,6 +247,46 @@ def check_package_for_broken_links(package_id: int):
 		db.session.commit()
 
 
+@celery.task(bind=True)
+def check_all_packages_for_broken_links(self):
+	"""
+	Checks the links of all approved packages, checking each distinct URL once
+	"""
+	start = time.monotonic()
+
+	packages = Package.query.filter_by(state=PackageState.APPROVED).all()
+	package_links = { package.id: _get_package_links(package) for package in packages }
+	urls = set()
+	for links in package_links.values():
+		urls.update(links.keys())
+
+	self.update_state(state="PROGRESS", meta={
+		"current": 0,
+		"total": len(urls),
+	})
+
+	def on_progress(current: int, total: int):
+		self.update_state(state="PROGRESS", meta={
+			"current": current,
+			"total": total,
+		})
+
+	results = _make_link_checker().check_urls(urls, on_progress)
+
+	reported = 0
+	for package in packages:
+		msg = _format_bad_links(_get_bad_links(package_links[package.id], results))
+		if msg:
+			post_bot_message(package, "Broken links", msg)
+			reported += 1
+
+	db.session.commit()
+
+	broken = len([x for x in results.values() if x != ""])
+	return f"Checked {len(urls)} links in {len(packages)} packages, found {broken} broken links in {reported} " \
+			f"packages in {time.monotonic() - start:.0f}s"
+
+
 @celery.task(bind=True)
 def update_file_size_bytes(self):
 	releases = PackageRelease.query.filter_by(file_size_bytes=0).all()
@@ -225,3 +316,40 @@ def update_file_size_bytes(self):
 			})
 
 	db.session.commit()
+
+
+@celery.task()
+def create_screenshot_thumbnails(screenshot_id: int):
+	ss = PackageScreenshot.query.get(screenshot_id)
+	if ss is None:
+		return
+
+	create_all_thumbnails(os.path.basename(ss.url))
+
+
+@celery.task(bind=True)
+def create_all_screenshot_thumbnails(self):
+	urls = [x[0] for x in db.session.query(PackageScreenshot.url).all()]
+	total = len(urls)
+	self.update_state(state="PROGRESS", meta={
+		"current": 0,
+		"total": total,
+	})
+
+	created = 0
+	failed = 0
+	for i, url in enumerate(urls):
+		# One broken upload, or a lock that can't be acquired, shouldn't stop the backfill
+		try:
+			created += create_all_thumbnails(os.path.basename(url))
+		except Exception as e:
+			print(f"Unable to create thumbnails for {url}: {type(e).__name__}: {e}", file=sys.stderr)
+			failed += 1
+
+		if i % 100 == 0:
+			self.update_state(state="PROGRESS", meta={
+				"current": i + 1,
+				"total": total,
+			})
+
+	return f"Created {created} thumbnails for {total} screenshots, {failed} failed"
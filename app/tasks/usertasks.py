@@ -4,15 +4,16 @@
 
 
 import datetime, requests
-import os
 import sys
+import time
 
 from flask import url_for
 from sqlalchemy import or_, and_, not_, func
 
 from app import app
+from app.domain.uploads import store_stream
+from app.domain.user_rankings import update_user_rankings
 from app.models import User, db, UserRank, Thread, Package, Notification, NotificationType
-from app.utils.misc import random_string
 from app.utils.models import create_session, add_notification, get_system_user
 from app.tasks import celery, TaskError
 
@@ -65,9 +66,7 @@ def set_profile_picture_from_url(username: str, url: str):
 	else:
 		raise TaskError(f"Unacceptable content-type: {content_type}")
 
-	filename = random_string(10) + "." + ext
-	filepath = os.path.join(app.config["UPLOAD_DIR"], filename)
-	with open(filepath, "wb") as f:
+	def read_chunks():
 		size = 0
 		for chunk in resp.iter_content(chunk_size=1024):
 			if chunk:  # filter out keep-alive new chunks
@@ -75,9 +74,9 @@ def set_profile_picture_from_url(username: str, url: str):
 				if size > 3 * 1000 * 1000:  # 3 MB
 					raise TaskError(f"File too large to download {url}")
 
-				f.write(chunk)
+				yield chunk
 
-	user.profile_pic = "/uploads/" + filename
+	user.profile_pic, filepath = store_stream(read_chunks(), ext)
 	db.session.commit()
 
 	return filepath
@@ -144,3 +143,10 @@ def delete_old_notifications():
 	one_month_ago = datetime.datetime.now() - datetime.timedelta(weeks=4)
 	Notification.query.filter(Notification.read_at < one_month_ago).delete()
 	db.session.commit()
+
+
+@celery.task()
+def update_user_medal_rankings():
+	start = time.monotonic()
+	count = update_user_rankings()
+	return f"Ranked {count} users in {time.monotonic() - start:.2f}s"
@@ -2,72 +2,156 @@
 # SPDX-License-Identifier: AGPL-3.0-or-later
 # Copyright (C) 2018-2025 rubenwardy <rw@rubenwardy>
 
-import subprocess
+import os
+import re
+import sqlite3
 import sys
-from subprocess import Popen, PIPE, TimeoutExpired
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from typing import Optional, List
 
+from app import app
 from app.models import Package, PackageState, PackageRelease
-from app.tasks import celery
+from app.tasks import celery, TaskError
+from app.utils.zipgrep import compile_query, search_archive_in_subprocess, ReleaseIndex
+
+
+# Maximum time spent searching a single release, in seconds
+ARCHIVE_TIME_BUDGET = 45
+
+
+def get_release_index() -> Optional[ReleaseIndex]:
+	path = app.config.get("ZIPGREP_INDEX_PATH")
+	return ReleaseIndex(path) if path else None
+
+
+def update_package_in_index(package: Package):
+	"""
+	Indexes the latest approved release of a package, or removes the package from the index if there isn't one
+	"""
+	index = get_release_index()
+	if index is None:
+		return
+
+	release: Optional[PackageRelease] = None
+	if package.state != PackageState.DELETED:
+		release = package.get_download_release()
+
+	try:
+		if release is None:
+			index.remove(package.id)
+		elif index.get_indexed_releases().get(package.id) != release.id:
+			index.add(package.id, release.id, release.file_path)
+	except Exception as e:
+		# Indexing is best-effort: this is called after releases are approved, and packages that
+		# aren't indexed are still searched
+		print(f"[Zipgrep] Unable to index {package.get_id()}: {e}", file=sys.stderr)
+
+
+@celery.task()
+def update_release_index(package_id: int):
+	package = Package.query.get(package_id)
+	if package is None:
+		index = get_release_index()
+		if index:
+			index.remove(package_id)
+		return
+
+	update_package_in_index(package)
 
 
 @celery.task(bind=True)
-def search_in_releases(self, query: str, file_filter: str, types: List[str]):
+def rebuild_release_index(self):
+	index = get_release_index()
+	if index is None:
+		raise TaskError("ZIPGREP_INDEX_PATH is not set")
+
+	packages = Package.query.filter(Package.state != PackageState.DELETED).all()
+	package_ids = set([package.id for package in packages])
+	for package_id in index.get_indexed_releases().keys():
+		if package_id not in package_ids:
+			index.remove(package_id)
+
+	total = len(packages)
+	for i, package in enumerate(packages):
+		update_package_in_index(package)
+		self.update_state(state="PROGRESS", meta={"current": i + 1, "total": total})
+
+	return f"Indexed {total} packages"
+
+
+@celery.task(bind=True)
+def search_in_releases(self, query: str, file_filter: str, types: List[str], literal: bool = False):
+	try:
+		compile_query(query, literal)
+	except re.error as e:
+		raise TaskError(f"Invalid regex: {e}")
+
 	pkg_query = Package.query.filter(Package.state == PackageState.APPROVED)
 	if len(types) > 0:
 		pkg_query = pkg_query.filter(Package.type.in_(types))
 
-	packages = list(pkg_query.all())
-	results = []
+	# Releases that are indexed and don't contain the query can be skipped
+	indexed_releases = {}
+	candidates = None
+	index = get_release_index()
+	if index:
+		try:
+			candidates = index.get_candidates(query, literal)
+			if candidates is not None:
+				indexed_releases = index.get_indexed_releases()
+		except sqlite3.Error as e:
+			print(f"[Zipgrep] Unable to use index: {e}", file=sys.stderr)
+			candidates = None
 
-	total = len(packages)
-	self.update_state(state="PROGRESS", meta={"current": 0, "total": total})
-
-	while len(packages) > 0:
-		package = packages.pop()
+	to_search = []
+	for package in pkg_query.all():
 		release: Optional[PackageRelease] = package.get_download_release()
-		if release:
-			print(f"[Zipgrep] Checking {package.name}", file=sys.stderr)
-			self.update_state(state="PROGRESS", meta={
-				"current": total - len(packages),
-				"total": total,
-				"running": [package.as_key_dict()],
-			})
+		if release is None:
+			continue
+
+		if candidates is not None and package.id not in candidates and indexed_releases.get(package.id) == release.id:
+			continue
 
-			handle = Popen(["zipgrep", query, release.file_path, file_filter], stdout=PIPE, encoding="UTF-8")
+		to_search.append((package.as_key_dict(), release.file_path))
 
+	results = []
+
+	total = len(to_search)
+	self.update_state(state="PROGRESS", meta={"current": 0, "total": total, "query": query, "matches": []})
+
+	# Each release is searched in a subprocess, so that it can be killed on timeout. Celery's prefork
+	# workers are daemonic and can't use multiprocessing.
+	with ThreadPoolExecutor(max_workers=app.config.get("ZIPGREP_WORKERS") or os.cpu_count()) as executor:
+		futures = {
+			executor.submit(search_archive_in_subprocess, file_path, query, literal, file_filter,
+					ARCHIVE_TIME_BUDGET): package
+			for package, file_path in to_search
+		}
+
+		for i, future in enumerate(as_completed(futures)):
+			package = futures[future]
 			try:
-				handle.wait(timeout=45)
-			except TimeoutExpired:
-				print(f"[Zipgrep] Timeout for {package.name}", file=sys.stderr)
-				handle.kill()
-				results.append({
-					"package": package.as_key_dict(),
-					"lines": "Error: timeout",
-				})
-				continue
+				lines = future.result()
+			except Exception as e:
+				lines = f"Error: {e}"
 
-			exit_code = handle.poll()
-			if exit_code is None:
-				print(f"[Zipgrep] Timeout for {package.name}", file=sys.stderr)
-				handle.kill()
-				results.append({
-					"package": package.as_key_dict(),
-					"lines": "Error: timeout",
-				})
-			elif exit_code == 0:
-				print(f"[Zipgrep] Success for {package.name}", file=sys.stderr)
-				results.append({
-					"package": package.as_key_dict(),
-					"lines": handle.stdout.read(),
-				})
-			elif exit_code != 1:
-				print(f"[Zipgrep] Error {exit_code} for {package.name}", file=sys.stderr)
+			if lines.startswith("Error: "):
+				print(f"[Zipgrep] {lines} for {package['name']}", file=sys.stderr)
+
+			if lines != "":
 				results.append({
-					"package": package.as_key_dict(),
-					"lines": f"Error: exit {exit_code}",
+					"package": package,
+					"lines": lines,
 				})
 
+			# Matches found so far are included so that they can be shown while the search runs
+			self.update_state(state="PROGRESS", meta={
+				"current": i + 1,
+				"total": total,
+				"query": query,
+				"matches": results,
+			})
+
 	return {
 		"query": query,
 		"matches": results,
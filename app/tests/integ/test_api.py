@@ -2,9 +2,12 @@
 # SPDX-License-Identifier: AGPL-3.0-or-later
 # Copyright (C) 2018-2025 rubenwardy <rw@rubenwardy>
 
+from urllib.parse import urlparse
+
+from sqlalchemy import event
 
 from app.default_data import populate_test_data
-from app.models import db, Package, PackageState
+from app.models import db, Package, PackageState, PackageReview, User
 from .utils import parse_json, validate_package_list
 from .utils import client # noqa
 
@@ -63,3 +66,87 @@ def test_dependencies(client):
 	assert not deps[0]["is_optional"]
 	assert len(deps[0]["packages"]) == 1
 	assert deps[0]["packages"][0] == "rubenwardy/food"
+
+
+def test_dependencies_cursor_pagination(client):
+	populate_test_data(db.session)
+	db.session.commit()
+
+	expected = [x["author"] + "/" + x["name"] for x in parse_json(client.get("/api/dependencies/?n=300").data)["items"]]
+	assert len(expected) > 3
+
+	for sort in ["score", "downloads", "created_at", "approved_at"]:
+		names = []
+		url = f"/api/dependencies/?sort={sort}&n=2&cursor="
+		while url:
+			rv = parse_json(client.get(url).data)
+			assert rv["total"] == len(expected)
+			names.extend([x["author"] + "/" + x["name"] for x in rv["items"]])
+			url = rv["urls"]["next"] and urlparse(rv["urls"]["next"])._replace(scheme="", netloc="").geturl()
+
+		assert sorted(names) == sorted(expected)
+
+	rv = client.get("/api/dependencies/?sort=name&cursor=")
+	assert rv.status_code == 400
+
+	rv = client.get("/api/dependencies/?cursor=invalid")
+	assert rv.status_code == 400
+
+
+def test_updates_not_modified(client):
+	populate_test_data(db.session)
+	db.session.commit()
+
+	rv = client.get("/api/updates/")
+	assert rv.status_code == 200
+	etag = rv.headers.get("ETag")
+	assert etag
+
+	rv = client.get("/api/updates/", headers={"If-None-Match": etag})
+	assert rv.status_code == 304
+	assert rv.data == b""
+
+
+def test_scores_query_count(client):
+	populate_test_data(db.session)
+	db.session.commit()
+
+	author = User.query.first()
+	packages = Package.query.filter_by(state=PackageState.APPROVED).all()
+	for i, package in enumerate(packages):
+		for rating in range(1, (i % 5) + 2):
+			review = PackageReview()
+			review.package = package
+			review.author = author
+			review.rating = rating
+			review.approved = True
+			db.session.add(review)
+	db.session.commit()
+
+	statements = []
+
+	def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+		statements.append(statement)
+
+	event.listen(db.engine, "before_cursor_execute", before_cursor_execute)
+	try:
+		rv = client.get("/api/scores/")
+	finally:
+		event.remove(db.engine, "before_cursor_execute", before_cursor_execute)
+
+	scores = parse_json(rv.data)
+	assert len(scores) == len(packages)
+
+	# Packages and eager loads, not one query per package. Review counts are columns of the package,
+	# so reviews aren't queried at all
+	assert len(statements) <= 5
+	assert not any("package_review" in x for x in statements)
+
+	for package in packages:
+		reviews = package.reviews.filter_by(approved=True)
+		actual = next(x["reviews"] for x in scores if x["name"] == package.name and x["author"] == package.author.username)
+		assert actual == {
+			"positive": reviews.filter(PackageReview.rating > 3).count(),
+			"neutral": reviews.filter(PackageReview.rating == 3).count(),
+			"negative": reviews.filter(PackageReview.rating < 3).count(),
+		}
@@ -0,0 +1,194 @@
+# ContentDB
+# SPDX-License-Identifier: AGPL-3.0-or-later
+# Copyright (C) 2018-2025 rubenwardy <rw@rubenwardy>
+
+import datetime
+
+from app.domain import bulk_jobs
+from app.domain.bulk_jobs import create_bulk_job, advance_bulk_job, get_bulk_job_status, take_expired_bulk_jobs, \
+	mark_bulk_job_item_succeeded, advance_bulk_job_now
+from app.models import db, BulkJob, BulkJobItemState
+from app.tasks.importtasks import import_languages
+from .utils import client # noqa
+
+
+class FakeResult:
+	def __init__(self, status: str, result=None):
+		self.status = status
+		self.result = result
+
+	def forget(self):
+		pass
+
+
+class FakeCelery:
+	def __init__(self):
+		self.sent = {}
+		self.results = {}
+
+		self.callbacks = {}
+
+	def send_task(self, name, args, task_id, link=None, link_error=None):
+		self.sent[task_id] = (name, args)
+		self.callbacks[task_id] = (link, link_error)
+
+	def signature(self, name, args, immutable):
+		return name, args
+
+	def AsyncResult(self, task_id):
+		return self.results.get(task_id, FakeResult("PENDING"))
+
+	def finish_all(self, failed_args=None):
+		for task_id, (_, args) in self.sent.items():
+			if task_id not in self.results:
+				if args == failed_args:
+					self.results[task_id] = FakeResult("FAILURE", Exception("Broken zip"))
+				else:
+					self.results[task_id] = FakeResult("SUCCESS")
+
+
+def test_bulk_job_runs_all_items(client, monkeypatch):
+	celery = FakeCelery()
+	monkeypatch.setattr(bulk_jobs, "celery", celery)
+
+	job = create_bulk_job(db.session, "Import translations", import_languages,
+			[(i, f"/tmp/{i}.zip") for i in range(5)], concurrency=2)
+	db.session.commit()
+	job_id = job.id
+	token = job.lease_token
+	assert job.total == 5
+
+	advance_bulk_job(db.session, job_id, token)
+	assert len(celery.sent) == 2
+	assert all(name == import_languages.name for name, _ in celery.sent.values())
+
+	# Nothing finished, so no more tasks are started
+	advance_bulk_job(db.session, job_id, token)
+	assert len(celery.sent) == 2
+	assert get_bulk_job_status(db.session.get(BulkJob, job_id))["status"] == "PROGRESS"
+
+	for _ in range(10):
+		celery.finish_all(failed_args=[3, "/tmp/3.zip"])
+		job = advance_bulk_job(db.session, job_id, token)
+		if job.is_finished:
+			break
+
+	assert job.is_finished
+	assert len(celery.sent) == 5
+	assert job.succeeded == 4
+	assert job.failed == 1
+
+	status = get_bulk_job_status(job)
+	assert status["status"] == "SUCCESS"
+	assert status["result"]["errors"] == [{ "args": [3, "/tmp/3.zip"], "error": "Broken zip" }]
+
+
+def test_bulk_job_retries_lost_tasks(client, monkeypatch):
+	celery = FakeCelery()
+	monkeypatch.setattr(bulk_jobs, "celery", celery)
+
+	job = create_bulk_job(db.session, "Import translations", import_languages, [(1, "/tmp/1.zip")])
+	db.session.commit()
+	job_id = job.id
+	token = job.lease_token
+
+	advance_bulk_job(db.session, job_id, token)
+	assert len(celery.sent) == 1
+
+	# A task that is still queued isn't retried
+	item = db.session.get(BulkJob, job_id).items.one()
+	item.started_at -= bulk_jobs.LOST_TASK_TIMEOUT + datetime.timedelta(minutes=1)
+	db.session.commit()
+
+	advance_bulk_job(db.session, job_id, token)
+	assert len(celery.sent) == 1
+
+	# Simulate a worker restart losing the running task
+	celery.results[item.task_id] = FakeResult("STARTED")
+	advance_bulk_job(db.session, job_id, token)
+	assert len(celery.sent) == 2
+
+	item = db.session.get(BulkJob, job_id).items.one()
+	assert item.state == BulkJobItemState.RUNNING
+	assert item.attempts == 2
+
+	celery.finish_all()
+	job = advance_bulk_job(db.session, job_id, token)
+	assert job.is_finished
+	assert job.succeeded == 1
+
+
+def test_empty_bulk_job(client):
+	job = create_bulk_job(db.session, "Import translations", import_languages, [])
+	db.session.commit()
+
+	assert job.is_finished
+	assert get_bulk_job_status(job)["result"]["total"] == 0
+
+
+def test_bulk_job_lease(client, monkeypatch):
+	celery = FakeCelery()
+	monkeypatch.setattr(bulk_jobs, "celery", celery)
+
+	job = create_bulk_job(db.session, "Import translations", import_languages,
+			[(i, f"/tmp/{i}.zip") for i in range(5)], concurrency=1)
+	db.session.commit()
+	job_id = job.id
+	old_token = job.lease_token
+
+	# The lease is renewed by each run
+	assert advance_bulk_job(db.session, job_id, old_token) is not None
+	assert take_expired_bulk_jobs(db.session) == []
+
+	job = db.session.get(BulkJob, job_id)
+	job.lease_expires_at = datetime.datetime.utcnow() - datetime.timedelta(minutes=1)
+	db.session.commit()
+
+	resumed = take_expired_bulk_jobs(db.session)
+	assert len(resumed) == 1
+	assert resumed[0][0] == job_id
+	new_token = resumed[0][1]
+	assert new_token != old_token
+
+	# The old chain stops, even if it was only delayed
+	celery.finish_all()
+	assert advance_bulk_job(db.session, job_id, old_token) is None
+	assert len(celery.sent) == 1
+
+	assert advance_bulk_job(db.session, job_id, new_token) is not None
+	assert len(celery.sent) == 2
+
+
+def test_bulk_job_advances_when_item_finishes(client, monkeypatch):
+	celery = FakeCelery()
+	monkeypatch.setattr(bulk_jobs, "celery", celery)
+
+	job = create_bulk_job(db.session, "Import translations", import_languages,
+			[(i, f"/tmp/{i}.zip") for i in range(3)], concurrency=1)
+	db.session.commit()
+	job_id = job.id
+
+	advance_bulk_job(db.session, job_id, job.lease_token)
+	assert len(celery.sent) == 1
+
+	task_id = next(iter(celery.sent.keys()))
+	link, link_error = celery.callbacks[task_id]
+	assert link == (bulk_jobs.ITEM_SUCCEEDED_TASK, (job_id, task_id))
+	assert link_error == (bulk_jobs.ITEM_FAILED_TASK, (job_id,))
+
+	# The success callback runs before the result is stored, so the item is marked by the callback
+	mark_bulk_job_item_succeeded(db.session, job_id, task_id)
+	job = advance_bulk_job_now(db.session, job_id)
+	assert job.succeeded == 1
+	assert len(celery.sent) == 2
+
+	# A callback from an earlier attempt doesn't change the item
+	item = db.session.get(BulkJob, job_id).items.filter_by(state=BulkJobItemState.RUNNING).one()
+	mark_bulk_job_item_succeeded(db.session, job_id, task_id)
+	assert db.session.get(BulkJob, job_id).items.filter_by(id=item.id).one().state == BulkJobItemState.RUNNING
+
+	# The error callback collects the failure from the result backend
+	celery.results[item.task_id] = FakeResult("FAILURE", Exception("Broken zip"))
+	job = advance_bulk_job_now(db.session, job_id)
+	assert job.failed == 1
+	assert len(celery.sent) == 3
@@ -0,0 +1,70 @@
+# ContentDB
+# SPDX-License-Identifier: AGPL-3.0-or-later
+# Copyright (C) 2018-2025 rubenwardy <rw@rubenwardy>
+
+import json
+import multiprocessing
+import os
+import zipfile
+
+import pytest
+
+from app import app
+from app.default_data import populate_test_data
+from app.models import db, Package
+from app.tasks.dumptask import create_database_dump, MANIFEST_PATH
+from .utils import client # noqa
+
+
+@pytest.fixture
+def upload_dir(tmp_path, monkeypatch):
+	monkeypatch.setitem(app.config, "UPLOAD_DIR", str(tmp_path))
+	return tmp_path
+
+
+@pytest.fixture
+def daemonic(monkeypatch):
+	# Like Celery's prefork workers, which can't start child processes
+	monkeypatch.setitem(multiprocessing.current_process()._config, "daemon", True)
+
+
+def read_dump(path) -> dict[str, bytes]:
+	with zipfile.ZipFile(path) as zipf:
+		assert zipf.testzip() is None
+		return { name: zipf.read(name) for name in zipf.namelist() }
+
+
+def test_create_database_dump(client, upload_dir, daemonic):
+	populate_test_data(db.session)
+	db.session.commit()
+
+	result = create_database_dump.apply()
+	assert result.successful(), result.traceback
+
+	dumps = os.listdir(upload_dir)
+	assert len(dumps) == 1 and not dumps[0].endswith("-incremental.zip")
+
+	entries = read_dump(upload_dir / dumps[0])
+	manifest = json.loads(entries[MANIFEST_PATH])
+	assert not manifest["incremental"]
+
+	package = Package.query.filter_by(name="awards").one()
+	path = f"backup/{package.author.username}/awards"
+	assert json.loads(entries[f"{path}/index.json"])["name"] == "awards"
+	assert len(json.loads(entries[f"{path}/releases.json"])) == package.releases.count()
+	assert set(manifest["entries"].keys()) == set(entries.keys()) - { "backup/index.json", MANIFEST_PATH }
+
+	package.title = "Changed"
+	db.session.commit()
+
+	result = create_database_dump.apply((True,))
+	assert result.successful(), result.traceback
+
+	incremental = [x for x in os.listdir(upload_dir) if x.endswith("-incremental.zip")]
+	assert len(incremental) == 1
+
+	entries = read_dump(upload_dir / incremental[0])
+	manifest = json.loads(entries[MANIFEST_PATH])
+	assert manifest["incremental"]
+	assert manifest["base"] == dumps[0]
+	assert set(entries.keys()) == { "backup/index.json", f"{path}/index.json", MANIFEST_PATH }
@@ -0,0 +1,80 @@
+# ContentDB
+# SPDX-License-Identifier: AGPL-3.0-or-later
+# Copyright (C) 2018-2025 rubenwardy <rw@rubenwardy>
+
+from typing import List
+
+from app.default_data import populate_test_data
+from app.domain import game_support
+from app.domain.game_support import game_support_update_all
+from app.models import db, Package, PackageState, PackageType, PackageGameSupport, MetaPackage, Dependency, License, \
+	User, UserRank, PackageAIDisclosure
+from .utils import client # noqa
+
+
+def make_package(name: str, type_: PackageType, provides: List[str], depends: List[str]) -> Package:
+	package = Package()
+	package.ai_disclosure = PackageAIDisclosure.UNKNOWN
+	package.state = PackageState.APPROVED
+	package.name = name
+	package.title = name
+	package.license = License.query.filter_by(name="MIT").one()
+	package.media_license = package.license
+	package.type = type_
+	package.author = User.query.filter_by(rank=UserRank.ADMIN).first()
+	package.short_desc = "Game support test"
+	db.session.add(package)
+
+	for modname in provides:
+		meta = MetaPackage.query.filter_by(name=modname).first() or MetaPackage(modname)
+		package.provides.append(meta)
+
+	for modname in depends:
+		meta = MetaPackage.query.filter_by(name=modname).first() or MetaPackage(modname)
+		db.session.add(Dependency(package, meta=meta))
+
+	db.session.flush()
+	return package
+
+
+def add_game_support(package: Package, game: Package, confidence: int):
+	support = PackageGameSupport()
+	support.package = package
+	support.game = game
+	support.supports = True
+	support.confidence = confidence
+	db.session.add(support)
+
+
+def get_game_support(package: Package) -> set[tuple[str, int]]:
+	return set([(x.game.name, x.confidence) for x in PackageGameSupport.query.filter_by(package_id=package.id).all()])
+
+
+def test_game_support_update_all(client, monkeypatch):
+	monkeypatch.setattr(game_support, "_cache", game_support._GameSupportCache())
+
+	populate_test_data(db.session)
+	game1 = make_package("game1", PackageType.GAME, ["default"], [])
+	game2 = make_package("game2", PackageType.GAME, ["default2"], [])
+	mod = make_package("mod1", PackageType.MOD, ["mod1"], ["default"])
+	user_mod = make_package("mod2", PackageType.MOD, ["mod2"], ["default"])
+
+	# Detected support that no longer applies, and support given by the user
+	add_game_support(mod, game2, 1)
+	add_game_support(user_mod, game2, 10)
+	db.session.commit()
+
+	# Deletes mod1's support for game2, and adds game1 to both mods
+	assert game_support_update_all(db.session) == 3
+	db.session.commit()
+
+	assert get_game_support(mod) == {("game1", 1)}
+	assert get_game_support(user_mod) == {("game1", 1), ("game2", 10)}
+	assert get_game_support(game1) == set()
+
+	# Nothing has changed
+	assert game_support_update_all(db.session) == 0
+	db.session.commit()
+
+	assert get_game_support(mod) == {("game1", 1)}
+	assert get_game_support(user_mod) == {("game1", 1), ("game2", 10)}
@@ -0,0 +1,32 @@
+# ContentDB
+# SPDX-License-Identifier: AGPL-3.0-or-later
+# Copyright (C) 2018-2025 rubenwardy <rw@rubenwardy>
+
+from app import redis_client
+from app.default_data import populate_test_data
+from app.domain.metrics import update_aggregate_metrics, generate_metrics, generate_live_metrics
+from app.models import db, Package, PackageState
+from app.rediscache import METRICS_KEY
+from .utils import client # noqa
+
+
+def test_generate_metrics(client):
+	populate_test_data(db.session)
+	db.session.commit()
+
+	update_aggregate_metrics()
+
+	metrics = generate_metrics()
+	assert metrics.startswith(generate_live_metrics())
+	assert "\ncontentdb_metrics_updated " in metrics
+	assert "\ncontentdb_metrics_duration_seconds " in metrics
+
+	packages = Package.query.filter_by(state=PackageState.APPROVED).count()
+	assert f"\ncontentdb_packages {packages}\n" in metrics
+
+	# Aggregates are only shown once computed
+	redis_client.delete(METRICS_KEY)
+	metrics = generate_metrics()
+	assert metrics == generate_live_metrics()
+	assert "contentdb_metrics_updated" not in metrics
+	assert "contentdb_packages " not in metrics
@@ -0,0 +1,42 @@
+# ContentDB
+# SPDX-License-Identifier: AGPL-3.0-or-later
+# Copyright (C) 2018-2025 rubenwardy <rw@rubenwardy>
+
+from app.default_data import populate_test_data
+from app.domain.scores import recalculate_package_scores
+from app.models import db, Package, PackageReview, User
+from .utils import client # noqa
+
+
+def test_recalculate_package_scores(client):
+	populate_test_data(db.session)
+	db.session.commit()
+
+	author = User.query.first()
+	packages = Package.query.order_by(Package.id).all()
+	for i, package in enumerate(packages):
+		package.score_downloads = i * 10.5
+		for rating in range(1, (i % 5) + 2):
+			review = PackageReview()
+			review.package = package
+			review.author = author
+			review.rating = rating
+			review.approved = rating != 3
+			db.session.add(review)
+	db.session.commit()
+
+	for package in packages:
+		package.recalculate_score()
+	expected = { package.id: package.score for package in packages }
+
+	for package in packages:
+		package.score = 0
+	db.session.commit()
+
+	assert recalculate_package_scores([packages[0].id]) == 1
+	assert recalculate_package_scores() == len(packages) - 1
+	assert recalculate_package_scores() == 0
+	db.session.commit()
+
+	db.session.expire_all()
+	assert { package.id: package.score for package in Package.query.all() } == expected
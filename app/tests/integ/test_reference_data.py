@@ -0,0 +1,31 @@
+# ContentDB
+# SPDX-License-Identifier: AGPL-3.0-or-later
+# Copyright (C) 2018-2025 rubenwardy <rw@rubenwardy>
+
+from app.models import db, Tag, License
+from app.utils.reference_data import get_tag, get_license, get_reference_data
+from .utils import client # noqa
+
+
+def test_reference_data_is_attached(client):
+	tag = get_tag("mapgen")
+	assert tag is not None
+	assert tag in db.session
+	assert tag is Tag.query.filter_by(name="mapgen").one()
+
+	assert get_license("mit").name == "MIT"
+	assert get_tag("doesnotexist") is None
+
+
+def test_reference_data_reloaded_on_change(client):
+	data = get_reference_data()
+	assert get_reference_data() is data
+
+	tag = Tag.query.filter_by(name="mapgen").one()
+	tag.title = "Map Generation"
+	db.session.add(License("Unlicense"))
+	db.session.commit()
+
+	assert get_reference_data() is not data
+	assert get_tag("mapgen").title == "Map Generation"
+	assert get_license("unlicense") is not None
@@ -0,0 +1,99 @@
+# ContentDB
+# SPDX-License-Identifier: AGPL-3.0-or-later
+# Copyright (C) 2018-2025 rubenwardy <rw@rubenwardy>
+
+from app.default_data import populate_test_data
+from app.domain.review_counts import get_inconsistent_review_counts, repair_review_counts
+from app.models import db, Package, PackageReview, PackageReviewVote, User
+from .utils import client # noqa
+
+
+def make_review(package: Package, author: User, rating: int, approved: bool = True) -> PackageReview:
+	review = PackageReview()
+	review.package = package
+	review.author = author
+	review.rating = rating
+	review.approved = approved
+	db.session.add(review)
+	return review
+
+
+def test_review_counts_updated_on_commit(client):
+	populate_test_data(db.session)
+	db.session.commit()
+
+	users = User.query.order_by(User.id).limit(3).all()
+	package = Package.query.first()
+
+	positive = make_review(package, users[0], 5)
+	make_review(package, users[1], 3)
+	pending = make_review(package, users[2], 1, approved=False)
+	db.session.commit()
+
+	assert package.get_review_summary() == [1, 1, 0]
+
+	pending.approved = True
+	db.session.commit()
+	assert package.get_review_summary() == [1, 1, 1]
+
+	positive.rating = 1
+	db.session.commit()
+	assert package.get_review_summary() == [0, 1, 2]
+
+	db.session.delete(pending)
+	db.session.commit()
+	assert package.get_review_summary() == [0, 1, 1]
+
+	for user, is_positive in [(users[1], True), (users[2], False)]:
+		vote = PackageReviewVote()
+		vote.review = positive
+		vote.user = user
+		vote.is_positive = is_positive
+		db.session.add(vote)
+	db.session.commit()
+
+	assert positive.get_totals() == (1, 1, None)
+	assert positive.get_totals(users[1]) == (1, 1, True)
+	assert positive.score == 1
+
+	PackageReview.load_user_votes([positive], users[2])
+	assert positive.get_totals(users[2]) == (1, 1, False)
+	assert positive.get_totals(users[0]) == (1, 1, None)
+
+	PackageReviewVote.query.filter_by(review=positive, user=users[2]).delete()
+	db.session.commit()
+	assert positive.get_totals() == (1, 0, None)
+	assert positive.score == 4
+
+	assert get_inconsistent_review_counts(db.session) == ([], [])
+
+
+def test_repair_review_counts(client):
+	populate_test_data(db.session)
+	db.session.commit()
+
+	users = User.query.order_by(User.id).limit(2).all()
+	package = Package.query.first()
+	review = make_review(package, users[0], 5)
+	db.session.commit()
+
+	vote = PackageReviewVote()
+	vote.review = review
+	vote.user = users[1]
+	vote.is_positive = True
+	db.session.add(vote)
+	db.session.commit()
+
+	# Simulate changes made outside of the ORM
+	db.session.query(Package).filter_by(id=package.id).update({ "reviews_positive": 5 })
+	db.session.query(PackageReview).filter_by(id=review.id).update({ "votes_helpful": 0, "score": 1 })
+	db.session.commit()
+
+	assert get_inconsistent_review_counts(db.session) == ([package.id], [review.id])
+	assert repair_review_counts(db.session) == (1, 1)
+	db.session.commit()
+
+	assert get_inconsistent_review_counts(db.session) == ([], [])
+	assert package.get_review_summary() == [1, 0, 0]
+	assert review.get_totals() == (1, 0, None)
+	assert review.score == 4
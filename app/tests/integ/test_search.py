@@ -0,0 +1,107 @@
+# ContentDB
+# SPDX-License-Identifier: AGPL-3.0-or-later
+# Copyright (C) 2018-2025 rubenwardy <rw@rubenwardy>
+
+from sqlalchemy import func
+
+from app.default_data import populate_test_data
+from app.domain.search import search_packages, get_package_facets, update_search_index
+from app.models import db, Package, PackageState, PackageTranslation, PackageSearchDocument, Language, Tags, Tag
+from .utils import client # noqa
+
+
+def search(search_query: str, lang: str = "en"):
+	query = Package.query.filter(Package.state == PackageState.APPROVED)
+	return [package.name for package in search_packages(query, search_query, lang).all()]
+
+
+def test_search_finds_packages(client):
+	populate_test_data(db.session)
+	db.session.commit()
+
+	assert PackageSearchDocument.query.count() == Package.query.count()
+
+	assert {"food", "food_sweet"}.issubset(search("food"))
+	assert search("mesecon")[0] == "mesecons"
+	assert search("doesnotexist") == []
+
+
+def test_search_index_updated_on_commit(client):
+	populate_test_data(db.session)
+	db.session.commit()
+
+	package = Package.query.filter_by(name="awards").one()
+	package.title = "Achievements"
+	db.session.commit()
+	assert search("achievements")[0] == "awards"
+
+	tag = Tag.query.filter_by(name="pvp").one()
+	package.tags.append(tag)
+	db.session.commit()
+	assert "awards" in search("pvp")
+
+
+def test_search_translations(client):
+	populate_test_data(db.session)
+	if db.session.get(Language, "de") is None:
+		db.session.add(Language(id="de", title="Deutsch"))
+
+	package = Package.query.filter_by(name="awards").one()
+	translation = PackageTranslation()
+	translation.package = package
+	translation.language_id = "de"
+	translation.title = "Auszeichnungen"
+	translation.short_desc = "Fügt Erfolge hinzu"
+	db.session.add(translation)
+	db.session.commit()
+
+	assert search("auszeichnungen", "de") == ["awards"]
+	assert search("auszeichnungen", "en") == []
+
+	# English documents are searched in every language
+	assert search("awards", "de")[0] == "awards"
+
+	db.session.delete(translation)
+	db.session.commit()
+	assert search("auszeichnungen", "de") == []
+
+
+def test_rebuild_search_index(client):
+	populate_test_data(db.session)
+	db.session.commit()
+
+	PackageSearchDocument.query.delete()
+	db.session.commit()
+	assert search("mesecons") == []
+
+	assert update_search_index(db.session) == Package.query.count()
+	db.session.commit()
+	assert search("mesecons")[0] == "mesecons"
+
+
+def test_package_facets(client):
+	populate_test_data(db.session)
+	db.session.commit()
+
+	query = Package.query.filter(Package.state == PackageState.APPROVED)
+	facets = get_package_facets(query)
+
+	expected_tags = dict(db.session.query(Tags.c.tag_id, func.count())
+			.join(Package, Package.id == Tags.c.package_id)
+			.filter(Package.state == PackageState.APPROVED)
+			.group_by(Tags.c.tag_id).all())
+	assert facets["tags"] == expected_tags
+
+	expected_types = dict(db.session.query(Package.type, func.count())
+			.filter(Package.state == PackageState.APPROVED)
+			.group_by(Package.type).all())
+	assert facets["types"] == expected_types
+
+	expected_licenses = {}
+	for package in query.all():
+		for license_id in {package.license_id, package.media_license_id}:
+			expected_licenses[license_id] = expected_licenses.get(license_id, 0) + 1
+	assert facets["licenses"] == expected_licenses
+
+	facets = get_package_facets(search_packages(query, "food", sort=False))
+	assert sum(facets["types"].values()) == len(search("food"))
@@ -0,0 +1,58 @@
+# ContentDB
+# SPDX-License-Identifier: AGPL-3.0-or-later
+# Copyright (C) 2018-2025 rubenwardy <rw@rubenwardy>
+
+import datetime
+
+from app import redis_client
+from app.default_data import populate_test_data
+from app.domain import stats_buffer
+from app.domain.stats_buffer import notify_download, notify_unique_download, flush_buffered_stats
+from app.models import db, Package, PackageRelease, PackageDailyStats
+from app.rediscache import STATS_BUFFER_KEY, STATS_BUFFER_BATCH_PREFIX
+from .utils import client # noqa
+
+
+def test_flush_buffered_stats_applies_batch_once(client, monkeypatch):
+	for key in redis_client.scan_iter(match=STATS_BUFFER_BATCH_PREFIX + "*"):
+		redis_client.delete(key)
+	redis_client.delete(STATS_BUFFER_KEY)
+
+	populate_test_data(db.session)
+	db.session.commit()
+
+	release = PackageRelease.query.order_by(PackageRelease.id).first()
+	package = release.package
+	package_id = package.id
+	release_id = release.id
+	downloads = package.downloads
+	score_downloads = package.score_downloads
+	score = package.score
+	release_downloads = release.downloads
+
+	notify_download(package, True, True, "new")
+	notify_download(package, False, False, None)
+	notify_unique_download(package, release, 2.5)
+
+	# Simulate the worker stopping after writing the batch, but before removing it from Redis
+	monkeypatch.setattr(stats_buffer, "delete_buffered_stats", lambda batch_id: None)
+	assert flush_buffered_stats() > 0
+	monkeypatch.undo()
+
+	# The batch left behind is replayed, and skipped as it was already written
+	assert flush_buffered_stats() == 0
+	assert flush_buffered_stats() == 0
+
+	db.session.expire_all()
+
+	package = db.session.get(Package, package_id)
+	assert package.downloads == downloads + 1
+	assert package.score_downloads == score_downloads + 2.5
+	assert package.score == score + 2.5
+	assert db.session.get(PackageRelease, release_id).downloads == release_downloads + 1
+
+	daily = db.session.get(PackageDailyStats, (package_id, datetime.datetime.utcnow().date()))
+	assert daily.platform_minetest == 1
+	assert daily.platform_other == 1
+	assert daily.reason_new == 1
+	assert daily.downloads_v510 == 1
@@ -0,0 +1,156 @@
+# ContentDB
+# SPDX-License-Identifier: AGPL-3.0-or-later
+# Copyright (C) 2018-2025 rubenwardy <rw@rubenwardy>
+
+import datetime
+import hashlib
+import os
+
+import pytest
+
+from app import app
+from app.default_data import populate_test_data
+from app.domain.uploads import store_stream, delete_unused_uploads, recount_upload_references, UNUSED_UPLOAD_GRACE_PERIOD
+from app.models import db, Upload, Package, PackageRelease, ReleaseState
+from .utils import client # noqa
+
+
+@pytest.fixture
+def upload_dir(tmp_path, monkeypatch):
+	monkeypatch.setitem(app.config, "UPLOAD_DIR", str(tmp_path))
+	return tmp_path
+
+
+def add_release(package: Package, url: str) -> PackageRelease:
+	release = PackageRelease()
+	release.package = package
+	release.name = "test"
+	release.title = "test"
+	release.url = url
+	release.state = ReleaseState.APPROVED
+	release.created_at = datetime.datetime.utcnow()
+	db.session.add(release)
+	return release
+
+
+def make_old(filename: str):
+	db.session.query(Upload).filter_by(filename=filename).update({
+		"updated_at": datetime.datetime.utcnow() - UNUSED_UPLOAD_GRACE_PERIOD - datetime.timedelta(minutes=1),
+	})
+	db.session.commit()
+
+
+def test_store_deduplicates(client, upload_dir):
+	url1, path1 = store_stream([b"hello ", b"world"], "zip")
+	url2, path2 = store_stream([b"hello world"], "zip")
+
+	digest = hashlib.sha256(b"hello world").hexdigest()
+	assert url1 == url2 == f"/uploads/{digest}.zip"
+	assert path1 == path2
+	assert os.listdir(upload_dir) == [f"{digest}.zip"]
+
+	upload = db.session.get(Upload, f"{digest}.zip")
+	assert upload.digest == digest
+	assert upload.size == 11
+	assert upload.ref_count == 0
+
+
+def test_store_failure_removes_temp_file(client, upload_dir):
+	def chunks():
+		yield b"partial"
+		raise ValueError("Too large")
+
+	with pytest.raises(ValueError):
+		store_stream(chunks(), "png")
+
+	assert os.listdir(upload_dir) == []
+
+
+def test_ref_counts(client, upload_dir):
+	populate_test_data(db.session)
+	db.session.commit()
+
+	url, _ = store_stream([b"release"], "zip")
+	filename = url.split("/")[-1]
+	package = Package.query.filter_by(name="awards").one()
+
+	release1 = add_release(package, url)
+	release2 = add_release(package, url)
+	db.session.commit()
+	assert db.session.get(Upload, filename).ref_count == 2
+
+	db.session.delete(release1)
+	db.session.commit()
+	assert db.session.get(Upload, filename).ref_count == 1
+
+	release2.url = "https://example.com/release.zip"
+	db.session.commit()
+	assert db.session.get(Upload, filename).ref_count == 0
+
+	add_release(package, url)
+	db.session.rollback()
+	assert db.session.get(Upload, filename).ref_count == 0
+
+
+def test_delete_unused_uploads(client, upload_dir):
+	populate_test_data(db.session)
+	db.session.commit()
+
+	used_url, used_path = store_stream([b"used"], "zip")
+	unused_url, unused_path = store_stream([b"unused"], "zip")
+	recent_url, recent_path = store_stream([b"recent"], "zip")
+	add_release(Package.query.filter_by(name="awards").one(), used_url)
+	db.session.commit()
+
+	for url in [used_url, unused_url]:
+		make_old(url.split("/")[-1])
+
+	# Counts are checked before deleting
+	db.session.query(Upload).filter_by(filename=used_url.split("/")[-1]).update({ "ref_count": 0 })
+	db.session.commit()
+
+	untracked_path = upload_dir / "untracked.png"
+	untracked_path.write_bytes(b"untracked")
+	old = (datetime.datetime.now() - UNUSED_UPLOAD_GRACE_PERIOD - datetime.timedelta(minutes=1)).timestamp()
+	os.utime(untracked_path, (old, old))
+
+	assert delete_unused_uploads(db.session) == (1, len(b"unused"))
+	assert os.path.isfile(used_path)
+	assert not os.path.isfile(unused_path)
+	assert os.path.isfile(recent_path)
+	assert os.path.isfile(untracked_path)
+	assert db.session.get(Upload, used_url.split("/")[-1]).ref_count == 1
+	assert db.session.get(Upload, unused_url.split("/")[-1]) is None
+
+	assert delete_unused_uploads(db.session, include_untracked=True) == (1, len(b"untracked"))
+	assert not os.path.isfile(untracked_path)
+	assert os.path.isfile(recent_path)
+
+
+def test_recount_upload_references(client, upload_dir):
+	populate_test_data(db.session)
+	db.session.commit()
+
+	used_url, used_path = store_stream([b"used"], "zip")
+	removed_url, removed_path = store_stream([b"removed"], "zip")
+	package = Package.query.filter_by(name="awards").one()
+	add_release(package, used_url)
+	add_release(package, removed_url)
+	db.session.commit()
+
+	# Deleted outside of the ORM, so the count isn't decremented
+	PackageRelease.query.filter_by(url=removed_url).delete()
+	db.session.commit()
+	removed_filename = removed_url.split("/")[-1]
+	assert db.session.get(Upload, removed_filename).ref_count == 1
+
+	assert recount_upload_references(db.session) == 1
+	assert recount_upload_references(db.session) == 0
+	assert db.session.get(Upload, removed_filename).ref_count == 0
+	assert db.session.get(Upload, used_url.split("/")[-1]).ref_count == 1
+
+	make_old(removed_filename)
+	assert delete_unused_uploads(db.session) == (1, len(b"removed"))
+	assert not os.path.isfile(removed_path)
+	assert os.path.isfile(used_path)
+
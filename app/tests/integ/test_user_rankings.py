@@ -0,0 +1,45 @@
+# ContentDB
+# SPDX-License-Identifier: AGPL-3.0-or-later
+# Copyright (C) 2018-2025 rubenwardy <rw@rubenwardy>
+
+from app import redis_client
+from app.default_data import populate_test_data
+from app.domain.user_rankings import compute_user_rankings, update_user_rankings, get_ranking_for_user
+from app.models import db, Package, PackageReview, PackageState, User
+from app.rediscache import USER_RANKINGS_KEY
+from .utils import client # noqa
+
+
+def test_compute_user_rankings(client):
+	populate_test_data(db.session)
+	db.session.commit()
+
+	users = User.query.order_by(User.id).limit(3).all()
+	packages = Package.query.filter_by(state=PackageState.APPROVED).order_by(Package.id).all()
+	for i, user in enumerate(users):
+		for package in packages[:i + 1]:
+			review = PackageReview()
+			review.package = package
+			review.author = user
+			review.rating = 5
+			review.score = 1 + i
+			db.session.add(review)
+	db.session.commit()
+
+	meta, rankings = compute_user_rankings()
+	assert meta["reviewers"] == 3
+	assert rankings[users[2].id]["review_place"] == 0
+	assert rankings[users[1].id]["review_place"] == 1
+	assert rankings[users[0].id]["review_place"] == 2
+
+	for author in set([package.author for package in packages]):
+		expected = sum([package.downloads for package in packages if package.author == author])
+		assert rankings[author.id]["downloads"] == expected
+
+	redis_client.delete(USER_RANKINGS_KEY)
+	assert get_ranking_for_user(users[2]) is None
+
+	update_user_rankings()
+	stored_meta, ranking = get_ranking_for_user(users[2])
+	assert stored_meta["reviewers"] == 3
+	assert ranking == rankings[users[2].id]
@@ -49,6 +49,7 @@ def client():
 	with app.app_context():
 		app.config["TESTING"] = True
 		app.config['WTF_CSRF_ENABLED'] = False
+		app.config["QUERY_BUDGET_ASSERT"] = True
 
 		recreate_db()
 		assert User.query.count() == 2
@@ -58,6 +59,7 @@ def client():
 
 		app.config["TESTING"] = False
 		app.config['WTF_CSRF_ENABLED'] = True
+		app.config["QUERY_BUDGET_ASSERT"] = False
 
 
 def validate_package_list(packages, strict=False):
@@ -0,0 +1,99 @@
+# ContentDB
+# SPDX-License-Identifier: AGPL-3.0-or-later
+# Copyright (C) 2018-2025 rubenwardy <rw@rubenwardy>
+
+import smtplib
+
+import pytest
+from flask_mail import Message
+
+from app.models import User, Notification, NotificationType, UserNotificationPreferences
+from app.tasks.emails import deliver_emails, _select_notifications
+
+
+class StandInConnection:
+	"""
+	Stands in for an SMTP connection, rejecting messages to some recipients
+	"""
+
+	def __init__(self, rejected=None):
+		self.rejected = set(rejected or [])
+		self.sent = []
+
+	def send(self, msg: Message):
+		if msg.recipients[0] in self.rejected:
+			raise smtplib.SMTPDataError(554, b"Message rejected under suspicion of SPAM")
+
+		self.sent.append(msg)
+
+
+def make_message(email: str) -> Message:
+	return Message("Subject", recipients=[email], sender="contentdb@example.com", body="Body")
+
+
+def test_deliver_emails():
+	connection = StandInConnection()
+	messages = [make_message(f"user{i}@example.com") for i in range(5)]
+
+	assert deliver_emails(messages, connection) == (5, [])
+	assert connection.sent == messages
+
+
+def test_deliver_emails_continues_after_rejection():
+	connection = StandInConnection(rejected=["user1@example.com"])
+	messages = [make_message(f"user{i}@example.com") for i in range(3)]
+
+	done = []
+	sent, errors = deliver_emails(messages, connection, done.append)
+	assert done == [0, 1, 2]
+	assert sent == 2
+	assert len(errors) == 1
+	assert isinstance(errors[0], smtplib.SMTPDataError)
+	assert [msg.recipients[0] for msg in connection.sent] == ["user0@example.com", "user2@example.com"]
+
+
+def test_deliver_emails_stops_on_disconnect():
+	class DisconnectingConnection(StandInConnection):
+		def send(self, msg: Message):
+			if len(self.sent) == 1:
+				raise smtplib.SMTPServerDisconnected()
+
+			super().send(msg)
+
+	connection = DisconnectingConnection()
+	messages = [make_message(f"user{i}@example.com") for i in range(3)]
+
+	done = []
+	with pytest.raises(smtplib.SMTPServerDisconnected):
+		deliver_emails(messages, connection, done.append)
+
+	# Only the sent message's notifications would be marked as emailed
+	assert done == [0]
+
+
+def make_notifications():
+	user = User("user", email="user@example.com")
+	prefs = UserNotificationPreferences(user)
+	user.notification_preferences = prefs
+	prefs.pref_thread_reply = 2
+	prefs.pref_new_review = 1
+	prefs.pref_other = 0
+
+	causer = User("causer")
+	reply = Notification(user, causer, NotificationType.THREAD_REPLY, "Reply", "/threads/1/")
+	review = Notification(user, causer, NotificationType.NEW_REVIEW, "Review", "/threads/2/")
+	other = Notification(user, causer, NotificationType.OTHER, "Other", "/threads/3/")
+	return reply, review, other
+
+
+def test_select_notifications():
+	reply, review, other = make_notifications()
+	notifications = [reply, review, other]
+
+	to_send, to_mark = _select_notifications(notifications, False)
+	assert to_send == [reply]
+	assert to_mark == [reply, other]
+
+	to_send, to_mark = _select_notifications(notifications, True)
+	assert to_send == [reply, review]
+	assert to_mark == [reply, review]
@@ -539,3 +539,72 @@ def test_ignores_mtg_in_violating_games():
 	assert not support.has_errors
 	assert modA.detected_supported_games == {"minetest_game"}
 	assert modB.detected_supported_games == {"tutorial"}
+
+
+def test_update_changed_provides_in_place():
+	support = GameSupport()
+	support.add(make_game("game1", ["default"]))
+	support.add(make_game("game2", ["core"]))
+	lib = support.add(make_mod("lib", ["lib"], ["default"]))
+	modA = support.add(make_mod("mod_a", ["mod_a"], ["lib"]))
+	support.on_first_run()
+
+	assert modA.detected_supported_games == {"game1"}
+
+	lib.provides = {"lib2"}
+	lib.depends = {"core"}
+	lib.is_confirmed = False
+	support.on_update(lib, {"lib"})
+
+	assert support.get_all_that_provide("lib") == []
+	assert support.get_all_that_provide("lib2") == [lib]
+	assert support.get_all_that_depend_on("core") == [lib]
+	assert lib.detected_supported_games == {"game2"}
+	assert not modA.is_confirmed
+	assert len(modA.errors) == 1
+
+
+def test_copy():
+	modA = make_mod("mod_a", ["mod_a"], ["default"])
+	modA.user_supported_games.add("game1")
+
+	copy = modA.copy()
+	copy.provides.add("mod_b")
+	copy.depends.add("lib")
+	copy.user_supported_games.add("game2")
+
+	assert copy.id_ == modA.id_
+	assert not copy.is_confirmed
+	assert modA.provides == {"mod_a"}
+	assert modA.depends == {"default"}
+	assert modA.user_supported_games == {"game1"}
+
+
+def test_fork():
+	base = GameSupport()
+	base.add(make_game("game1", ["default"]))
+	base.add(make_game("game2", ["core"]))
+	lib = base.add(make_mod("lib", ["lib"], ["default"]))
+	modA = base.add(make_mod("mod_a", ["mod_a"], ["lib"]))
+
+	fork = base.fork()
+	fork.on_first_run()
+	assert fork.all_confirmed
+	assert fork.get(modA.id_).detected_supported_games == {"game1"}
+	assert fork.modified_packages == {fork.get(lib.id_), fork.get(modA.id_)}
+
+	# Resolving the fork doesn't change the shared packages
+	assert not lib.is_confirmed and not modA.is_confirmed
+	assert len(modA.detected_supported_games) == 0
+
+	# Changes to either instance aren't seen by the other
+	fork2 = base.fork()
+	fork2.add(make_mod("lib", ["lib"], ["core"]))
+	fork2.on_update(fork2.get(lib.id_), {"lib"})
+	assert fork2.get(modA.id_).detected_supported_games == {"game2"}
+	assert base.get_all_that_depend_on("core") == []
+	assert base.get(lib.id_) is lib
+
+	base.discard(modA.id_)
+	assert fork2.get_all_that_depend_on("lib") == [fork2.get(modA.id_)]
+	assert base.get_all_that_depend_on("lib") == []
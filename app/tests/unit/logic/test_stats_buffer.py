@@ -0,0 +1,50 @@
+# ContentDB
+# SPDX-License-Identifier: AGPL-3.0-or-later
+# Copyright (C) 2018-2025 rubenwardy <rw@rubenwardy>
+
+import datetime
+
+import pytest
+
+from app.domain.stats_buffer import BufferedStats
+
+
+def test_parse_daily_stats():
+	stats = BufferedStats({
+		"daily/3/2026-10-18/platform_minetest": "4",
+		"daily/3/2026-10-18/reason_new": "1",
+		"daily/3/2026-10-19/views_luanti": "2",
+		"daily/5/2026-10-18/platform_other": "1",
+	})
+
+	assert len(stats.daily) == 3
+
+	row = stats.daily[(3, datetime.date(2026, 10, 18))]
+	assert row["platform_minetest"] == 4
+	assert row["reason_new"] == 1
+	assert row["platform_other"] == 0
+	assert row["views_luanti"] == 0
+
+	assert stats.daily[(3, datetime.date(2026, 10, 19))]["views_luanti"] == 2
+	assert stats.daily[(5, datetime.date(2026, 10, 18))]["platform_other"] == 1
+	assert stats.package_ids == {3, 5}
+
+
+def test_parse_downloads():
+	stats = BufferedStats({
+		"package/3/downloads": "2",
+		"package/3/score": "1.5",
+		"package/4/score": "0",
+		"release/9/downloads": "2",
+	})
+
+	assert stats.package_downloads == {3: 2}
+	assert stats.package_score == {3: 1.5, 4: 0.0}
+	assert stats.release_downloads == {9: 2}
+	assert stats.package_ids == {3, 4}
+	assert len(stats.daily) == 0
+
+
+def test_parse_unknown_field():
+	with pytest.raises(ValueError):
+		BufferedStats({ "daily/3/2026-10-18/unknown": "1" })
@@ -0,0 +1,84 @@
+# ContentDB
+# SPDX-License-Identifier: AGPL-3.0-or-later
+# Copyright (C) 2018-2025 rubenwardy <rw@rubenwardy>
+
+import os
+from zipfile import ZipFile
+
+import pytest
+
+from app.tasks.luanticheck import build_tree, ContentType, ZipFileSystem, LuantiCheckError
+from app.tasks.importtasks import _check_zip_file
+
+
+def make_modpack_zip(path):
+	with ZipFile(path, "w") as zf:
+		zf.writestr("mypack/modpack.conf", "name = mypack\ndescription = A modpack\n")
+		zf.writestr("mypack/LICENSE.txt", "MIT")
+		zf.writestr("mypack/README.md", "Hello")
+		zf.writestr("mypack/.cdb.json", "{}")
+		zf.writestr("mypack/mod_a/init.lua", "")
+		zf.writestr("mypack/mod_a/mod.conf", "name = mod_a\ndepends = default\noptional_depends = mod_b\n")
+		zf.writestr("mypack/mod_a/locale/mod_a.fr.tr", "# textdomain: mod_a\r\nHello=Bonjour\r\n")
+		zf.writestr("mypack/mod_a/.git/locale/mod_a.de.tr", "# textdomain: mod_a\nHello=Hallo\n")
+		zf.writestr("mypack/mod_b/init.lua", "")
+		zf.writestr("mypack/mod_b/depends.txt", "mod_a\nfarming?\n")
+
+
+def test_build_tree_from_zip(tmp_path):
+	path = tmp_path / "release.zip"
+	make_modpack_zip(path)
+
+	extracted = tmp_path / "extracted"
+	with ZipFile(path, "r") as zf:
+		zf.extractall(extracted)
+
+		for tree in [build_tree("/", fs=ZipFileSystem(zf)), build_tree(str(extracted))]:
+			assert tree.type == ContentType.MODPACK
+			assert tree.name == "mypack"
+			assert tree.get("description") == "A modpack"
+			assert tree.get_mod_names() == {"mod_a", "mod_b"}
+			assert tree.fold("meta", "depends") == {"default", "mod_a"}
+			assert tree.fold("meta", "optional_depends") == {"mod_b", "farming"}
+			assert os.path.basename(tree.find_license_file()) == "LICENSE.txt"
+			assert os.path.basename(tree.get_readme_path()) == "README.md"
+			assert tree.read_text(".cdb.json") == "{}"
+			assert tree.get_supported_languages() == {"fr"}
+
+			translations = tree.get_translations("mod_a", {"fr", "de"})
+			assert len(translations) == 1
+			assert translations[0].entries == {"Hello": "Bonjour"}
+
+			with pytest.raises(LuantiCheckError):
+				tree.check_for_legacy_files()
+
+			with pytest.raises(IOError):
+				tree.read_text("missing.txt")
+
+
+def test_build_tree_from_zip_checks_type(tmp_path):
+	path = tmp_path / "release.zip"
+	make_modpack_zip(path)
+
+	with ZipFile(path, "r") as zf:
+		with pytest.raises(LuantiCheckError):
+			build_tree("/", expected_type=ContentType.GAME, fs=ZipFileSystem(zf))
+
+
+@pytest.mark.parametrize("filename,safe", [
+	("mypack/mod_a/init.lua", True),
+	("mypack/../mypack/init.lua", True),
+	("../init.lua", False),
+	("mypack/../../init.lua", False),
+	("/etc/passwd", False),
+	("..\\init.lua", False),
+	("mypack/init\n.lua", False),
+])
+def test_check_zip_file(tmp_path, filename, safe):
+	path = tmp_path / "release.zip"
+	with ZipFile(path, "w") as zf:
+		zf.writestr("mypack/modpack.conf", "name = mypack\n")
+		zf.writestr(filename, "")
+
+	with ZipFile(path, "r") as zf:
+		assert _check_zip_file(zf) == safe
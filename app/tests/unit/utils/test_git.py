@@ -4,9 +4,12 @@
 
 import os
 import pytest
+import git
 
+from app import app
 from app.tasks import TaskError
-from app.utils.git import get_latest_tag, get_latest_commit, clone_repo, get_commit_list
+from app.utils.git import get_latest_tag, get_latest_commit, clone_repo, get_commit_list, checkout_worktree, \
+	evict_mirrors, get_cache_dir, get_mirror_key
 
 test_repo = "https://codeberg.org/rubenwardy/testmod"
 test_private_repo = "https://github.com/luanti-org/discussions"
@@ -86,3 +89,113 @@ def test_git_clone_private_repo():
 	with pytest.raises(TaskError):
 		with clone_repo(test_private_repo, recursive=True) as repo:
 			assert False
+
+
+@pytest.fixture
+def local_repo(tmp_path, monkeypatch):
+	monkeypatch.setitem(app.config, "GIT_CACHE_DIR", str(tmp_path / "cache"))
+
+	path = tmp_path / "source"
+	repo = git.Repo.init(path, initial_branch="master")
+	with repo.config_writer() as config:
+		config.set_value("user", "name", "Test")
+		config.set_value("user", "email", "test@example.com")
+
+	def commit(filename: str, message: str) -> str:
+		(path / filename).write_text(message)
+		repo.index.add([filename])
+		return repo.index.commit(message).hexsha
+
+	commit("init.lua", "First")
+	repo.create_tag("v1", message="Version 1")
+	return repo, f"file://{path}", commit
+
+
+def test_mirror_fetches_new_commits(local_repo):
+	repo, url, commit = local_repo
+
+	tag, commit_hash, message = get_latest_tag(url)
+	assert tag == "v1"
+	assert commit_hash == repo.head.commit.hexsha
+	assert message == "Version 1"
+
+	first = repo.head.commit.hexsha
+	commit("a.txt", "Second")
+	second = commit("b.txt", "Third")
+	repo.create_tag("v2")
+
+	assert get_latest_tag(url) == ("v2", second, None)
+	assert get_commit_list(url, first, second) == ["Second", "Third"]
+	assert len(os.listdir(get_cache_dir())) == 2
+
+
+def test_mirror_follows_url_change(local_repo):
+	repo, url, commit = local_repo
+	assert get_latest_tag(url)[0] == "v1"
+
+	# The same mirror, but the old URL no longer works
+	new_path = repo.working_tree_dir + ".git"
+	os.rename(repo.working_tree_dir, new_path)
+	new_url = f"file://{new_path}"
+	assert get_mirror_key(new_url) == get_mirror_key(url)
+
+	repo = git.Repo(new_path)
+	repo.create_tag("v2")
+	assert get_latest_tag(new_url)[0] == "v2"
+	assert len(os.listdir(get_cache_dir())) == 2
+
+
+def test_checkout_worktree(local_repo):
+	repo, url, commit = local_repo
+
+	first = repo.head.commit.hexsha
+	repo.create_head("test-branch").checkout()
+	branch_head = commit("test-branch.txt", "Branch")
+	repo.heads.master.checkout()
+	master_head = commit("master.txt", "Master")
+
+	with checkout_worktree(url) as checkout:
+		assert checkout.head.commit.hexsha == master_head
+		assert os.path.isfile(os.path.join(checkout.working_tree_dir, "master.txt"))
+		worktree_path = checkout.working_tree_dir
+
+	assert not os.path.exists(worktree_path)
+
+	with checkout_worktree(url, "test-branch") as checkout:
+		assert checkout.head.commit.hexsha == branch_head
+		assert os.path.isfile(os.path.join(checkout.working_tree_dir, "test-branch.txt"))
+		assert not os.path.isfile(os.path.join(checkout.working_tree_dir, "master.txt"))
+
+	with checkout_worktree(url, "v1") as checkout:
+		assert checkout.head.commit.hexsha == first
+
+	with pytest.raises(TaskError):
+		with checkout_worktree(url, "not-a-ref"):
+			assert False
+
+
+def test_evict_mirrors(local_repo, tmp_path):
+	_, url, _ = local_repo
+
+	other = git.Repo.init(tmp_path / "other", initial_branch="master")
+	(tmp_path / "other" / "init.lua").write_text("Other")
+	other.index.add(["init.lua"])
+	other.index.commit("Other", author=git.Actor("Test", "test@example.com"),
+			committer=git.Actor("Test", "test@example.com"))
+	other_url = f"file://{tmp_path / 'other'}"
+
+	get_latest_tag(url)
+	with checkout_worktree(other_url):
+		# Mirrors with a checkout aren't evicted
+		evict_mirrors(0)
+		assert len([x for x in os.listdir(get_cache_dir()) if not x.endswith(".lock")]) == 1
+
+	evict_mirrors(0)
+	assert len([x for x in os.listdir(get_cache_dir()) if not x.endswith(".lock")]) == 0
+
+
+def test_get_mirror_key():
+	key = get_mirror_key("https://codeberg.org/rubenwardy/testmod")
+	assert get_mirror_key("http://codeberg.org/rubenwardy/testmod") == key
+	assert get_mirror_key("https://Codeberg.org/rubenwardy/testmod.git/") == key
+	assert get_mirror_key("codeberg.org/rubenwardy/testmod") != get_mirror_key("https://codeberg.org/rubenwardy/TestMod")
@@ -0,0 +1,134 @@
+# ContentDB
+# SPDX-License-Identifier: AGPL-3.0-or-later
+# Copyright (C) 2018-2025 rubenwardy <rw@rubenwardy>
+
+import threading
+from collections import Counter
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+import pytest
+
+from app.utils.link_checker import LinkChecker
+
+
+class Handler(BaseHTTPRequestHandler):
+	requests = Counter()
+
+	def respond(self, method: str):
+		Handler.requests[(method, self.path)] += 1
+
+		if self.path == "/ok":
+			status = 200
+		elif self.path == "/forbidden":
+			status = 403
+		elif self.path == "/no-head":
+			status = 405 if method == "HEAD" else 200
+		elif self.path == "/redirect":
+			self.send_response(302)
+			self.send_header("Location", "/ok")
+			self.send_header("Content-Length", "0")
+			self.end_headers()
+			return
+		else:
+			status = 404
+
+		self.send_response(status)
+		self.send_header("Content-Length", "0")
+		self.end_headers()
+
+	def do_HEAD(self):
+		self.respond("HEAD")
+
+	def do_GET(self):
+		self.respond("GET")
+
+	def log_message(self, format, *args):
+		pass
+
+
+@pytest.fixture
+def server():
+	Handler.requests.clear()
+	httpd = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+	thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+	thread.start()
+	yield f"http://127.0.0.1:{httpd.server_address[1]}"
+	httpd.shutdown()
+	httpd.server_close()
+
+
+def make_checker(**kwargs) -> LinkChecker:
+	return LinkChecker(host_delay=(0, 0), timeout=5, **kwargs)
+
+
+def test_check_urls(server):
+	results = make_checker().check_urls([
+		f"{server}/ok",
+		f"{server}/forbidden",
+		f"{server}/no-head",
+		f"{server}/redirect",
+		f"{server}/missing",
+	])
+
+	assert results == {
+		f"{server}/ok": "",
+		f"{server}/forbidden": "",
+		f"{server}/no-head": "",
+		f"{server}/redirect": "",
+		f"{server}/missing": "404",
+	}
+
+	# HEAD first, only falling back to GET on failure
+	assert Handler.requests[("GET", "/ok")] == 0
+	assert Handler.requests[("GET", "/no-head")] == 1
+	assert Handler.requests[("GET", "/missing")] == 1
+
+
+def test_check_urls_deduplicates(server):
+	results = make_checker(per_host=2).check_urls([f"{server}/ok"] * 5 + [f"{server}/missing"] * 3)
+
+	assert len(results) == 2
+	assert Handler.requests[("HEAD", "/ok")] == 1
+	assert Handler.requests[("HEAD", "/missing")] == 1
+
+
+def test_check_urls_uses_cache(server):
+	cache = { f"{server}/missing": "" }
+	checker = make_checker(get_cached=lambda urls: { x: cache[x] for x in urls if x in cache },
+			set_cached=cache.update)
+
+	assert checker.check_urls([f"{server}/missing", f"{server}/ok"]) == {
+		f"{server}/missing": "",
+		f"{server}/ok": "",
+	}
+	assert Handler.requests[("HEAD", "/missing")] == 0
+	assert cache[f"{server}/ok"] == ""
+
+	checker.check_urls([f"{server}/ok"])
+	assert Handler.requests[("HEAD", "/ok")] == 1
+
+
+def test_check_urls_connection_error():
+	results = make_checker().check_urls(["http://127.0.0.1:1/"])
+	assert results == { "http://127.0.0.1:1/": "ConnectionError" }
+
+
+def test_check_urls_progress(server):
+	progress = []
+	make_checker(per_host=2).check_urls([f"{server}/ok", f"{server}/missing", f"{server}/no-head"],
+			lambda current, total: progress.append((current, total)))
+
+	assert progress[-1] == (3, 3)
+
+
+def test_check_urls_caches_each_result(server):
+	cached = []
+	progress = []
+	checker = make_checker(per_host=1, set_cached=lambda results: cached.append(results))
+	checker.check_urls([f"{server}/ok", f"{server}/missing", f"{server}/no-head"],
+			lambda current, total: progress.append((current, total)))
+
+	# One host, so URLs are checked one at a time and each result is reported when it arrives
+	assert len(cached) == 3
+	assert all(len(x) == 1 for x in cached)
+	assert progress == [(1, 3), (2, 3), (3, 3)]
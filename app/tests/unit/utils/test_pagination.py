@@ -0,0 +1,92 @@
+# ContentDB
+# SPDX-License-Identifier: AGPL-3.0-or-later
+# Copyright (C) 2018-2025 rubenwardy <rw@rubenwardy>
+
+import datetime
+
+import pytest
+from sqlalchemy import create_engine, Column, Integer
+from sqlalchemy.orm import DeclarativeBase, Session
+
+from app.models import Package
+from app.utils.pagination import encode_cursor, decode_cursor, paginate_by_cursor
+
+
+def test_cursor_round_trip():
+	keys = [Package.created_at, Package.id]
+	created_at = datetime.datetime(2024, 5, 1, 12, 30, 15, 123456)
+
+	cursor = encode_cursor("created_at/desc", [created_at, 42])
+	assert "=" not in cursor
+	assert decode_cursor(cursor, "created_at/desc", keys) == [created_at, 42]
+
+	cursor = encode_cursor("score/desc", [12.5, 7])
+	assert decode_cursor(cursor, "score/desc", [Package.score, Package.id]) == [12.5, 7]
+
+
+def test_cursor_for_different_sort():
+	cursor = encode_cursor("score/desc", [12.5, 7])
+
+	with pytest.raises(ValueError):
+		decode_cursor(cursor, "score/asc", [Package.score, Package.id])
+
+	with pytest.raises(ValueError):
+		decode_cursor(cursor, "score/desc", [Package.id])
+
+
+def test_invalid_cursor():
+	keys = [Package.created_at, Package.id]
+
+	for cursor in ["abc", "!!!", encode_cursor("created_at/desc", [1, 2]),
+			encode_cursor("created_at/desc", ["not a date", 2]),
+			encode_cursor("created_at/desc", ["2024-05-01T12:30:15", None]),
+			encode_cursor("created_at/desc", ["2024-05-01T12:30:15", [1]])]:
+		with pytest.raises(ValueError):
+			decode_cursor(cursor, "created_at/desc", keys)
+
+
+class Base(DeclarativeBase):
+	pass
+
+
+class Item(Base):
+	__tablename__ = "item"
+	id = Column(Integer, primary_key=True)
+	score = Column(Integer, nullable=False)
+
+
+@pytest.fixture
+def session():
+	engine = create_engine("sqlite://")
+	Base.metadata.create_all(engine)
+	with Session(engine) as session:
+		session.add_all([Item(id=i, score=i % 3) for i in range(1, 8)])
+		session.commit()
+		yield session
+
+
+def test_paginate_by_cursor(session):
+	keys = [Item.score, Item.id]
+	pages = []
+	cursor = None
+	while True:
+		page = paginate_by_cursor(session.query(Item), "score/desc", keys, True, cursor, 3)
+		assert page.total == 7
+		pages.append([item.id for item in page.items])
+		if not page.has_next:
+			break
+		cursor = page.next_cursor
+
+	assert pages == [[5, 2, 7], [4, 1, 6], [3]]
+
+
+def test_paginate_by_cursor_ignores_limit(session):
+	keys = [Item.id]
+	query = session.query(Item).order_by(Item.score).limit(2)
+
+	page = paginate_by_cursor(query, "id/asc", keys, False, None, 3)
+	assert [item.id for item in page.items] == [1, 2, 3]
+
+	page = paginate_by_cursor(query, "id/asc", keys, False, page.next_cursor, 3)
+	assert [item.id for item in page.items] == [4, 5, 6]
+	assert page.total == 7
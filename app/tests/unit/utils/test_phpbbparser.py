@@ -0,0 +1,136 @@
+# ContentDB
+# SPDX-License-Identifier: AGPL-3.0-or-later
+# Copyright (C) 2018-2025 rubenwardy <rw@rubenwardy>
+
+import os
+import threading
+from collections import Counter
+from datetime import datetime
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qs
+
+import pytest
+import requests
+
+from app.utils.phpbbparser import parse_forum_list_html, ForumTopicFetcher, TOPICS_PER_PAGE
+
+
+FIXTURES_DIR = os.path.join(os.path.dirname(__file__), "phpbb")
+
+
+def read_fixture(name: str) -> bytes:
+	with open(os.path.join(FIXTURES_DIR, name), "rb") as f:
+		return f.read()
+
+
+class Handler(BaseHTTPRequestHandler):
+	requests = Counter()
+	not_modified = Counter()
+
+	def do_GET(self):
+		url = urlparse(self.path)
+		query = parse_qs(url.query)
+		forum_id = int(query["f"][0])
+		page = int(query["start"][0]) // TOPICS_PER_PAGE
+		Handler.requests[(forum_id, page)] += 1
+
+		if forum_id != 11:
+			self.send_response(404)
+			self.send_header("Content-Length", "0")
+			self.end_headers()
+			return
+
+		# Like phpBB, pages after the end show the last page. Only the last page has an ETag
+		if page == 0:
+			body = read_fixture("viewforum_1.html")
+			etag = None
+		else:
+			body = read_fixture("viewforum_2.html")
+			etag = "\"page2\""
+
+		if etag and self.headers.get("If-None-Match") == etag:
+			Handler.not_modified[page] += 1
+			self.send_response(304)
+			self.send_header("ETag", etag)
+			self.end_headers()
+			return
+
+		self.send_response(200)
+		self.send_header("Content-Type", "text/html; charset=UTF-8")
+		self.send_header("Content-Length", str(len(body)))
+		if etag:
+			self.send_header("ETag", etag)
+		self.end_headers()
+		self.wfile.write(body)
+
+	def log_message(self, format, *args):
+		pass
+
+
+@pytest.fixture
+def server():
+	Handler.requests.clear()
+	Handler.not_modified.clear()
+	httpd = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+	thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+	thread.start()
+	yield f"http://127.0.0.1:{httpd.server_address[1]}"
+	httpd.shutdown()
+	httpd.server_close()
+
+
+def test_parse_forum_list_html():
+	assert parse_forum_list_html(read_fixture("viewforum_1.html")) == [
+		{
+			"id": "123",
+			"title": "[Mod] Awards [awards]",
+			"author": "rubenwardy",
+			"posts": "120 ",
+			"views": "34567 ",
+			"date": datetime(2016, 2, 10, 18, 35),
+		},
+		{
+			"id": "456",
+			"title": "[Mod] Fancy Café [1.2] [fancy_cafe]",
+			"author": "Zoë",
+			"posts": "7 ",
+			"views": "890 ",
+			"date": datetime(2022, 3, 3, 9, 5),
+		},
+	]
+
+
+def test_get_topics(server):
+	fetcher = ForumTopicFetcher(base_url=server, pages_per_wave=2)
+	topics = fetcher.get_topics([(11, { "wip": False })])
+
+	assert sorted(topics.keys()) == ["123", "456", "789"]
+	assert topics["789"]["title"] == "[Mod] Food [food]"
+	assert topics["789"]["wip"] is False
+
+	# Stops after the first wave that reaches the end
+	assert set(Handler.requests.keys()) == {(11, 0), (11, 1), (11, 2), (11, 3)}
+
+
+def test_get_topics_error(server):
+	with pytest.raises(requests.HTTPError):
+		ForumTopicFetcher(base_url=server).get_topics([(4, None)])
+
+
+def test_get_topics_uses_cache(server):
+	cache = {}
+	fetcher = ForumTopicFetcher(base_url=server, pages_per_wave=2,
+			get_cached=lambda urls: { x: cache[x] for x in urls if x in cache }, set_cached=cache.update)
+	topics = fetcher.get_topics([(11, None)])
+	assert fetcher.pages_unchanged == 0
+	assert len(cache) == 4
+
+	fetcher = ForumTopicFetcher(base_url=server, pages_per_wave=2,
+			get_cached=lambda urls: { x: cache[x] for x in urls if x in cache }, set_cached=cache.update)
+	assert fetcher.get_topics([(11, None)]) == topics
+	assert fetcher.pages_fetched == 4
+	assert fetcher.pages_unchanged == 4
+
+	# Conditional requests for pages with an ETag
+	assert Handler.not_modified[0] == 0
+	assert Handler.not_modified[1] == 1
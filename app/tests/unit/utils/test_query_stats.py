@@ -0,0 +1,96 @@
+# ContentDB
+# SPDX-License-Identifier: AGPL-3.0-or-later
+# Copyright (C) 2018-2025 rubenwardy <rw@rubenwardy>
+
+import pytest
+from flask import Flask
+from sqlalchemy import create_engine, text
+
+from app.utils import query_stats
+from app.utils.query_stats import start_collecting, stop_collecting, get_statement_shape, query_budget, timed, \
+	QueryBudgetExceeded, REPEATED_QUERY_THRESHOLD
+
+
+@pytest.fixture
+def engine():
+	engine = create_engine("sqlite://")
+	with engine.begin() as conn:
+		conn.execute(text("CREATE TABLE item (id INTEGER PRIMARY KEY)"))
+		conn.execute(text("INSERT INTO item (id) VALUES (1), (2), (3)"))
+	return engine
+
+
+def test_statement_shape():
+	assert get_statement_shape("SELECT * FROM item\n WHERE id IN (%(id_1_1)s, %(id_1_2)s)") == \
+		"SELECT * FROM item WHERE id IN (...)"
+	assert get_statement_shape("SELECT * FROM item WHERE id IN (%(id_1_1)s)") == \
+		"SELECT * FROM item WHERE id IN (...)"
+
+
+def test_collect(engine):
+	token = start_collecting()
+	with engine.connect() as conn:
+		for i in range(REPEATED_QUERY_THRESHOLD):
+			conn.execute(text("SELECT id FROM item WHERE id = :id"), { "id": i })
+		conn.execute(text("SELECT COUNT(*) FROM item"))
+	stats = stop_collecting(token)
+
+	assert stats.count == REPEATED_QUERY_THRESHOLD + 1
+	assert stats.duration > 0
+	assert stats.get_repeated() == [("SELECT id FROM item WHERE id = ?", REPEATED_QUERY_THRESHOLD)]
+
+	with engine.connect() as conn:
+		conn.execute(text("SELECT COUNT(*) FROM item"))
+	assert stats.count == REPEATED_QUERY_THRESHOLD + 1
+
+
+def test_request(engine, monkeypatch):
+	recorded = []
+	monkeypatch.setattr(query_stats, "record_stats", lambda kind, name, stats: recorded.append((kind, name, stats.count)))
+
+	app = Flask(__name__)
+	query_stats.init_app(app)
+
+	@app.route("/items/")
+	@query_budget(2)
+	def items():
+		with timed("items"), engine.connect() as conn:
+			for i in range(3):
+				conn.execute(text("SELECT id FROM item WHERE id = :id"), { "id": i })
+		return "ok"
+
+	client = app.test_client()
+
+	rv = client.get("/items/")
+	assert rv.status_code == 200
+	assert rv.headers["Server-Timing"].startswith("db;dur=")
+	assert "desc=\"3 queries\", items;dur=" in rv.headers["Server-Timing"]
+	assert recorded == [("request", "items", 3)]
+
+	app.config["QUERY_BUDGET_ASSERT"] = True
+	app.config["TESTING"] = True
+	with pytest.raises(QueryBudgetExceeded):
+		client.get("/items/")
+
+
+def test_task(engine, monkeypatch, capsys):
+	from app import app, rediscache
+	from app.tasks import celery
+
+	recorded = []
+	monkeypatch.setattr(rediscache, "record_query_stats",
+			lambda kind, name, count, _duration, _repeated: recorded.append((kind, name, count)))
+	monkeypatch.setattr(app, "debug", True)
+
+	@celery.task(name="test_query_stats.items")
+	def items():
+		with engine.connect() as conn:
+			for i in range(REPEATED_QUERY_THRESHOLD):
+				conn.execute(text("SELECT id FROM item WHERE id = :id"), { "id": i })
+
+	result = items.apply()
+	assert result.successful(), result.traceback
+	assert recorded == [("task", "test_query_stats.items", REPEATED_QUERY_THRESHOLD)]
+
+	# Repeated statements are reported in debug mode, which needs the app outside of the task's context
+	assert "[QueryStats] test_query_stats.items ran a statement" in capsys.readouterr().err
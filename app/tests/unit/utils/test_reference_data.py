@@ -0,0 +1,41 @@
+# ContentDB
+# SPDX-License-Identifier: AGPL-3.0-or-later
+# Copyright (C) 2018-2025 rubenwardy <rw@rubenwardy>
+
+from app.models import LuantiRelease
+from app.utils.reference_data import find_luanti_release
+
+
+def make_releases():
+	releases = []
+	for i, (name, protocol) in enumerate([("None", 0), ("5.0", 37), ("5.1", 38), ("5.2", 39), ("5.3-dev", 39),
+			("5.3", 39), ("5.10", 46)]):
+		release = LuantiRelease(name, protocol)
+		release.id = i + 1
+		releases.append(release)
+	return releases
+
+
+def test_find_luanti_release_by_version():
+	releases = make_releases()
+
+	assert find_luanti_release(releases, "5.1", None).name == "5.1"
+	assert find_luanti_release(releases, "5.1.1", None).name == "5.1"
+	assert find_luanti_release(releases, " 5.10.0 ", None).name == "5.10"
+	assert find_luanti_release(releases, "5.2", 39).name == "5.2"
+
+	assert find_luanti_release(releases, "4.0", None) is None
+	assert find_luanti_release(releases, "5", None) is None
+
+
+def test_find_luanti_release_by_protocol():
+	releases = make_releases()
+
+	assert find_luanti_release(releases, None, 38).name == "5.1"
+	assert find_luanti_release(releases, None, 40).name == "5.3"
+	assert find_luanti_release(releases, None, 100).name == "5.10"
+	assert find_luanti_release(releases, None, None) is None
+
+	# Ambiguous versions fall back to the protocol
+	assert find_luanti_release(releases, "5.3", 39).name == "5.3"
+	assert find_luanti_release(releases, "6.0", 38).name == "5.1"
@@ -0,0 +1,47 @@
+# ContentDB
+# SPDX-License-Identifier: AGPL-3.0-or-later
+# Copyright (C) 2018-2025 rubenwardy <rw@rubenwardy>
+
+import os
+
+from PIL import Image
+
+from app.utils.thumbnails import resize_and_crop, save_atomic
+
+
+def test_resize_and_crop():
+	assert resize_and_crop(Image.new("RGB", (1100, 520)), (1100, 520)).size == (1100, 520)
+	assert resize_and_crop(Image.new("RGB", (2000, 500)), (270, 180)).size == (270, 180)
+	assert resize_and_crop(Image.new("RGB", (500, 2000)), (270, 180)).size == (270, 180)
+
+
+def test_save_atomic(tmp_path):
+	img = Image.new("RGBA", (100, 67))
+	for ext in ["png", "webp", "jpg"]:
+		path = str(tmp_path / "1" / f"image.{ext}")
+		save_atomic(img, path)
+
+		with Image.open(path) as saved:
+			assert saved.size == (100, 67)
+
+	assert sorted(os.listdir(tmp_path / "1")) == ["image.jpg", "image.png", "image.webp"]
+
+
+def test_save_atomic_unique_temp_path(tmp_path, monkeypatch):
+	temp_paths = []
+	original_save = Image.Image.save
+
+	def save(self, fp, *args, **kwargs):
+		temp_paths.append(fp)
+		return original_save(self, fp, *args, **kwargs)
+
+	monkeypatch.setattr(Image.Image, "save", save)
+
+	img = Image.new("RGB", (100, 67))
+	path = str(tmp_path / "1" / "image.png")
+	save_atomic(img, path)
+	save_atomic(img, path)
+
+	assert len(temp_paths) == 2
+	assert temp_paths[0] != temp_paths[1]
+	assert os.listdir(tmp_path / "1") == ["image.png"]
@@ -0,0 +1,155 @@
+# ContentDB
+# SPDX-License-Identifier: AGPL-3.0-or-later
+# Copyright (C) 2018-2025 rubenwardy <rw@rubenwardy>
+
+import re
+import time
+import zipfile
+
+import pytest
+
+from app.utils.zipgrep import search_archive, search_archive_in_subprocess, get_required_literals, ReleaseIndex
+
+
+def make_zip(path):
+	with zipfile.ZipFile(path, "w") as zf:
+		zf.writestr("mymod/init.lua", "local x = 1\nminetest.register_node(\"mymod:a\", {})\n")
+		zf.writestr("mymod/README.md", "Uses minetest.register_node\n")
+		zf.writestr("mymod/sub/api.lua", "minetest.register_node(\"mymod:b\", {})\n")
+
+
+def test_search_regex(tmp_path):
+	path = tmp_path / "release.zip"
+	make_zip(path)
+
+	assert search_archive(str(path), r"register_node\(\"mymod:.\"", False, "*.lua", 10) == \
+		"mymod/init.lua:minetest.register_node(\"mymod:a\", {})\n" \
+		"mymod/sub/api.lua:minetest.register_node(\"mymod:b\", {})"
+
+
+def test_search_literal(tmp_path):
+	path = tmp_path / "release.zip"
+	make_zip(path)
+
+	assert search_archive(str(path), "minetest.register_node(", True, "*.lua", 10) == \
+		"mymod/init.lua:minetest.register_node(\"mymod:a\", {})\n" \
+		"mymod/sub/api.lua:minetest.register_node(\"mymod:b\", {})"
+	assert search_archive(str(path), "register_node", True, "*.md", 10) == \
+		"mymod/README.md:Uses minetest.register_node"
+	assert search_archive(str(path), "not_found", True, "*", 10) == ""
+
+
+def test_search_errors(tmp_path):
+	path = tmp_path / "release.zip"
+	make_zip(path)
+
+	assert search_archive(str(path), "local", True, "*", -1) == "Error: timeout"
+
+	bad_path = tmp_path / "bad.zip"
+	bad_path.write_text("not a zip")
+	assert search_archive(str(bad_path), "local", True, "*", 10).startswith("Error: ")
+
+
+def make_broken_zip(path, compress_type: int) -> bytearray:
+	with zipfile.ZipFile(path, "w", compress_type) as zf:
+		zf.writestr("mymod/init.lua", "local x = 1\n" * 200)
+
+	return bytearray(path.read_bytes())
+
+
+def test_search_broken_archives(tmp_path):
+	# Encrypted
+	path = tmp_path / "encrypted.zip"
+	data = make_broken_zip(path, zipfile.ZIP_STORED)
+	data[data.index(b"PK\x01\x02") + 8] |= 1
+	data[data.index(b"PK\x03\x04") + 6] |= 1
+	path.write_bytes(data)
+	assert search_archive(str(path), "local", True, "*", 10).startswith("Error: ")
+
+	# Corrupt compressed data
+	path = tmp_path / "corrupt.zip"
+	data = make_broken_zip(path, zipfile.ZIP_DEFLATED)
+	start = data.index(b"PK\x03\x04") + 30 + len("mymod/init.lua")
+	for i in range(start + 2, start + 12):
+		data[i] ^= 0xff
+	path.write_bytes(data)
+	assert search_archive(str(path), "local", True, "*", 10).startswith("Error: ")
+
+
+def test_search_in_subprocess(tmp_path):
+	path = tmp_path / "release.zip"
+	make_zip(path)
+
+	assert search_archive_in_subprocess(str(path), "-- not found", True, "*", 10) == ""
+	assert search_archive_in_subprocess(str(path), "register_node", True, "*.md", 10) == \
+		"mymod/README.md:Uses minetest.register_node"
+
+
+def test_search_in_subprocess_timeout(tmp_path):
+	path = tmp_path / "release.zip"
+	with zipfile.ZipFile(path, "w") as zf:
+		zf.writestr("init.lua", "a" * 40 + "!\n")
+
+	# Catastrophic backtracking within a single line
+	start = time.monotonic()
+	assert search_archive_in_subprocess(str(path), "(a+)+$", False, "*", 1) == "Error: timeout"
+	assert time.monotonic() - start < 5
+
+
+def test_required_literals():
+	assert get_required_literals("a.b(c", True) == ["a.b(c"]
+	assert get_required_literals("minetest\\.register_node\\(", False) == ["minetest.register_node("]
+	assert get_required_literals("register_(node|tool)", False) == []
+	assert get_required_literals("(?i)register", False) == []
+	assert get_required_literals("abcd?efg+hij*", False) == ["abc", "efg"]
+	assert get_required_literals("core\\.get_[a-z]+_by_name", False) == ["core.get_", "_by_name"]
+	assert get_required_literals("io\\.open\\s*\\(", False) == ["io.open"]
+	assert get_required_literals("os.execute", False) == ["execute"]
+	assert get_required_literals("ab{1,3}cdef", False) == ["cdef"]
+	assert get_required_literals("foo\\x41bar", False) == ["foo", "bar"]
+	assert get_required_literals("foo\\101bar", False) == ["foo", "bar"]
+
+
+@pytest.mark.parametrize("query,text", [
+	("foo\\x41bar", "fooAbar"),
+	("foo\\u0041bar", "fooAbar"),
+	("foo\\U00000041bar", "fooAbar"),
+	("foo\\101bar", "fooAbar"),
+	("foo\\0bar", "foo\0bar"),
+	("foo\\N{LATIN CAPITAL LETTER A}bar", "fooAbar"),
+	("(foo)\\1bar", "foofoobar"),
+	("foo\\d123", "foo5123"),
+])
+def test_required_literals_skip_escapes(query, text):
+	assert re.search(query, text)
+
+	literals = get_required_literals(query, False)
+	assert all(literal in text for literal in literals), literals
+
+
+def test_release_index(tmp_path):
+	path = tmp_path / "release.zip"
+	make_zip(path)
+
+	other_path = tmp_path / "other.zip"
+	with zipfile.ZipFile(other_path, "w") as zf:
+		zf.writestr("other/init.lua", "core.register_node(\"other:a\", {})\n")
+		zf.writestr("other/texture.png", b"\x89PNG\0minetest.register_node")
+
+	index = ReleaseIndex(str(tmp_path / "index.sqlite"))
+	index.add(1, 10, str(path))
+	index.add(2, 20, str(other_path))
+	assert index.get_indexed_releases() == {1: 10, 2: 20}
+
+	assert index.get_candidates("minetest.register_node(", True) == {1}
+	assert index.get_candidates("register_node", True) == {1, 2}
+	assert index.get_candidates("not_found", True) == set()
+	assert index.get_candidates("re.*", False) is None
+
+	index.add(2, 21, str(path))
+	assert index.get_indexed_releases() == {1: 10, 2: 21}
+	assert index.get_candidates("minetest.register_node(", True) == {1, 2}
+
+	index.remove(1)
+	assert index.get_indexed_releases() == {2: 21}
+	assert index.get_candidates("minetest.register_node(", True) == {2}
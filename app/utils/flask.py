@@ -151,12 +151,43 @@ def get_daterange_options() -> typing.List[typing.Tuple[LazyString, str]]:
 	]
 
 
-def cached(max_age: int):
+def cached(max_age: int, shared: bool = False):
+	"""
+	Sets Cache-Control on the response.
+
+	If `shared` is true, successful responses are also stored in Redis and served to other
+	clients until they expire or a package, release, tag, or review is changed.
+	The key is the endpoint, normalised query string, and Accept-Language.
+	"""
 	def decorator(f):
 		@wraps(f)
 		def inner(*args, **kwargs):
+			key = None
+			if shared:
+				from app.rediscache import make_response_cache_key, get_cached_response
+
+				lang = request.headers.get("Accept-Language", "").replace(" ", "").lower()
+				lang += "|" + (request.cookies.get("locale") or "")
+				key = make_response_cache_key(request.endpoint, request.view_args or {},
+						list(request.args.items(multi=True)), lang)
+
+				entry = get_cached_response(key)
+				if entry is not None:
+					mimetype, body = entry
+					res = Response(body, mimetype=mimetype)
+					res.vary = "Accept-Language"
+					res.headers["X-Cache"] = "HIT"
+					res.cache_control.max_age = max_age
+					return res
+
 			res: Response = f(*args, **kwargs)
 			res.cache_control.max_age = max_age
+
+			if key is not None and res.status_code == 200 and not res.is_streamed:
+				from app.rediscache import set_cached_response
+				set_cached_response(key, res.mimetype, res.get_data(), max_age)
+				res.headers["X-Cache"] = "MISS"
+
 			return res
 		return inner
 
@@ -4,6 +4,8 @@
 
 
 import contextlib
+import fcntl
+import hashlib
 from typing import List, Optional, Tuple
 
 import git
@@ -15,6 +17,7 @@ from urllib.parse import urlsplit
 
 from git import GitCommandError
 
+from app import app
 from app.tasks import TaskError
 from app.utils.misc import random_string, normalize_line_endings
 
@@ -39,33 +42,188 @@ def get_temp_dir():
 	shutil.rmtree(temp)
 
 
-# Clones a repo from an unvalidated URL.
-# Returns a tuple of path and repo on sucess.
-# Throws `TaskError` on failure.
+# Mirror cache
+#
+# Repositories are fetched into bare mirrors in GIT_CACHE_DIR, keyed by URL, so that each
+# fetch only downloads new objects. Checkouts are worktrees of the mirror.
+# Each mirror has a lock file, held while it is fetched or modified.
+
+MIRROR_FETCH_REFSPECS = [
+	"+refs/heads/*:refs/heads/*",
+	"+refs/tags/*:refs/tags/*",
+	"+HEAD:refs/contentdb/HEAD",
+]
+
+
+def get_cache_dir() -> str:
+	return app.config.get("GIT_CACHE_DIR") or os.path.join(tempfile.gettempdir(), "contentdb_git_cache")
+
+
+def get_mirror_key(git_url: str) -> str:
+	"""
+	Normalises a repository URL, so that different ways of writing it use the same mirror
+	"""
+	_, netloc, path, _, _ = urlsplit(generate_git_url(git_url.strip()))
+	return netloc.lower() + path.rstrip("/").removesuffix(".git")
+
+
+def _get_mirror_path(git_url: str) -> str:
+	return os.path.join(get_cache_dir(), hashlib.sha1(get_mirror_key(git_url).encode("utf-8")).hexdigest())
+
+
 @contextlib.contextmanager
-def clone_repo(url_str, ref=None, recursive=False):
-	git_dir = os.path.join(tempfile.gettempdir(), random_string(10))
+def _lock_mirror(mirror_path: str, blocking: bool = True):
+	os.makedirs(os.path.dirname(mirror_path), exist_ok=True)
+	with open(mirror_path + ".lock", "w") as f:
+		try:
+			fcntl.flock(f, fcntl.LOCK_EX if blocking else fcntl.LOCK_EX | fcntl.LOCK_NB)
+		except BlockingIOError:
+			yield False
+			return
+
+		try:
+			yield True
+		finally:
+			fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def _get_dir_size(path: str) -> int:
+	ret = 0
+	for dirpath, _, filenames in os.walk(path):
+		for filename in filenames:
+			try:
+				ret += os.lstat(os.path.join(dirpath, filename)).st_size
+			except FileNotFoundError:
+				pass
+
+	return ret
+
+
+def evict_mirrors(max_size: int, keep: Optional[str] = None):
+	"""
+	Deletes the least recently used mirrors until the cache is no larger than max_size bytes.
+	Mirrors that are locked or have a checkout are skipped.
+	"""
+	cache_dir = get_cache_dir()
+	mirrors = []
+	for name in os.listdir(cache_dir):
+		path = os.path.join(cache_dir, name)
+		if os.path.isdir(path) and path != keep:
+			mirrors.append((os.path.getmtime(path), path, _get_dir_size(path)))
+
+	total = sum([size for _, _, size in mirrors])
+	if keep is not None and os.path.isdir(keep):
+		total += _get_dir_size(keep)
+
+	mirrors.sort()
+	for _, path, size in mirrors:
+		if total <= max_size:
+			break
+
+		with _lock_mirror(path, blocking=False) as locked:
+			worktrees_path = os.path.join(path, "worktrees")
+			if locked and not (os.path.isdir(worktrees_path) and len(os.listdir(worktrees_path)) > 0):
+				shutil.rmtree(path)
+				total -= size
+
+
+def _fetch_mirror(git_url: str, mirror_path: str) -> git.Repo:
+	"""
+	Creates or updates a mirror. The mirror must be locked.
+	"""
+	is_new = not os.path.isdir(mirror_path)
+	if is_new:
+		repo = git.Repo.init(mirror_path, bare=True)
+		origin = repo.create_remote("origin", url=git_url)
+		with repo.config_writer() as config:
+			config.set_value('remote "origin"', "fetch", MIRROR_FETCH_REFSPECS[0])
+			for refspec in MIRROR_FETCH_REFSPECS[1:]:
+				config.add_value('remote "origin"', "fetch", refspec)
+		assert origin.exists()
+	else:
+		repo = git.Repo(mirror_path)
+
+		# Different spellings of a URL share a mirror, and the package's URL may have changed
+		origin = repo.remote("origin")
+		if origin.url != git_url:
+			origin.set_url(git_url)
 
 	try:
-		git_url = generate_git_url(url_str)
-		print("Cloning from " + git_url)
+		repo.git.update_environment(**GIT_ENV)
+		repo.git.fetch("origin", prune=True, kill_after_timeout=120)
+	except GitCommandError:
+		if is_new:
+			shutil.rmtree(mirror_path)
+		raise
+
+	# Used for least recently used eviction
+	os.utime(mirror_path)
+
+	if is_new:
+		max_size = app.config.get("GIT_CACHE_MAX_SIZE", 5 * 1024 * 1024 * 1024)
+		evict_mirrors(max_size, keep=mirror_path)
+
+	return repo
 
-		if ref is None:
-			repo = git.Repo.clone_from(git_url, git_dir,
-					progress=None, env=GIT_ENV, depth=1, recursive=recursive, kill_after_timeout=15)
-		else:
-			assert ref != ""
 
-			repo = git.Repo.init(git_dir)
-			origin = repo.create_remote("origin", url=git_url)
-			assert origin.exists()
-			origin.fetch()
-			repo.git.checkout(ref)
+@contextlib.contextmanager
+def get_mirror(git_url: str):
+	"""
+	Yields an up-to-date bare mirror of a repository.
+	The mirror is locked, so that other processes don't fetch or evict it while it is in use.
+	"""
+	mirror_path = _get_mirror_path(git_url)
+	with _lock_mirror(mirror_path):
+		yield _fetch_mirror(git_url, mirror_path)
+
+
+@contextlib.contextmanager
+def checkout_worktree(git_url: str, ref: Optional[str] = None, recursive: bool = False):
+	"""
+	Yields a temporary checkout of `ref`, or the default branch, as a worktree of the mirror.
+	"""
+	mirror_path = _get_mirror_path(git_url)
+	worktree_path = os.path.join(tempfile.gettempdir(), random_string(10))
+
+	with _lock_mirror(mirror_path):
+		mirror = _fetch_mirror(git_url, mirror_path)
+		try:
+			commit = mirror.git.rev_parse((ref or "refs/contentdb/HEAD") + "^{commit}")
+		except GitCommandError:
+			raise TaskError("Unable to find the reference " + (ref or "HEAD"))
+
+		mirror.git.worktree("add", "--detach", worktree_path, commit)
+
+	try:
+		repo = git.Repo(worktree_path)
+		repo.git.update_environment(**GIT_ENV)
 
-			repo.git.submodule('update', '--init')
+		# Checkouts of a ref always include the top-level submodules, as they did before mirrors
+		if recursive:
+			repo.git.submodule("update", "--init", "--recursive", kill_after_timeout=120)
+		elif ref is not None:
+			repo.git.submodule("update", "--init", kill_after_timeout=120)
 
 		yield repo
-		shutil.rmtree(git_dir)
+	finally:
+		with _lock_mirror(mirror_path):
+			shutil.rmtree(worktree_path, ignore_errors=True)
+			git.Repo(mirror_path).git.worktree("prune")
+
+
+# Clones a repo from an unvalidated URL.
+# Returns a tuple of path and repo on sucess.
+# Throws `TaskError` on failure.
+@contextlib.contextmanager
+def clone_repo(url_str, ref=None, recursive=False):
+	assert ref != ""
+
+	git_url = generate_git_url(url_str)
+	print("Cloning from " + git_url)
+
+	try:
+		with checkout_worktree(git_url, ref, recursive) as repo:
+			yield repo
 		return
 
 	except GitCommandError as e:
@@ -75,9 +233,7 @@ def clone_repo(url_str, ref=None, recursive=False):
 	except gitdb.exc.BadName as e:
 		err = "Unable to find the reference " + (ref or "?") + "\n" + e.stderr
 
-	raise TaskError(err.replace("stderr: ", "") \
-			.replace("Cloning into '" + git_dir + "'...", "") \
-			.strip())
+	raise TaskError(err.replace("stderr: ", "").strip())
 
 
 def get_latest_commit(git_url, ref_name=None):
@@ -100,11 +256,7 @@ def get_latest_commit(git_url, ref_name=None):
 
 # @returns (tag_name, commit_hash, tag_message)
 def get_latest_tag(git_url) -> Tuple[Optional[str], Optional[str], Optional[str]]:
-	with get_temp_dir() as git_dir:
-		repo = git.Repo.init(git_dir)
-		origin = repo.create_remote("origin", url=git_url)
-		origin.fetch()
-
+	with get_mirror(git_url) as repo:
 		refs = repo.git.for_each_ref(sort="creatordate", format="%(objectname)\t%(refname)").split("\n")
 		refs = [ref for ref in refs if "refs/tags/" in ref]
 		if len(refs) == 0:
@@ -131,11 +283,7 @@ def get_latest_tag(git_url) -> Tuple[Optional[str], Optional[str], Optional[str]
 
 
 def get_commit_list(git_url: str, start: str, end: str) -> List[str]:
-	with (get_temp_dir() as git_dir):
-		repo = git.Repo.init(git_dir)
-		origin = repo.create_remote("origin", url=git_url)
-		origin.fetch()
-
+	with get_mirror(git_url) as repo:
 		commits = repo.iter_commits(f"{start}..{end}")
 		ret = [commit.summary for commit in commits]
 		ret.reverse()
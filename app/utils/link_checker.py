@@ -0,0 +1,142 @@
+# ContentDB
+# SPDX-License-Identifier: AGPL-3.0-or-later
+# Copyright (C) 2018-2025 rubenwardy <rw@rubenwardy>
+
+import random
+import sys
+import time
+import typing
+from concurrent.futures import ThreadPoolExecutor, Future, wait, FIRST_COMPLETED
+from urllib.parse import urlparse
+
+import requests
+
+
+# Checks whether URLs exist
+#
+# Each URL is only checked once, even if it's used by many packages, and results can be cached
+# between runs. URLs on different hosts are checked concurrently, but requests to a host are
+# limited to `per_host` at a time with a delay between them, to avoid overloading hosts or
+# being rate limited.
+#
+# A HEAD request is tried first, falling back to GET as not all servers support HEAD.
+#
+# Results are "" if the URL exists, or otherwise the status code or the name of the error.
+
+
+USER_AGENT = "Mozilla/5.0 (compatible; ContentDB link checker; +https://content.luanti.org/)"
+
+
+class LinkChecker:
+	max_workers: int
+	per_host: int
+	host_delay: tuple[float, float]
+	timeout: float
+
+	def __init__(self, get_cached: typing.Optional[typing.Callable[[list[str]], dict[str, str]]] = None,
+			set_cached: typing.Optional[typing.Callable[[dict[str, str]], None]] = None,
+			max_workers: int = 16, per_host: int = 1, host_delay: tuple[float, float] = (0.4, 0.6),
+			timeout: float = 10):
+		"""
+		:param get_cached: returns cached results for a list of URLs
+		:param set_cached: caches results
+		:param host_delay: range of seconds to wait between requests to the same host
+		"""
+		self.get_cached = get_cached
+		self.set_cached = set_cached
+		self.max_workers = max_workers
+		self.per_host = per_host
+		self.host_delay = host_delay
+		self.timeout = timeout
+
+	def check_url(self, session: requests.Session, url: str) -> str:
+		headers = {
+			"User-Agent": USER_AGENT,
+		}
+
+		try:
+			with session.head(url, headers=headers, timeout=self.timeout, allow_redirects=True) as response:
+				status_code = response.status_code
+			if status_code < 400 or status_code == 403:
+				return ""
+
+			with session.get(url, stream=True, headers=headers, timeout=self.timeout) as response:
+				status_code = response.status_code
+			if status_code < 400 or status_code == 403:
+				return ""
+
+			print(f"   - [{status_code}] <{url}>", file=sys.stderr)
+			return str(status_code)
+		except requests.exceptions.Timeout:
+			return "timeout"
+		except requests.exceptions.ConnectionError:
+			return "ConnectionError"
+		except requests.exceptions.RequestException as e:
+			return type(e).__name__
+
+	def _check_after_delay(self, session: requests.Session, url: str, delay: bool) -> str:
+		if delay:
+			time.sleep(random.uniform(*self.host_delay))
+
+		return self.check_url(session, url)
+
+	def check_urls(self, urls: typing.Iterable[str],
+			on_progress: typing.Optional[typing.Callable[[int, int], None]] = None) -> dict[str, str]:
+		"""
+		Returns a map from URL to result. URLs must be absolute.
+
+		:param on_progress: called with the number of URLs checked and the number to check
+		"""
+		urls = list(set(urls))
+		results = self.get_cached(urls) if self.get_cached else {}
+
+		by_host: dict[str, list[str]] = {}
+		for url in urls:
+			if url not in results:
+				by_host.setdefault(urlparse(url).hostname or "", []).append(url)
+
+		lanes = []
+		for host_urls in by_host.values():
+			host_urls.sort()
+			lanes.extend([host_urls[i::self.per_host] for i in range(min(self.per_host, len(host_urls)))])
+
+		# Start the longest lanes first, so that they don't determine the total time
+		lanes.sort(key=len, reverse=True)
+
+		checked = {}
+		total = sum(len(x) for x in lanes)
+		if lanes:
+			# Each lane has one URL being checked at a time. When it's done, the next URL in the lane is
+			# submitted, so results are cached and reported as they arrive rather than per lane.
+			sessions = [requests.Session() for _ in lanes]
+			try:
+				with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+					pending: dict[Future, tuple[str, int]] = {}
+
+					def submit(lane_idx: int, delay: bool):
+						lane = lanes[lane_idx]
+						if len(lane) > 0:
+							url = lane.pop(0)
+							future = executor.submit(self._check_after_delay, sessions[lane_idx], url, delay)
+							pending[future] = (url, lane_idx)
+
+					for i in range(len(lanes)):
+						submit(i, False)
+
+					while pending:
+						done, _ = wait(pending.keys(), return_when=FIRST_COMPLETED)
+						for future in done:
+							url, lane_idx = pending.pop(future)
+							submit(lane_idx, True)
+
+							checked[url] = future.result()
+							if self.set_cached:
+								self.set_cached({ url: checked[url] })
+							if on_progress:
+								on_progress(len(checked), total)
+			finally:
+				for session in sessions:
+					session.close()
+
+		results.update(checked)
+		return results
@@ -0,0 +1,110 @@
+# ContentDB
+# SPDX-License-Identifier: AGPL-3.0-or-later
+# Copyright (C) 2018-2025 rubenwardy <rw@rubenwardy>
+
+import base64
+import datetime
+import json
+import typing
+
+from flask import abort, make_response
+from sqlalchemy import tuple_, DateTime
+
+from app.models import db
+
+
+# Keyset (cursor) pagination
+#
+# A page is selected by comparing its sort keys with the keys of the last item of the previous
+# page, rather than using OFFSET, so the cost of a page doesn't depend on how deep it is.
+# The last key must be unique, such as an id, so that items with equal values aren't skipped.
+#
+# Cursors are opaque to clients. They contain the name of the sort order, so that a cursor
+# can't be used with a different one.
+
+
+class CursorPagination:
+	items: list
+	per_page: int
+	total: typing.Optional[int]
+	next_cursor: typing.Optional[str]
+
+	def __init__(self, items: list, per_page: int, total: typing.Optional[int], next_cursor: typing.Optional[str]):
+		self.items = items
+		self.per_page = per_page
+		self.total = total
+		self.next_cursor = next_cursor
+
+	@property
+	def has_next(self):
+		return self.next_cursor is not None
+
+
+def encode_cursor(name: str, values: list) -> str:
+	values = [x.isoformat() if isinstance(x, datetime.datetime) else x for x in values]
+	data = json.dumps([name, values], separators=(",", ":")).encode("utf-8")
+	return base64.urlsafe_b64encode(data).decode("ascii").rstrip("=")
+
+
+def decode_cursor(cursor: str, name: str, keys: list) -> list:
+	"""
+	Raises ValueError if the cursor is invalid or is for a different sort order
+	"""
+	try:
+		data = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+	except (ValueError, TypeError) as e:
+		raise ValueError("Invalid cursor") from e
+
+	if not isinstance(data, list) or len(data) != 2 or data[0] != name or \
+			not isinstance(data[1], list) or len(data[1]) != len(keys):
+		raise ValueError("Cursor is for a different sort order")
+
+	values = []
+	for key, value in zip(keys, data[1]):
+		if isinstance(key.type, DateTime):
+			if not isinstance(value, str):
+				raise ValueError("Invalid cursor")
+			value = datetime.datetime.fromisoformat(value)
+		elif not isinstance(value, (int, float, str)) or isinstance(value, bool):
+			raise ValueError("Invalid cursor")
+
+		values.append(value)
+
+	return values
+
+
+def paginate_by_cursor(query, name: str, keys: list, descending: bool, cursor: typing.Optional[str],
+		per_page: int, count: bool = True) -> CursorPagination:
+	"""
+	Returns a page of a query, ordered by keys. Any limit or offset of the query is ignored.
+
+	:param name: name of the sort order, stored in cursors
+	:param keys: columns to order by, the last must be unique
+	:param cursor: next_cursor of the previous page, or None or "" for the first page
+	:param count: whether to count the total number of results
+	"""
+	# The cursor can't be applied after a limit, and pages are limited by per_page instead
+	query = query.limit(None).offset(None)
+
+	total = query.order_by(None).count() if count else None
+
+	if cursor:
+		try:
+			values = decode_cursor(cursor, name, keys)
+		except ValueError as e:
+			abort(make_response(str(e)), 400)
+
+		if descending:
+			query = query.filter(tuple_(*keys) < tuple_(*values))
+		else:
+			query = query.filter(tuple_(*keys) > tuple_(*values))
+
+	order = [db.desc(key) if descending else db.asc(key) for key in keys]
+	rows = query.add_columns(*keys).order_by(None).order_by(*order).limit(per_page + 1).all()
+
+	next_cursor = None
+	if len(rows) > per_page:
+		rows = rows[:per_page]
+		next_cursor = encode_cursor(name, list(rows[-1][1:]))
+
+	return CursorPagination([row[0] for row in rows], per_page, total, next_cursor)
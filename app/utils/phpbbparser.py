@@ -2,14 +2,19 @@
 # License: MIT
 # Source: https://github.com/rubenwardy/python_phpbb_parser
 
+import hashlib
 import re
 import sys
+import typing
 import urllib
 import urllib.parse as urlparse
 import urllib.request
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 from urllib.parse import urlencode
 
+import lxml.html
+import requests
 from bs4 import BeautifulSoup
 
 
@@ -118,69 +123,215 @@ def get_profile(url, username):
 
 regex_id = re.compile(r"^.*t=([0-9]+).*$")
 
+TOPICS_PER_PAGE = 30
 
-def parse_forum_list_page(id, page, out, extra=None):
-	num_per_page = 30
-	start = page*num_per_page+1
-	print(" - Fetching page {} (topics {}-{})".format(page, start, start+num_per_page), file=sys.stderr)
 
-	url = "https://forum.luanti.org/viewforum.php?f=" + str(id) + "&start=" + str(start)
-	r = urllib.request.urlopen(url).read().decode("utf-8")
-	soup = BeautifulSoup(r, "html.parser")
+def _has_class(name):
+	return f"contains(concat(' ', normalize-space(@class), ' '), ' {name} ')"
 
-	for row in soup.find_all("li", class_="row"):
-		classes = row.get("class")
+
+def _find_class(el, name):
+	res = el.xpath(f".//*[{_has_class(name)}]")
+	return res[0] if len(res) > 0 else None
+
+
+def _first_text(el):
+	texts = el.xpath(".//text()")
+	return texts[0] if len(texts) > 0 else ""
+
+
+def parse_forum_list_html(html):
+	"""
+	Returns the topics on a page of a forum's topic list, excluding stickies and announcements
+	"""
+	doc = lxml.html.document_fromstring(html, parser=lxml.html.HTMLParser(encoding="utf-8"))
+
+	topics = []
+	for row in doc.xpath(f"//li[{_has_class('row')}]"):
+		classes = row.get("class").split()
 		if "sticky" in classes or "announce" in classes or "global-announce" in classes:
 			continue
 
-		topic = row.find("dl")
+		topic = row.find(".//dl")
 
 		# Link info
-		link   = topic.find(class_="topictitle")
+		link   = _find_class(topic, "topictitle")
 		id	   = regex_id.match(link.get("href")).group(1)
-		title  = link.find(text=True)
+		title  = _first_text(link)
 
 		# Date
-		left   = topic.find(class_="topic-poster")
-		date   = left.find("time").get_text()
+		left   = _find_class(topic, "topic-poster")
+		date   = left.find(".//time").text_content()
 		date   = datetime.strptime(date, "%a %b %d, %Y %H:%M")
-		links  = left.find_all("a")
+		links  = left.findall(".//a")
 		if len(links) == 0:
 			continue
 
-		author = links[-1].get_text().strip()
+		author = links[-1].text_content().strip()
 
 		# Get counts
-		posts  = topic.find(class_="posts").find(text=True)
-		views  = topic.find(class_="views").find(text=True)
+		posts  = _first_text(_find_class(topic, "posts"))
+		views  = _first_text(_find_class(topic, "views"))
 
-		if id in out:
-			print("   - got {} again, title: {}".format(id, title), file=sys.stderr)
-			assert title == out[id]['title']
-			return False
-
-		row = {
+		topics.append({
 			"id"    : id,
 			"title" : title,
 			"author": author,
 			"posts" : posts,
 			"views" : views,
 			"date"  : date
+		})
+
+	return topics
+
+
+class ForumTopicFetcher:
+	"""
+	Fetches the topic lists of forums.
+
+	Pages of each forum are requested concurrently, `pages_per_wave` at a time, until a page
+	doesn't contain any new topics. phpBB shows the last page for any start after the end.
+
+	Pages can be cached between runs: the ETag and Last-Modified headers are used for conditional
+	requests, and pages whose content hasn't changed aren't parsed again.
+	"""
+
+	base_url: str
+	max_workers: int
+	pages_per_wave: int
+	timeout: float
+
+	pages_fetched: int
+	pages_unchanged: int
+
+	def __init__(self, base_url="https://forum.luanti.org",
+			get_cached: typing.Optional[typing.Callable[[list[str]], dict[str, dict]]] = None,
+			set_cached: typing.Optional[typing.Callable[[dict[str, dict]], None]] = None,
+			max_workers: int = 8, pages_per_wave: int = 4, timeout: float = 15):
+		"""
+		:param get_cached: returns cached pages for a list of URLs
+		:param set_cached: caches pages, values are JSON serializable
+		"""
+		self.base_url = base_url
+		self.get_cached = get_cached
+		self.set_cached = set_cached
+		self.max_workers = max_workers
+		self.pages_per_wave = pages_per_wave
+		self.timeout = timeout
+		self.pages_fetched = 0
+		self.pages_unchanged = 0
+
+	def get_page_url(self, forum_id: int, page: int) -> str:
+		return f"{self.base_url}/viewforum.php?f={forum_id}&start={page * TOPICS_PER_PAGE}"
+
+	def _fetch_page(self, session: requests.Session, url: str, cached: typing.Optional[dict]) \
+			-> tuple[list[dict], dict]:
+		"""
+		Returns the topics on the page, and the page to cache
+		"""
+		print(f" - Fetching {url}", file=sys.stderr)
+
+		headers = {}
+		if cached:
+			if cached.get("etag"):
+				headers["If-None-Match"] = cached["etag"]
+			if cached.get("last_modified"):
+				headers["If-Modified-Since"] = cached["last_modified"]
+
+		response = session.get(url, headers=headers, timeout=self.timeout)
+		if cached and response.status_code == 304:
+			return _load_topics(cached["topics"]), cached
+
+		response.raise_for_status()
+
+		digest = hashlib.sha256(response.content).hexdigest()
+		if cached and cached.get("digest") == digest:
+			topics = _load_topics(cached["topics"])
+		else:
+			topics = parse_forum_list_html(response.content)
+
+		return topics, {
+			"etag": response.headers.get("ETag"),
+			"last_modified": response.headers.get("Last-Modified"),
+			"digest": digest,
+			"topics": _dump_topics(topics),
 		}
 
+	def get_topics(self, forums: list[tuple[int, typing.Optional[dict]]]) -> dict[str, dict]:
+		"""
+		Returns a map from topic id to topic.
+
+		:param forums: list of forum ids and extra values to add to their topics
+		"""
+		out = {}
+		next_page = { forum_id: 0 for forum_id, _ in forums }
+
+		with requests.Session() as session, ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+			session.mount(self.base_url, requests.adapters.HTTPAdapter(pool_maxsize=self.max_workers))
+
+			while len(next_page) > 0:
+				urls = {}
+				for forum_id, page in next_page.items():
+					for i in range(page, page + self.pages_per_wave):
+						urls[(forum_id, i)] = self.get_page_url(forum_id, i)
+
+				cached = self.get_cached(list(urls.values())) if self.get_cached else {}
+				futures = { key: executor.submit(self._fetch_page, session, url, cached.get(url))
+						for key, url in urls.items() }
+
+				to_cache = {}
+				results = {}
+				for key, future in futures.items():
+					url = urls[key]
+					results[key], to_cache[url] = future.result()
+					self.pages_fetched += 1
+					if url in cached and cached[url]["digest"] == to_cache[url]["digest"]:
+						self.pages_unchanged += 1
+
+				if self.set_cached:
+					self.set_cached(to_cache)
+
+				# Pages are added in order, so that the end of a forum is found in the same way as
+				# fetching them one at a time
+				for forum_id, extra in forums:
+					if forum_id not in next_page:
+						continue
+
+					start = next_page[forum_id]
+					for i in range(start, start + self.pages_per_wave):
+						if not _add_topics(results[(forum_id, i)], out, extra):
+							del next_page[forum_id]
+							break
+					else:
+						next_page[forum_id] = start + self.pages_per_wave
+
+		return out
+
+
+def _add_topics(topics: list[dict], out: dict[str, dict], extra: typing.Optional[dict]) -> bool:
+	"""
+	Returns False if the page has no new topics, meaning that it is past the end
+	"""
+	if len(topics) == 0:
+		return False
+
+	for topic in topics:
+		if topic["id"] in out:
+			print("   - got {} again, title: {}".format(topic["id"], topic["title"]), file=sys.stderr)
+			return False
+
+		row = dict(topic)
 		if extra is not None:
-			for key, value in extra.items():
-				row[key] = value
+			row.update(extra)
 
-		out[id] = row
+		out[topic["id"]] = row
 
 	return True
 
 
-def get_topics_from_forum(id, out, extra=None):
-	print("Fetching all topics from forum {}".format(id), file=sys.stderr)
-	page = 0
-	while parse_forum_list_page(id, page, out, extra):
-		page = page + 1
+def _dump_topics(topics: list[dict]) -> list[dict]:
+	return [{ **topic, "date": topic["date"].isoformat() } for topic in topics]
+
 
-	return out
+def _load_topics(topics: list[dict]) -> list[dict]:
+	return [{ **topic, "date": datetime.fromisoformat(topic["date"]) } for topic in topics]
@@ -0,0 +1,177 @@
+# ContentDB
+# SPDX-License-Identifier: AGPL-3.0-or-later
+# Copyright (C) 2018-2025 rubenwardy <rw@rubenwardy>
+
+import contextvars
+import re
+import sys
+import time
+import typing
+from contextlib import contextmanager
+from functools import wraps
+
+from flask import Flask, request, current_app, Response, g
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+
+# Counts the queries made by each request and Celery task, and how long they took.
+#
+# Totals are exported to Prometheus by the metrics blueprint, and requests also get a
+# `Server-Timing` header. A statement that runs REPEATED_QUERY_THRESHOLD or more times in
+# one request or task, with different parameters, is counted as repeated. This usually means
+# that a relationship is being lazy loaded in a loop (an N+1 query).
+
+REPEATED_QUERY_THRESHOLD = 10
+
+
+class QueryStats:
+	count: int
+	duration: float
+	statements: dict[str, int]
+	timings: list[tuple[str, float]]
+
+	def __init__(self):
+		self.count = 0
+		self.duration = 0
+		self.statements = {}
+		self.timings = []
+
+	def add(self, statement: str, duration: float):
+		self.count += 1
+		self.duration += duration
+
+		shape = get_statement_shape(statement)
+		self.statements[shape] = self.statements.get(shape, 0) + 1
+
+	def get_repeated(self) -> list[tuple[str, int]]:
+		"""
+		Returns statements that ran at least REPEATED_QUERY_THRESHOLD times, most repeated first
+		"""
+		ret = [(shape, count) for shape, count in self.statements.items() if count >= REPEATED_QUERY_THRESHOLD]
+		ret.sort(key=lambda x: -x[1])
+		return ret
+
+	def get_server_timing(self) -> str:
+		entries = [f"db;dur={self.duration * 1000:.1f};desc=\"{self.count} queries\""]
+		for name, duration in self.timings:
+			entries.append(f"{name};dur={duration * 1000:.1f}")
+
+		return ", ".join(entries)
+
+
+class QueryBudgetExceeded(Exception):
+	pass
+
+
+_current: contextvars.ContextVar[typing.Optional[QueryStats]] = contextvars.ContextVar("query_stats", default=None)
+
+
+def get_statement_shape(statement: str) -> str:
+	# Expanded IN lists have a parameter per value
+	statement = re.sub(r"\(%\(\w+\)s(, %\(\w+\)s)*\)", "(...)", statement)
+	return " ".join(statement.split())
+
+
+def start_collecting() -> contextvars.Token:
+	return _current.set(QueryStats())
+
+
+def stop_collecting(token: contextvars.Token) -> QueryStats:
+	stats = _current.get()
+	_current.reset(token)
+	return stats
+
+
+def get_current_stats() -> typing.Optional[QueryStats]:
+	return _current.get()
+
+
+@contextmanager
+def timed(name: str):
+	"""
+	Times a block of code, adding it to the Server-Timing header of the current request
+	"""
+	start = time.perf_counter()
+	try:
+		yield
+	finally:
+		stats = _current.get()
+		if stats is not None:
+			stats.timings.append((name, time.perf_counter() - start))
+
+
+def query_budget(max_queries: int):
+	"""
+	Sets the maximum number of queries a view should make. When QUERY_BUDGET_ASSERT is set,
+	requests that exceed the budget fail with QueryBudgetExceeded. This is intended for tests.
+	"""
+	def decorator(f):
+		@wraps(f)
+		def inner(*args, **kwargs):
+			return f(*args, **kwargs)
+
+		inner.query_budget = max_queries
+		return inner
+
+	return decorator
+
+
+@event.listens_for(Engine, "before_cursor_execute")
+def _before_cursor_execute(conn, _cursor, _statement, _parameters, _context, _executemany):
+	if _current.get() is not None:
+		conn.info.setdefault("query_start_time", []).append(time.perf_counter())
+
+
+@event.listens_for(Engine, "after_cursor_execute")
+def _after_cursor_execute(conn, _cursor, statement, _parameters, _context, _executemany):
+	stats = _current.get()
+	start_times = conn.info.get("query_start_time")
+	if stats is not None and start_times:
+		stats.add(statement, time.perf_counter() - start_times.pop())
+
+
+def _report_repeated(name: str, stats: QueryStats):
+	for shape, count in stats.get_repeated():
+		print(f"[QueryStats] {name} ran a statement {count} times: {shape[:200]}", file=sys.stderr)
+
+
+def record_stats(kind: str, name: str, stats: QueryStats):
+	"""
+	:param kind: "request" or "task"
+	:param name: the endpoint or task name
+	"""
+	from app.rediscache import record_query_stats
+	record_query_stats(kind, name, stats.count, stats.duration, len(stats.get_repeated()))
+
+	if current_app.debug:
+		_report_repeated(name, stats)
+
+
+def init_app(app: Flask):
+	@app.before_request
+	def start_query_stats():
+		g.query_stats_token = start_collecting()
+
+	@app.after_request
+	def add_query_stats(response: Response):
+		stats = _current.get()
+		if stats is None:
+			return response
+
+		endpoint = request.endpoint or "none"
+		response.headers.add("Server-Timing", stats.get_server_timing())
+		record_stats("request", endpoint, stats)
+
+		view = current_app.view_functions.get(request.endpoint)
+		budget = getattr(view, "query_budget", None)
+		if current_app.config.get("QUERY_BUDGET_ASSERT") and budget is not None and stats.count > budget:
+			raise QueryBudgetExceeded(f"{endpoint} made {stats.count} queries, the budget is {budget}")
+
+		return response
+
+	@app.teardown_request
+	def stop_query_stats(_exception):
+		token = g.pop("query_stats_token", None)
+		if token is not None:
+			stop_collecting(token)
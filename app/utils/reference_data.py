@@ -0,0 +1,123 @@
+# ContentDB
+# SPDX-License-Identifier: AGPL-3.0-or-later
+# Copyright (C) 2018-2025 rubenwardy <rw@rubenwardy>
+
+import os
+import typing
+
+from app.models import db, Tag, ContentWarning, License, LuantiRelease, Language
+from app.rediscache import get_reference_data_version, subscribe_to_reference_data, has_reference_data_changed
+from app.utils.models import create_session
+
+
+# A process-local cache of tables that rarely change: tags, content warnings, licenses, Luanti
+# releases, and languages.
+#
+# The tables are loaded on first use. Committing a change to them publishes a new version using
+# Redis pub/sub (see app/rediscache.py), and each process checks its subscription without blocking
+# whenever the cache is used, reloading when a newer version was published.
+#
+# Cached objects aren't attached to a session. The getters merge them into `db.session` without
+# querying, so they can be used in queries and compared with other objects as normal.
+
+
+class ReferenceData:
+	version: int
+	tags: dict[str, Tag]
+	content_warnings: dict[str, ContentWarning]
+	licenses: dict[str, License]
+	luanti_releases: list[LuantiRelease]
+	language_ids: set[str]
+
+	def __init__(self, version: int):
+		self.version = version
+
+		session = create_session()
+		try:
+			self.tags = { x.name: x for x in session.query(Tag).all() }
+			self.content_warnings = { x.name: x for x in session.query(ContentWarning).all() }
+			self.licenses = { x.name.lower(): x for x in session.query(License).all() }
+			self.luanti_releases = session.query(LuantiRelease).order_by(db.asc(LuantiRelease.id)).all()
+			self.language_ids = set([x[0] for x in session.query(Language.id).all()])
+		finally:
+			session.close()
+
+
+_data: typing.Optional[ReferenceData] = None
+_subscription = None
+_pid: typing.Optional[int] = None
+
+
+def get_reference_data() -> ReferenceData:
+	global _data, _subscription, _pid
+
+	# Connections can't be shared with forked processes
+	if _pid != os.getpid():
+		_subscription = subscribe_to_reference_data()
+		_pid = os.getpid()
+		_data = None
+
+	if _data is not None and has_reference_data_changed(_subscription, _data.version):
+		_data = None
+
+	if _data is None:
+		_data = ReferenceData(get_reference_data_version())
+
+	return _data
+
+
+T = typing.TypeVar("T")
+
+
+def _attach(obj: typing.Optional[T]) -> typing.Optional[T]:
+	return None if obj is None else db.session.merge(obj, load=False)
+
+
+def get_tag(name: str) -> typing.Optional[Tag]:
+	return _attach(get_reference_data().tags.get(name))
+
+
+def get_content_warning(name: str) -> typing.Optional[ContentWarning]:
+	return _attach(get_reference_data().content_warnings.get(name))
+
+
+def get_license(name: str) -> typing.Optional[License]:
+	"""
+	Case-insensitive
+	"""
+	return _attach(get_reference_data().licenses.get(name.lower()))
+
+
+def get_license_names() -> list[str]:
+	return sorted([x.name for x in get_reference_data().licenses.values()])
+
+
+def get_language_ids() -> set[str]:
+	return get_reference_data().language_ids
+
+
+def find_luanti_release(releases: list[LuantiRelease], version: typing.Optional[str],
+		protocol_num: typing.Optional[int]) -> typing.Optional[LuantiRelease]:
+	"""
+	Same as `LuantiRelease.get`, using a list of releases instead of the database
+	"""
+	if version:
+		parts = version.strip().split(".")
+		if len(parts) >= 2:
+			name = "{}.{}".format(parts[0], parts[1])
+			matches = [x for x in releases if x.name.replace("-dev", "") == name and
+					(not protocol_num or x.protocol == int(protocol_num))]
+			if len(matches) == 1:
+				return matches[0]
+
+	if protocol_num:
+		# Find the closest matching release
+		matches = [x for x in releases if x.protocol <= int(protocol_num)]
+		if len(matches) > 0:
+			return max(matches, key=lambda x: (x.protocol, x.id))
+
+	return None
+
+
+def get_luanti_release(version: typing.Optional[str], protocol_num: typing.Optional[int]) -> typing.Optional[LuantiRelease]:
+	return _attach(find_luanti_release(get_reference_data().luanti_releases, version, protocol_num))
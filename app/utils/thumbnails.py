@@ -0,0 +1,171 @@
+# ContentDB
+# SPDX-License-Identifier: AGPL-3.0-or-later
+# Copyright (C) 2018-2025 rubenwardy <rw@rubenwardy>
+
+import os
+import secrets
+import sys
+from typing import Optional, Tuple
+
+from PIL import Image
+from redis.exceptions import LockError
+
+from app import app
+from app.rediscache import get_lock
+
+
+ALLOWED_RESOLUTIONS = [(100, 67), (270, 180), (350, 233), (1100, 520)]
+ALLOWED_MIMETYPES = {
+	"png": "image/png",
+	"webp": "image/webp",
+	"jpg": "image/jpeg",
+}
+
+
+def _split_ext(img: str) -> Tuple[str, str]:
+	period = img.rfind(".")
+	return img[:period], img[period + 1:]
+
+
+def resize_and_crop(img: Image.Image, size: Tuple[int, int]) -> Image.Image:
+	# Get current and desired ratio for the images
+	img_ratio = img.size[0] / float(img.size[1])
+	desired_ratio = size[0] / float(size[1])
+
+	# Is more portrait than target, scale and crop
+	if desired_ratio > img_ratio:
+		img = img.resize((int(size[0]), int(size[0] * img.size[1] / img.size[0])),
+				Image.BICUBIC)
+		box = (0, (img.size[1] - size[1]) / 2, img.size[0], (img.size[1] + size[1]) / 2)
+		return img.crop(box)
+
+	# Is more landscape than target, scale and crop
+	elif desired_ratio < img_ratio:
+		img = img.resize((int(size[1] * img.size[0] / img.size[1]), int(size[1])),
+				Image.BICUBIC)
+		box = ((img.size[0] - size[0]) / 2, 0, (img.size[0] + size[0]) / 2, img.size[1])
+		return img.crop(box)
+
+	# Is exactly the same ratio as target
+	else:
+		return img.resize(size, Image.BICUBIC)
+
+
+def save_atomic(img: Image.Image, path: str):
+	"""
+	Saves an image so that other processes never see a partially written file
+	"""
+	_, ext = _split_ext(path)
+	if ext == "jpg" and img.mode != "RGB":
+		img = img.convert("RGB")
+
+	os.makedirs(os.path.dirname(path), exist_ok=True)
+
+	# Random suffix, as threads in the same process may save the same thumbnail. Not using tempfile.mkstemp,
+	# as it creates files only readable by the owner
+	temp_path = f"{path}.{os.getpid()}.{secrets.token_hex(8)}.tmp"
+	try:
+		img.save(temp_path, format=Image.registered_extensions()["." + ext], lossless=True)
+		os.replace(temp_path, path)
+	finally:
+		if os.path.isfile(temp_path):
+			os.remove(temp_path)
+
+
+def find_source_file(img: str) -> Optional[str]:
+	"""
+	Finds the upload for a thumbnail, which may have a different file extension
+	"""
+	upload_dir = app.config["UPLOAD_DIR"]
+	source_filepath = os.path.join(upload_dir, img)
+	if os.path.isfile(source_filepath):
+		return source_filepath
+
+	start, ext = _split_ext(source_filepath)
+	if ext not in ALLOWED_MIMETYPES:
+		return None
+
+	for other_ext in ALLOWED_MIMETYPES.keys():
+		other_path = f"{start}.{other_ext}"
+		if ext != other_ext and os.path.isfile(other_path):
+			return other_path
+
+	return None
+
+
+def get_thumbnail_path(level: int, img: str) -> str:
+	return os.path.join(app.config["THUMBNAIL_DIR"], str(level), img)
+
+
+# Maximum time a request waits for another process to create the same thumbnail, in seconds
+LOCK_WAIT_TIME = 5
+
+
+def _get_lock(level: int, img: str, blocking_timeout: Optional[float] = None):
+	# One lock per thumbnail file, so creating one doesn't wait for the others
+	return get_lock(f"thumbnails/{level}/{img}", 60, blocking_timeout)
+
+
+def get_or_create_thumbnail(level: int, img: str) -> Optional[str]:
+	"""
+	Returns the path to a thumbnail, creating it if needed.
+	Returns None if there's no upload for the thumbnail.
+
+	:param level: 1-indexed, into ALLOWED_RESOLUTIONS
+	:param img: filename, the extension is the format of the thumbnail
+	"""
+	cache_filepath = get_thumbnail_path(level, img)
+	if os.path.isfile(cache_filepath):
+		return cache_filepath
+
+	def create():
+		if os.path.isfile(cache_filepath):
+			return cache_filepath
+
+		source_filepath = find_source_file(img)
+		if source_filepath is None:
+			return None
+
+		with Image.open(source_filepath) as source:
+			save_atomic(resize_and_crop(source, ALLOWED_RESOLUTIONS[level - 1]), cache_filepath)
+
+		return cache_filepath
+
+	try:
+		with _get_lock(level, img, LOCK_WAIT_TIME):
+			return create()
+	except LockError:
+		print(f"Unable to lock thumbnails for {img}", file=sys.stderr)
+		return create()
+
+
+def create_all_thumbnails(img: str) -> int:
+	"""
+	Creates thumbnails of an upload in all resolutions and formats, returning the number created
+	"""
+	start, _ = _split_ext(img)
+	source_filepath = find_source_file(img)
+	if source_filepath is None:
+		return 0
+
+	created = 0
+	with Image.open(source_filepath) as source:
+		for i, size in enumerate(ALLOWED_RESOLUTIONS):
+			resized = None
+			for ext in ALLOWED_MIMETYPES.keys():
+				thumbnail = f"{start}.{ext}"
+				cache_filepath = get_thumbnail_path(i + 1, thumbnail)
+				if os.path.isfile(cache_filepath):
+					continue
+
+				with _get_lock(i + 1, thumbnail):
+					if os.path.isfile(cache_filepath):
+						continue
+
+					if resized is None:
+						resized = resize_and_crop(source, size)
+
+					save_atomic(resized, cache_filepath)
+					created += 1
+
+	return created
@@ -0,0 +1,261 @@
+# ContentDB
+# SPDX-License-Identifier: AGPL-3.0-or-later
+# Copyright (C) 2018-2025 rubenwardy <rw@rubenwardy>
+
+import io
+import re
+import sqlite3
+import subprocess
+import sys
+import time
+import zipfile
+import zlib
+from contextlib import closing
+from fnmatch import fnmatchcase
+from typing import Iterator, Optional, Tuple, List
+
+
+def compile_query(query: str, literal: bool) -> re.Pattern:
+	if literal:
+		query = re.escape(query)
+
+	return re.compile(query)
+
+
+def _iter_text_lines(zf: zipfile.ZipFile, file_filter: str = "*") -> Iterator[Tuple[str, str]]:
+	"""
+	Yields (filename, line) for each line in the text files of an archive.
+	Files with a NUL byte near the start are treated as binary and skipped.
+	"""
+	for info in zf.infolist():
+		if info.is_dir() or not fnmatchcase(info.filename, file_filter):
+			continue
+
+		with zf.open(info) as f:
+			if b"\0" in f.peek(8192)[:8192]:
+				continue
+
+			for line in io.TextIOWrapper(f, encoding="utf-8", errors="replace"):
+				yield info.filename, line.rstrip("\r\n")
+
+
+def search_archive(path: str, query: str, literal: bool, file_filter: str, time_budget: float) -> str:
+	"""
+	Searches the text files in a zip archive, returning matching lines as `file:line`,
+	in the same format as zipgrep.
+
+	`file_filter` is a wildcard matched against the path of each file in the archive.
+	Returns "Error: timeout" if the search takes longer than `time_budget` seconds.
+	"""
+	deadline = time.monotonic() + time_budget
+	pattern = compile_query(query, literal)
+	ret = []
+
+	try:
+		with zipfile.ZipFile(path, "r") as zf:
+			for filename, line in _iter_text_lines(zf, file_filter):
+				if pattern.search(line):
+					ret.append(f"{filename}:{line.rstrip()}")
+
+				if time.monotonic() > deadline:
+					return "Error: timeout"
+	except (OSError, zipfile.BadZipFile, EOFError, zlib.error, RuntimeError, NotImplementedError) as e:
+		# RuntimeError is raised for encrypted files, and NotImplementedError for unsupported compression
+		return f"Error: {e}"
+
+	return "\n".join(ret)
+
+
+def search_archive_in_subprocess(path: str, query: str, literal: bool, file_filter: str, time_budget: float) -> str:
+	"""
+	Runs `search_archive` in a new process, which is killed after `time_budget` seconds.
+
+	The deadline in `search_archive` is only checked between lines, and a regex with catastrophic
+	backtracking can't be interrupted.
+	"""
+	args = [sys.executable, "-I", __file__, path, query, "1" if literal else "0", file_filter, str(time_budget)]
+	try:
+		res = subprocess.run(args, capture_output=True, encoding="utf-8", errors="replace", timeout=time_budget)
+	except subprocess.TimeoutExpired:
+		return "Error: timeout"
+
+	if res.returncode != 0:
+		return f"Error: exit code {res.returncode}"
+
+	return res.stdout
+
+
+def get_trigrams(text: str) -> set[str]:
+	return set([text[i:i + 3] for i in range(len(text) - 2)])
+
+
+def _skip_escape(query: str, i: int) -> int:
+	"""
+	Returns the index of the last character of the escape whose letter or digit is at i
+	"""
+	c = query[i] if i < len(query) else ""
+	if c in _HEX_ESCAPE_LENGTHS:
+		return min(i + _HEX_ESCAPE_LENGTHS[c], len(query) - 1)
+	elif c == "N" and query[i + 1:i + 2] == "{":
+		end = query.find("}", i)
+		return end if end != -1 else len(query) - 1
+	elif c.isdigit():
+		# Octal escapes have up to 3 digits, backreferences up to 2
+		end = i
+		while end + 1 < len(query) and end - i < 2 and query[end + 1].isdigit():
+			end += 1
+		return end
+
+	return i
+
+
+_HEX_ESCAPE_LENGTHS = { "x": 2, "u": 4, "U": 8 }
+
+
+def get_required_literals(query: str, literal: bool) -> List[str]:
+	"""
+	Returns strings that any line matching the query must contain.
+
+	For regexes, this is a conservative subset: only runs of plain characters outside of groups,
+	character classes and optional elements. Returns an empty list if nothing can be required.
+	"""
+	if literal:
+		return [query]
+
+	# Alternation and inline flags can make any literal optional or case-insensitive
+	if "|" in query or "(?" in query:
+		return []
+
+	ret = []
+	run = []
+	depth = 0
+
+	def flush():
+		if len(run) > 0:
+			ret.append("".join(run))
+			run.clear()
+
+	i = 0
+	while i < len(query):
+		c = query[i]
+		if c == "\\":
+			if i + 1 < len(query) and not query[i + 1].isalnum():
+				if depth == 0:
+					run.append(query[i + 1])
+				i += 1
+			else:
+				# Character class, escape sequence, or backreference
+				flush()
+				i = _skip_escape(query, i + 1)
+		elif c == "[":
+			flush()
+			i += 1
+			if i < len(query) and query[i] == "^":
+				i += 1
+			if i < len(query) and query[i] == "]":
+				i += 1
+			while i < len(query) and query[i] != "]":
+				if query[i] == "\\":
+					i += 1
+				i += 1
+		elif c == "(":
+			flush()
+			depth += 1
+		elif c == ")":
+			flush()
+			depth = max(depth - 1, 0)
+		elif c in "*?{":
+			# The previous character is optional
+			if len(run) > 0:
+				run.pop()
+			flush()
+			if c == "{":
+				while i < len(query) and query[i] != "}":
+					i += 1
+		elif c in "+.^$}":
+			flush()
+		elif depth == 0:
+			run.append(c)
+
+		i += 1
+
+	flush()
+	return [x for x in ret if len(x) >= 3]
+
+
+class ReleaseIndex:
+	"""
+	A trigram index of the text files in releases, stored in a local SQLite database.
+
+	Each package has at most one indexed release. Used to find the releases that may contain
+	a query, so that only those need to be searched.
+	"""
+
+	path: str
+
+	def __init__(self, path: str):
+		self.path = path
+
+	def _connect(self) -> sqlite3.Connection:
+		conn = sqlite3.connect(self.path, timeout=60)
+		conn.execute("PRAGMA journal_mode=WAL")
+		conn.execute("CREATE TABLE IF NOT EXISTS release (package_id INTEGER PRIMARY KEY, release_id INTEGER NOT NULL)")
+		conn.execute("CREATE TABLE IF NOT EXISTS trigram (trigram TEXT NOT NULL, package_id INTEGER NOT NULL, " +
+				"PRIMARY KEY (trigram, package_id)) WITHOUT ROWID")
+		conn.execute("CREATE INDEX IF NOT EXISTS trigram_package_id ON trigram (package_id)")
+		return conn
+
+	def get_indexed_releases(self) -> dict[int, int]:
+		"""
+		Returns a map from package id to indexed release id
+		"""
+		with closing(self._connect()) as conn:
+			return dict(conn.execute("SELECT package_id, release_id FROM release").fetchall())
+
+	def add(self, package_id: int, release_id: int, archive_path: str):
+		"""
+		Indexes a release, replacing any release previously indexed for the package.
+		"""
+		trigrams = set()
+		with zipfile.ZipFile(archive_path, "r") as zf:
+			for _, line in _iter_text_lines(zf):
+				trigrams.update(get_trigrams(line))
+
+		with closing(self._connect()) as conn, conn:
+			conn.execute("DELETE FROM trigram WHERE package_id = ?", (package_id,))
+			conn.executemany("INSERT INTO trigram (trigram, package_id) VALUES (?, ?)",
+					[(x, package_id) for x in trigrams])
+			conn.execute("INSERT OR REPLACE INTO release (package_id, release_id) VALUES (?, ?)",
+					(package_id, release_id))
+
+	def remove(self, package_id: int):
+		with closing(self._connect()) as conn, conn:
+			conn.execute("DELETE FROM trigram WHERE package_id = ?", (package_id,))
+			conn.execute("DELETE FROM release WHERE package_id = ?", (package_id,))
+
+	def get_candidates(self, query: str, literal: bool) -> Optional[set[int]]:
+		"""
+		Returns the ids of packages whose indexed release may match the query,
+		or None if the query can't be narrowed down using the index.
+		"""
+		trigrams = set()
+		for required in get_required_literals(query, literal):
+			trigrams.update(get_trigrams(required))
+
+		if len(trigrams) == 0:
+			return None
+
+		ret = None
+		with closing(self._connect()) as conn:
+			for trigram in trigrams:
+				package_ids = set([x[0] for x in
+						conn.execute("SELECT package_id FROM trigram WHERE trigram = ?", (trigram,)).fetchall()])
+				ret = package_ids if ret is None else ret.intersection(package_ids)
+				if len(ret) == 0:
+					break
+
+		return ret
+
+
+if __name__ == "__main__":
+	sys.stdout.write(search_archive(sys.argv[1], sys.argv[2], sys.argv[3] == "1", sys.argv[4], float(sys.argv[5])))
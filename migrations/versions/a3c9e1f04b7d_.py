@@ -0,0 +1,28 @@
+"""empty message
+
+Revision ID: a3c9e1f04b7d
+Revises: 4d1cf83c0c53
+Create Date: 2026-10-18 10:12:41.520417
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'a3c9e1f04b7d'
+down_revision = '4d1cf83c0c53'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+	op.create_table('stats_buffer_flush',
+		sa.Column('id', sa.String(length=32), nullable=False),
+		sa.Column('flushed_at', sa.DateTime(), nullable=False),
+		sa.PrimaryKeyConstraint('id')
+	)
+
+
+def downgrade():
+	op.drop_table('stats_buffer_flush')
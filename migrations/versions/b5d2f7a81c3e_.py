@@ -0,0 +1,77 @@
+"""empty message
+
+Revision ID: b5d2f7a81c3e
+Revises: c71e5b0d92af
+Create Date: 2026-10-18 23:41:12.520187
+
+"""
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy import text
+from sqlalchemy.dialects import postgresql
+
+
+# revision identifiers, used by Alembic.
+revision = 'b5d2f7a81c3e'
+down_revision = 'c71e5b0d92af'
+branch_labels = None
+depends_on = None
+
+
+# Same as app.domain.search.LANGUAGE_CONFIGS at the time of writing
+language_configs = {
+	"ar": "arabic", "ca": "catalan", "da": "danish", "de": "german", "el": "greek", "en": "english",
+	"es": "spanish", "eu": "basque", "fi": "finnish", "fr": "french", "ga": "irish", "hi": "hindi",
+	"hu": "hungarian", "hy": "armenian", "id": "indonesian", "it": "italian", "lt": "lithuanian",
+	"nb": "norwegian", "ne": "nepali", "nl": "dutch", "nn": "norwegian", "pt": "portuguese",
+	"ro": "romanian", "ru": "russian", "sr": "serbian", "sv": "swedish", "ta": "tamil", "tr": "turkish",
+	"yi": "yiddish",
+}
+
+
+def upgrade():
+	op.create_table('package_search_document',
+		sa.Column('package_id', sa.Integer(), nullable=False),
+		sa.Column('language_id', sa.String(length=10), nullable=False),
+		sa.Column('vector', postgresql.TSVECTOR(), nullable=False),
+		sa.ForeignKeyConstraint(['package_id'], ['package.id'], ondelete='CASCADE'),
+		sa.ForeignKeyConstraint(['language_id'], ['language.id'], ),
+		sa.PrimaryKeyConstraint('package_id', 'language_id')
+	)
+	op.create_index('ix_package_search_document_vector', 'package_search_document', ['vector'],
+			unique=False, postgresql_using='gin')
+
+	op.execute(text("""
+		INSERT INTO package_search_document (package_id, language_id, vector)
+		SELECT package.id, 'en',
+			setweight(to_tsvector('english', concat_ws(' ', package.title, package.name,
+				(SELECT string_agg(meta_package.name, ' ') FROM provides
+					JOIN meta_package ON meta_package.id = provides.metapackage_id
+					WHERE provides.package_id = package.id))), 'A') ||
+			setweight(to_tsvector('english', coalesce(package.short_desc, '')), 'B') ||
+			setweight(to_tsvector('english', coalesce(
+				(SELECT string_agg(tag.title, ' ') FROM tags
+					JOIN tag ON tag.id = tags.tag_id
+					WHERE tags.package_id = package.id), '')), 'C') ||
+			setweight(to_tsvector('english', coalesce(package."desc", '')), 'D')
+		FROM package
+	"""))
+
+	cases = " ".join([f"WHEN '{lang}' THEN '{config}'" for lang, config in language_configs.items()])
+	op.execute(text(f"""
+		INSERT INTO package_search_document (package_id, language_id, vector)
+		SELECT package_id, language_id,
+			setweight(to_tsvector(config, coalesce(title, '')), 'A') ||
+			setweight(to_tsvector(config, coalesce(short_desc, '')), 'B') ||
+			setweight(to_tsvector(config, coalesce("desc", '')), 'D')
+		FROM (
+			SELECT *, CAST(CASE split_part(language_id, '_', 1) {cases} ELSE 'simple' END AS regconfig) AS config
+			FROM package_translation
+			WHERE language_id != 'en'
+		) AS translations
+	"""))
+
+
+def downgrade():
+	op.drop_index('ix_package_search_document_vector', table_name='package_search_document', postgresql_using='gin')
+	op.drop_table('package_search_document')
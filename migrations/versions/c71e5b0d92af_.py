@@ -0,0 +1,70 @@
+"""empty message
+
+Revision ID: c71e5b0d92af
+Revises: a3c9e1f04b7d
+Create Date: 2026-10-18 21:08:26.184390
+
+"""
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy import text
+
+
+# revision identifiers, used by Alembic.
+revision = 'c71e5b0d92af'
+down_revision = 'a3c9e1f04b7d'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+	with op.batch_alter_table('package', schema=None) as batch_op:
+		batch_op.add_column(sa.Column('reviews_positive', sa.Integer(), nullable=False, server_default="0"))
+		batch_op.add_column(sa.Column('reviews_neutral', sa.Integer(), nullable=False, server_default="0"))
+		batch_op.add_column(sa.Column('reviews_negative', sa.Integer(), nullable=False, server_default="0"))
+
+	with op.batch_alter_table('package_review', schema=None) as batch_op:
+		batch_op.add_column(sa.Column('votes_helpful', sa.Integer(), nullable=False, server_default="0"))
+		batch_op.add_column(sa.Column('votes_unhelpful', sa.Integer(), nullable=False, server_default="0"))
+
+	op.execute(text("""
+		UPDATE package SET
+			reviews_positive = counts.positive,
+			reviews_neutral = counts.neutral,
+			reviews_negative = counts.negative
+		FROM (
+			SELECT package_id,
+				COUNT(*) FILTER (WHERE rating > 3) AS positive,
+				COUNT(*) FILTER (WHERE rating = 3) AS neutral,
+				COUNT(*) FILTER (WHERE rating < 3) AS negative
+			FROM package_review
+			WHERE approved
+			GROUP BY package_id
+		) AS counts
+		WHERE package.id = counts.package_id
+	"""))
+
+	op.execute(text("""
+		UPDATE package_review SET
+			votes_helpful = counts.helpful,
+			votes_unhelpful = counts.unhelpful
+		FROM (
+			SELECT review_id,
+				COUNT(*) FILTER (WHERE is_positive) AS helpful,
+				COUNT(*) FILTER (WHERE NOT is_positive) AS unhelpful
+			FROM package_review_vote
+			GROUP BY review_id
+		) AS counts
+		WHERE package_review.id = counts.review_id
+	"""))
+
+
+def downgrade():
+	with op.batch_alter_table('package_review', schema=None) as batch_op:
+		batch_op.drop_column('votes_unhelpful')
+		batch_op.drop_column('votes_helpful')
+
+	with op.batch_alter_table('package', schema=None) as batch_op:
+		batch_op.drop_column('reviews_negative')
+		batch_op.drop_column('reviews_neutral')
+		batch_op.drop_column('reviews_positive')
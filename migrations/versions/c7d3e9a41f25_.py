@@ -0,0 +1,28 @@
+"""empty message
+
+Revision ID: c7d3e9a41f25
+Revises: f4c9a2e6b7d1
+Create Date: 2026-10-18 23:12:41.285614
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c7d3e9a41f25'
+down_revision = 'f4c9a2e6b7d1'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+	with op.batch_alter_table('bulk_job', schema=None) as batch_op:
+		batch_op.add_column(sa.Column('lease_token', sa.String(length=36), nullable=True))
+		batch_op.add_column(sa.Column('lease_expires_at', sa.DateTime(), nullable=True))
+
+
+def downgrade():
+	with op.batch_alter_table('bulk_job', schema=None) as batch_op:
+		batch_op.drop_column('lease_expires_at')
+		batch_op.drop_column('lease_token')
@@ -0,0 +1,35 @@
+"""empty message
+
+Revision ID: d3a8e6f1b4c7
+Revises: b5d2f7a81c3e
+Create Date: 2026-10-18 12:14:37.118402
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'd3a8e6f1b4c7'
+down_revision = 'b5d2f7a81c3e'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+	op.create_index('ix_package_score_id', 'package', ['score', 'id'], unique=False)
+	op.create_index('ix_package_downloads_id', 'package', ['downloads', 'id'], unique=False)
+	op.create_index('ix_package_created_at_id', 'package', ['created_at', 'id'], unique=False)
+	op.create_index('ix_package_approved_at_id', 'package', [sa.text('coalesce(approved_at, created_at)'), 'id'],
+			unique=False)
+	op.create_index('ix_package_release_created_at_id', 'package_release', ['created_at', 'id'], unique=False)
+	op.create_index('ix_package_review_created_at_id', 'package_review', ['created_at', 'id'], unique=False)
+
+
+def downgrade():
+	op.drop_index('ix_package_review_created_at_id', table_name='package_review')
+	op.drop_index('ix_package_release_created_at_id', table_name='package_release')
+	op.drop_index('ix_package_approved_at_id', table_name='package')
+	op.drop_index('ix_package_created_at_id', table_name='package')
+	op.drop_index('ix_package_downloads_id', table_name='package')
+	op.drop_index('ix_package_score_id', table_name='package')
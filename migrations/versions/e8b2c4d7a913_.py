@@ -0,0 +1,52 @@
+"""empty message
+
+Revision ID: e8b2c4d7a913
+Revises: d3a8e6f1b4c7
+Create Date: 2026-10-18 15:02:51.730614
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e8b2c4d7a913'
+down_revision = 'd3a8e6f1b4c7'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+	op.create_table('bulk_job',
+		sa.Column('id', sa.String(length=36), nullable=False),
+		sa.Column('title', sa.String(length=100), nullable=False),
+		sa.Column('task_name', sa.String(length=100), nullable=False),
+		sa.Column('concurrency', sa.Integer(), nullable=False),
+		sa.Column('created_at', sa.DateTime(), nullable=False),
+		sa.Column('updated_at', sa.DateTime(), nullable=False),
+		sa.Column('finished_at', sa.DateTime(), nullable=True),
+		sa.Column('total', sa.Integer(), nullable=False),
+		sa.Column('succeeded', sa.Integer(), nullable=False),
+		sa.Column('failed', sa.Integer(), nullable=False),
+		sa.PrimaryKeyConstraint('id')
+	)
+	op.create_table('bulk_job_item',
+		sa.Column('id', sa.Integer(), nullable=False),
+		sa.Column('job_id', sa.String(length=36), nullable=False),
+		sa.Column('args', sa.JSON(), nullable=False),
+		sa.Column('state', sa.Enum('PENDING', 'RUNNING', 'SUCCESS', 'FAILURE', name='bulkjobitemstate'), nullable=False),
+		sa.Column('task_id', sa.String(length=36), nullable=True),
+		sa.Column('started_at', sa.DateTime(), nullable=True),
+		sa.Column('attempts', sa.Integer(), nullable=False),
+		sa.Column('error', sa.Text(), nullable=True),
+		sa.ForeignKeyConstraint(['job_id'], ['bulk_job.id'], ondelete='CASCADE'),
+		sa.PrimaryKeyConstraint('id')
+	)
+	op.create_index(op.f('ix_bulk_job_item_job_id'), 'bulk_job_item', ['job_id'], unique=False)
+
+
+def downgrade():
+	op.drop_index(op.f('ix_bulk_job_item_job_id'), table_name='bulk_job_item')
+	op.drop_table('bulk_job_item')
+	op.drop_table('bulk_job')
+	sa.Enum(name='bulkjobitemstate').drop(op.get_bind())
@@ -0,0 +1,46 @@
+"""empty message
+
+Revision ID: f4c9a2e6b7d1
+Revises: e8b2c4d7a913
+Create Date: 2026-10-18 17:26:03.448190
+
+"""
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy import text
+
+
+# revision identifiers, used by Alembic.
+revision = 'f4c9a2e6b7d1'
+down_revision = 'e8b2c4d7a913'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+	op.create_table('upload',
+		sa.Column('filename', sa.String(length=100), nullable=False),
+		sa.Column('digest', sa.String(length=64), nullable=True),
+		sa.Column('size', sa.BigInteger(), nullable=True),
+		sa.Column('ref_count', sa.Integer(), nullable=False),
+		sa.Column('created_at', sa.DateTime(), nullable=False),
+		sa.Column('updated_at', sa.DateTime(), nullable=False),
+		sa.PrimaryKeyConstraint('filename')
+	)
+
+	# Existing uploads aren't content-addressed, so they don't have a digest
+	op.execute(text("""
+		INSERT INTO upload (filename, ref_count, created_at, updated_at)
+		SELECT substring(url from 10), count(*), now() at time zone 'utc', now() at time zone 'utc'
+		FROM (
+			SELECT url FROM package_release WHERE url LIKE '/uploads/%'
+			UNION ALL SELECT url FROM package_screenshot WHERE url LIKE '/uploads/%'
+			UNION ALL SELECT url FROM report_attachment WHERE url LIKE '/uploads/%'
+			UNION ALL SELECT profile_pic FROM "user" WHERE profile_pic LIKE '/uploads/%'
+		) AS refs
+		GROUP BY url
+	"""))
+
+
+def downgrade():
+	op.drop_table('upload')
@@ -0,0 +1,140 @@
+# ContentDB
+# SPDX-License-Identifier: AGPL-3.0-or-later
+# Copyright (C) 2018-2025 rubenwardy <rw@rubenwardy>
+
+# Compares the latency of deep pages using OFFSET and cursor pagination over a synthetic catalog.
+#
+# Usage: python utils/benchmark_pagination.py [packages] [runs]
+#
+# The catalog is created in a transaction that is rolled back at the end, so existing data
+# isn't changed. This is intended for development databases, don't run it on production.
+
+import datetime
+import inspect
+import os
+import random
+import statistics
+import sys
+import time
+from urllib.parse import urlencode
+
+if not "FLASK_CONFIG" in os.environ:
+	os.environ["FLASK_CONFIG"] = "../config.cfg"
+
+# Allow finding the `app` module
+currentdir = os.path.dirname(os.path.abspath(inspect.getfile(inspect.currentframe())))
+parentdir = os.path.dirname(currentdir)
+sys.path.insert(0,parentdir)
+
+from flask import request
+from sqlalchemy import insert, text
+
+from app import app
+from app.models import db, User, UserRank, Package, PackageState, PackageType, License
+from app.querybuilder import QueryBuilder
+from app.utils.pagination import encode_cursor
+
+num_packages = int(sys.argv[1]) if len(sys.argv) > 1 else 50000
+runs = int(sys.argv[2]) if len(sys.argv) > 2 else 20
+per_page = 40
+
+rng = random.Random(42)
+
+SORTS = ["score", "downloads", "created_at", "approved_at"]
+
+
+def create_catalog():
+	license_ids = [x[0] for x in db.session.query(License.id).all()]
+	assert len(license_ids) > 0, "Licenses are missing, run the default data script"
+
+	user_ids = db.session.scalars(insert(User).returning(User.id), [{
+		"username": f"bench_user_{i}",
+		"display_name": f"Bench User {i}",
+		"rank": UserRank.MEMBER,
+	} for i in range(max(num_packages // 20, 1))]).all()
+
+	start = datetime.datetime(2018, 1, 1)
+	packages = []
+	for i in range(num_packages):
+		created_at = start + datetime.timedelta(minutes=rng.randint(0, 60 * 24 * 365 * 8))
+		license_id = rng.choice(license_ids)
+		packages.append({
+			"author_id": rng.choice(user_ids),
+			"name": f"bench_{i}",
+			"title": f"Bench {i}",
+			"short_desc": "Benchmark package",
+			"type": PackageType.MOD,
+			"state": PackageState.APPROVED,
+			"license_id": license_id,
+			"media_license_id": license_id,
+			"created_at": created_at,
+			"approved_at": created_at if rng.random() < 0.8 else None,
+			# Rounded so that many packages have the same score
+			"score": round(rng.expovariate(0.01)),
+			"downloads": int(rng.expovariate(0.001)),
+		})
+
+	return len(db.session.scalars(insert(Package).returning(Package.id), packages).all())
+
+
+def get_cursor(sort: str, page: int) -> str:
+	"""
+	Returns the cursor for a page, without walking through the pages before it
+	"""
+	with app.test_request_context("/packages/?" + urlencode({ "sort": sort })):
+		qb = QueryBuilder(request.args)
+		keys = qb.get_cursor_keys()
+		row = qb.build_package_query().with_entities(*keys).order_by(None) \
+			.order_by(*[db.desc(key) for key in keys]) \
+			.offset((page - 1) * per_page - 1).limit(1).one()
+		return encode_cursor(f"{sort}/desc", list(row))
+
+
+def run_offset(sort: str, page: int) -> int:
+	with app.test_request_context("/packages/?" + urlencode({ "sort": sort })):
+		qb = QueryBuilder(request.args)
+		return len(qb.build_package_query().paginate(page=page, per_page=per_page, count=False).items)
+
+
+def run_cursor(sort: str, cursor: str) -> int:
+	with app.test_request_context("/packages/?" + urlencode({ "sort": sort })):
+		qb = QueryBuilder(request.args)
+		return len(qb.paginate_by_cursor(qb.build_package_query(), cursor, per_page, count=False).items)
+
+
+def measure(func, *args) -> tuple[float, float]:
+	timings = []
+	for _ in range(runs):
+		start = time.perf_counter()
+		assert func(*args) == per_page
+		timings.append((time.perf_counter() - start) * 1000)
+
+	timings.sort()
+	return statistics.median(timings), timings[min(len(timings) - 1, int(len(timings) * 0.95))]
+
+
+def benchmark():
+	start = time.monotonic()
+	packages = create_catalog()
+	print(f"Created {packages} packages in {time.monotonic() - start:.1f}s")
+
+	db.session.execute(text("ANALYZE package"))
+
+	total = Package.query.filter_by(state=PackageState.APPROVED).count()
+	pages = [1, 10, 100] + [x for x in [total // per_page // 2, total // per_page] if x > 100]
+
+	print()
+	print(f"{'sort':<12} {'page':>6} {'offset ms':>10} {'p95':>7} {'cursor ms':>10} {'p95':>7}")
+	for sort in SORTS:
+		for page in pages:
+			offset_median, offset_p95 = measure(run_offset, sort, page)
+			cursor = get_cursor(sort, page) if page > 1 else ""
+			cursor_median, cursor_p95 = measure(run_cursor, sort, cursor)
+			print(f"{sort:<12} {page:>6} {offset_median:>10.1f} {offset_p95:>7.1f} {cursor_median:>10.1f} {cursor_p95:>7.1f}")
+
+
+with app.app_context():
+	try:
+		benchmark()
+	finally:
+		db.session.rollback()
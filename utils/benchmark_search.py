@@ -0,0 +1,196 @@
+# ContentDB
+# SPDX-License-Identifier: AGPL-3.0-or-later
+# Copyright (C) 2018-2025 rubenwardy <rw@rubenwardy>
+
+# Benchmarks package search and facets over a synthetic catalog.
+#
+# Usage: python utils/benchmark_search.py [packages] [runs]
+#
+# The catalog is created in a transaction that is rolled back at the end, so existing data
+# isn't changed. This is intended for development databases, don't run it on production.
+
+import inspect
+import os
+import random
+import statistics
+import sys
+import time
+from urllib.parse import urlencode
+
+if not "FLASK_CONFIG" in os.environ:
+	os.environ["FLASK_CONFIG"] = "../config.cfg"
+
+# Allow finding the `app` module
+currentdir = os.path.dirname(os.path.abspath(inspect.getfile(inspect.currentframe())))
+parentdir = os.path.dirname(currentdir)
+sys.path.insert(0,parentdir)
+
+from flask import request
+from sqlalchemy import insert, text
+
+from app import app
+from app.domain.search import update_search_index, get_package_facets
+from app.models import db, User, UserRank, Package, PackageState, PackageType, License, Tag, Tags, ContentWarning, \
+	ContentWarnings, MetaPackage, PackageProvides, PackageTranslation, Language
+from app.querybuilder import QueryBuilder
+
+num_packages = int(sys.argv[1]) if len(sys.argv) > 1 else 50000
+runs = int(sys.argv[2]) if len(sys.argv) > 2 else 20
+
+rng = random.Random(42)
+
+WORDS = [
+	"adventure", "animals", "armor", "automation", "biome", "blocks", "boats", "building", "castle", "cave",
+	"chest", "circuits", "city", "cooking", "crafting", "creatures", "decoration", "dungeon", "electric",
+	"farming", "fishing", "flowers", "food", "forest", "furniture", "garden", "hunger", "island", "kitchen",
+	"lamps", "magic", "mapgen", "mining", "mobs", "monsters", "mountains", "music", "nether", "ocean", "ores",
+	"pipes", "plants", "potions", "quests", "rails", "roads", "ruins", "shops", "signs", "skins", "sky",
+	"space", "survival", "swords", "technic", "textures", "tools", "trains", "trees", "villages", "weather",
+	"wizards", "wool", "world", "zombies",
+]
+
+TRANSLATED_WORDS = {
+	"de": ["abenteuer", "tiere", "rüstung", "bauen", "burg", "höhle", "truhe", "kochen", "wald", "möbel"],
+	"fr": ["aventure", "animaux", "armure", "construction", "château", "grotte", "coffre", "cuisine", "forêt"],
+	"es": ["aventura", "animales", "armadura", "construcción", "castillo", "cueva", "cofre", "cocina", "bosque"],
+}
+
+# label, query arguments, language
+CASES = [
+	("browse", {}, "en"),
+	("browse tag", {"tag": "__tag__"}, "en"),
+	("one word", {"q": "castle"}, "en"),
+	("prefix", {"q": "furn"}, "en"),
+	("two words", {"q": "magic swords"}, "en"),
+	("phrase", {"q": "\"magic swords\""}, "en"),
+	("excluded word", {"q": "mobs -zombies"}, "en"),
+	("no results", {"q": "qwertyuiop"}, "en"),
+	("modname", {"q": "bench_123"}, "en"),
+	("word and tag", {"q": "castle", "tag": "__tag__"}, "en"),
+	("word and type", {"q": "adventure", "type": "game"}, "en"),
+	("word, sorted", {"q": "castle", "sort": "downloads"}, "en"),
+	("translated", {"q": "burg"}, "de"),
+	("english in de", {"q": "castle"}, "de"),
+]
+
+
+def sentence(words: list[str], length: int) -> str:
+	return " ".join(rng.choice(words) for _ in range(length))
+
+
+def ensure_languages():
+	for lang_id, title in [("de", "Deutsch"), ("fr", "Français"), ("es", "Español")]:
+		if db.session.get(Language, lang_id) is None:
+			db.session.add(Language(id=lang_id, title=title))
+	db.session.flush()
+
+
+def create_catalog():
+	ensure_languages()
+
+	license_ids = [x[0] for x in db.session.query(License.id).all()]
+	tag_ids = [x[0] for x in db.session.query(Tag.id).all()]
+	warning_ids = [x[0] for x in db.session.query(ContentWarning.id).all()]
+	assert len(license_ids) > 0, "Licenses are missing, run the default data script"
+
+	user_ids = db.session.scalars(insert(User).returning(User.id), [{
+		"username": f"bench_user_{i}",
+		"display_name": f"Bench User {i}",
+		"rank": UserRank.MEMBER,
+	} for i in range(max(num_packages // 20, 1))]).all()
+
+	packages = []
+	for i in range(num_packages):
+		package_type = rng.choices([PackageType.MOD, PackageType.GAME, PackageType.TXP], [85, 8, 7])[0]
+		license_id = rng.choice(license_ids)
+		packages.append({
+			"author_id": rng.choice(user_ids),
+			"name": f"bench_{i}",
+			"title": sentence(WORDS, rng.randint(1, 3)).title(),
+			"short_desc": sentence(WORDS, rng.randint(6, 15)),
+			"desc": sentence(WORDS, rng.randint(20, 120)),
+			"type": package_type,
+			"state": PackageState.APPROVED if rng.random() < 0.9 else PackageState.WIP,
+			"license_id": license_id,
+			"media_license_id": license_id if package_type == PackageType.TXP else rng.choice(license_ids),
+			"score": rng.expovariate(0.01),
+			"downloads": int(rng.expovariate(0.001)),
+		})
+	package_ids = db.session.scalars(insert(Package).returning(Package.id), packages).all()
+
+	tags = [{ "package_id": package_id, "tag_id": tag_id }
+			for package_id in package_ids for tag_id in rng.sample(tag_ids, min(len(tag_ids), rng.randint(0, 4)))]
+	if tags:
+		db.session.execute(insert(Tags), tags)
+
+	warnings = [{ "package_id": package_id, "content_warning_id": rng.choice(warning_ids) }
+			for package_id in package_ids if warning_ids and rng.random() < 0.05]
+	if warnings:
+		db.session.execute(insert(ContentWarnings), warnings)
+
+	metapackage_ids = db.session.scalars(insert(MetaPackage).returning(MetaPackage.id),
+			[{ "name": f"bench_{i}" } for i in range(num_packages)]).all()
+	db.session.execute(insert(PackageProvides), [{ "package_id": package_id, "metapackage_id": metapackage_id }
+			for package_id, metapackage_id in zip(package_ids, metapackage_ids)])
+
+	translations = []
+	for package_id in package_ids:
+		if rng.random() < 0.1:
+			lang = rng.choice(list(TRANSLATED_WORDS.keys()))
+			translations.append({
+				"package_id": package_id,
+				"language_id": lang,
+				"title": sentence(TRANSLATED_WORDS[lang], 2).title(),
+				"short_desc": sentence(TRANSLATED_WORDS[lang], 10),
+			})
+	if translations:
+		db.session.execute(insert(PackageTranslation), translations)
+
+	return len(package_ids), len(translations)
+
+
+def run_case(args: dict, lang: str) -> tuple[int, int]:
+	with app.test_request_context("/packages/?" + urlencode(args)):
+		qb = QueryBuilder(request.args, lang=lang)
+		pagination = qb.build_package_query().paginate(page=1, per_page=40)
+		facets = get_package_facets(qb.build_facet_query())
+		return pagination.total, len(facets["tags"])
+
+
+def benchmark():
+	start = time.monotonic()
+	packages, translations = create_catalog()
+	print(f"Created {packages} packages and {translations} translations in {time.monotonic() - start:.1f}s")
+
+	start = time.monotonic()
+	documents = update_search_index(db.session)
+	print(f"Indexed {documents} documents in {time.monotonic() - start:.1f}s")
+
+	db.session.execute(text("ANALYZE package, package_search_document, tags, content_warnings, provides"))
+
+	tag = db.session.query(Tag.name).order_by(Tag.id).first()
+
+	print()
+	print(f"{'case':<16} {'results':>8} {'tags':>5} {'median ms':>10} {'p95 ms':>8}")
+	for label, args, lang in CASES:
+		if "tag" in args:
+			if tag is None:
+				continue
+			args = dict(args, tag=tag[0])
+
+		timings = []
+		for _ in range(runs):
+			start = time.perf_counter()
+			total, tags = run_case(args, lang)
+			timings.append((time.perf_counter() - start) * 1000)
+
+		timings.sort()
+		p95 = timings[min(len(timings) - 1, int(len(timings) * 0.95))]
+		print(f"{label:<16} {total:>8} {tags:>5} {statistics.median(timings):>10.1f} {p95:>8.1f}")
+
+
+with app.app_context():
+	try:
+		benchmark()
+	finally:
+		db.session.rollback()